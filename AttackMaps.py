@@ -0,0 +1,182 @@
+import Instrumentation
+import MoveTables
+
+
+"""
+Attack maps for the mailbox backend, kept up to date by Game.make_move and Game.undo.
+
+For every occupied square the map holds the squares its piece attacks, as a 64-bit integer
+(square = row * 8 + column); OR-ing them over one color gives that side's attack map. A move
+only changes a few squares, so only the pieces standing on them and the sliders whose rays pass
+through them are recomputed, and undo puts the saved values back. King safety, checks, pins and
+castling paths are then answered from the maps instead of scanning rays out from the king.
+"""
+
+
+SLIDER_DIRECTIONS = {'R': MoveTables.ROOK_DIRECTIONS, 'B': MoveTables.BISHOP_DIRECTIONS,
+                     'Q': MoveTables.DIRECTIONS}
+
+
+"""
+Squares attacked by the piece on (row, column), stopping each ray at the first occupied square
+"""
+
+
+def piece_attacks(board, row, column):
+    piece = board[row][column]
+    piece_type = piece[1]
+    square = row * 8 + column
+    attacks = 0
+    if piece_type == 'P':
+        targets = MoveTables.PAWN_ATTACKS[piece[0]][square]
+    elif piece_type == 'N':
+        targets = MoveTables.KNIGHT_TARGETS[square]
+    elif piece_type == 'K':
+        targets = MoveTables.KING_TARGETS[square]
+    else:
+        rays = MoveTables.RAYS[square]
+        for direction in SLIDER_DIRECTIONS[piece_type]:
+            for end_row, end_column in rays[direction]:
+                attacks |= 1 << (end_row * 8 + end_column)
+                if board[end_row][end_column] != "--":
+                    break
+        return attacks
+    for end_row, end_column in targets:
+        attacks |= 1 << (end_row * 8 + end_column)
+    return attacks
+
+
+def sign(value):
+    return (value > 0) - (value < 0)
+
+
+class AttackMaps:
+    __slots__ = ("attacks", "pieces", "sliders", "history")
+
+    def __init__(self, board):
+        MoveTables.init_tables()
+        self.rebuild(board)
+
+    """
+    Recompute every map from the board
+    """
+    def rebuild(self, board):
+        self.attacks = [0] * 64  # squares attacked by the piece on each square
+        self.pieces = {'w': set(), 'b': set()}  # occupied squares per color
+        self.sliders = set()  # squares holding a bishop, rook or queen of either color
+        self.history = []  # per move, a flat list of the square, attacks, square, attacks... it overwrote
+        self.update(board, [divmod(square, 8) for square in range(64)])
+        self.history = []
+
+    """
+    The board changed on the given (row, column) squares: recompute the pieces standing there and
+    every slider whose attacks reached one of them. The old values are kept for restore.
+    """
+    @Instrumentation.probe()
+    def update(self, board, squares):
+        changed = 0
+        for row, column in squares:
+            changed |= 1 << (row * 8 + column)
+        attacks = self.attacks
+        affected = [square for square in self.sliders if attacks[square] & changed]
+        self.place(board, squares)
+        saved = []
+        for row, column in squares:
+            square = row * 8 + column
+            saved.append(square)
+            saved.append(attacks[square])
+            attacks[square] = piece_attacks(board, row, column) if board[row][column] != "--" else 0
+        for square in affected:
+            if not changed >> square & 1:
+                saved.append(square)
+                saved.append(attacks[square])
+                attacks[square] = piece_attacks(board, square >> 3, square & 7)
+        self.history.append(saved)
+
+    """
+    Take back the last update, once the board is back to what it was before it
+    """
+    @Instrumentation.probe()
+    def restore(self, board, squares):
+        attacks = self.attacks
+        saved = self.history.pop()
+        for index in range(0, len(saved), 2):
+            attacks[saved[index]] = saved[index + 1]
+        self.place(board, squares)
+
+    """
+    Bring the piece and slider sets up to date for the given squares
+    """
+    def place(self, board, squares):
+        pieces = self.pieces
+        sliders = self.sliders
+        for row, column in squares:
+            square = row * 8 + column
+            piece = board[row][column]
+            pieces['w'].discard(square)
+            pieces['b'].discard(square)
+            sliders.discard(square)
+            if piece != "--":
+                pieces[piece[0]].add(square)
+                if piece[1] in SLIDER_DIRECTIONS:
+                    sliders.add(square)
+
+    """
+    Every square the color attacks, as a 64-bit integer
+    """
+    def attacked_squares(self, color):
+        attacks = self.attacks
+        attacked = 0
+        for square in self.pieces[color]:
+            attacked |= attacks[square]
+        return attacked
+
+    """
+    Squares of the color's pieces that attack (row, column)
+    """
+    def attackers(self, row, column, color):
+        bit = 1 << (row * 8 + column)
+        attacks = self.attacks
+        return [square for square in self.pieces[color] if attacks[square] & bit]
+
+    """
+    Pins and checks against the king on (king_row, king_column), read off the attack maps:
+    (in_check, pins, checks), with pins and checks as (row, column, d_row, d_column) and the
+    direction pointing away from the king
+    """
+    @Instrumentation.probe("check_scans")
+    def pins_and_checks(self, board, king_row, king_column, ally_color, enemy_color):
+        checks = []
+        for square in self.attackers(king_row, king_column, enemy_color):
+            row, column = divmod(square, 8)
+            if board[row][column][1] == 'N':
+                checks.append((row, column, row - king_row, column - king_column))
+            else:
+                checks.append((row, column, sign(row - king_row), sign(column - king_column)))
+
+        # a pin needs an enemy slider on a line through the king with exactly one of our pieces between
+        pins = []
+        enemy_pieces = self.pieces[enemy_color]
+        for square in self.sliders:
+            if square not in enemy_pieces:
+                continue
+            row, column = divmod(square, 8)
+            d_row, d_column = row - king_row, column - king_column
+            if d_row == 0 or d_column == 0:
+                if board[row][column][1] == 'B':
+                    continue
+            elif abs(d_row) == abs(d_column):
+                if board[row][column][1] == 'R':
+                    continue
+            else:
+                continue
+            blocker = None
+            for end_row, end_column in MoveTables.BETWEEN[king_row * 8 + king_column][square]:
+                if board[end_row][end_column] != "--":
+                    if blocker is not None or board[end_row][end_column][0] != ally_color:
+                        break
+                    blocker = (end_row, end_column, sign(d_row), sign(d_column))
+            else:
+                if blocker is not None:
+                    pins.append(blocker)
+        return len(checks) > 0, pins, checks
@@ -0,0 +1,178 @@
+import argparse
+import concurrent.futures
+import itertools
+import sys
+import ChessEngine
+import Search
+
+
+"""
+Batch analysis of positions given as FEN strings. Results are streamed back in input order while
+later positions are still being read, so the input can be any iterable, e.g. an open file with
+millions of lines. Each worker process (or the calling process, with one worker) keeps a single
+Game and Searcher and loads every position into them with Game.load_fen. A FEN that does not load
+comes back paired with its ValueError instead of ending the stream.
+"""
+
+
+_game = None
+_searcher = None
+
+
+def init_worker(backend, tt_megabytes):
+    global _game, _searcher
+    _game = ChessEngine.Game(backend)
+    _searcher = Search.Searcher(tt_megabytes) if tt_megabytes else None
+
+
+"""
+Worker task: the legal moves of each FEN, as (fen, [coordinate notation, ...]) pairs, or
+(fen, ValueError) for a FEN that does not load
+"""
+
+
+def legal_moves_task(fens):
+    results = []
+    for fen in fens:
+        try:
+            _game.load_fen(fen)
+        except ValueError as error:
+            results.append((fen, error))
+            continue
+        results.append((fen, [move.get_chess_notation() for move in _game.get_valid_moves()]))
+    return results
+
+
+"""
+Worker task: search each FEN, as (fen, SearchResult) pairs, or (fen, ValueError) for a FEN that
+does not load
+"""
+
+
+def search_task(fens, depth, time_limit):
+    results = []
+    for fen in fens:
+        try:
+            _game.load_fen(fen)
+        except ValueError as error:
+            results.append((fen, error))
+            continue
+        results.append((fen, _searcher.search(_game, depth, time_limit)))
+    return results
+
+
+def chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean(fens):
+    return (fen for fen in (fen.strip() for fen in fens) if fen)
+
+
+"""
+Run task over the items in chunks, in worker processes set up by initializer(*initargs), and yield
+its results: in input order, or as each chunk finishes when ordered is False. At most two chunks
+per worker are in flight, so memory stays bounded however long the input is. With one worker
+everything runs in the calling process.
+"""
+
+
+def run_chunks(items, task, task_args, workers, chunk_size, initializer, initargs, ordered=True):
+    if workers <= 1:
+        initializer(*initargs)
+        for chunk in chunks(items, chunk_size):
+            yield from task(chunk, *task_args)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        pending = []
+        for chunk in chunks(items, chunk_size):
+            pending.append(pool.submit(task, chunk, *task_args))
+            if len(pending) < 2 * workers:
+                continue
+            if ordered:
+                yield from pending.pop(0).result()
+            else:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield from future.result()
+        if ordered:
+            for future in pending:
+                yield from future.result()
+        else:
+            for future in concurrent.futures.as_completed(pending):
+                yield from future.result()
+
+
+def analyse(fens, task, task_args=(), workers=1, chunk_size=64, backend="bitboard", tt_megabytes=0):
+    return run_chunks(clean(fens), task, task_args, workers, chunk_size, init_worker, (backend, tt_megabytes))
+
+
+"""
+Stream (fen, [legal moves in coordinate notation]) for every FEN, or (fen, ValueError) for one
+that does not load
+"""
+
+
+def legal_moves(fens, workers=1, chunk_size=64, backend="bitboard"):
+    return analyse(fens, legal_moves_task, (), workers, chunk_size, backend)
+
+
+"""
+Stream (fen, SearchResult) for every FEN, searched to depth plies and/or for time_limit seconds each,
+or (fen, ValueError) for one that does not load
+"""
+
+
+def search(fens, depth=None, time_limit=None, workers=1, chunk_size=4, backend="bitboard", tt_megabytes=16):
+    if depth is None and time_limit is None:
+        raise ValueError("search needs a depth limit or a time limit")
+    return analyse(fens, search_task, (depth, time_limit), workers, chunk_size, backend, tt_megabytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Legal moves or search results for a file of FEN positions")
+    parser.add_argument("file", nargs="?", help="one FEN per line (default: standard input)")
+    parser.add_argument("-s", "--search", action="store_true", help="search each position instead of listing moves")
+    parser.add_argument("-d", "--depth", type=int, help="search depth in plies (default 3 without -t)")
+    parser.add_argument("-t", "--time", type=float, help="search time per position in seconds")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="worker processes (default 1)")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    args = parser.parse_args(argv)
+
+    source = open(args.file) if args.file else sys.stdin
+    failed = 0
+    try:
+        if args.search:
+            depth = args.depth if args.depth is not None or args.time is not None else 3
+            for fen, result in search(source, depth, args.time, args.workers, backend=args.backend):
+                if isinstance(result, ValueError):
+                    failed += 1
+                    print(f"{fen}\tinvalid FEN: {result}", file=sys.stderr)
+                    continue
+                best = result.best_move.get_chess_notation() if result.best_move else "(none)"
+                print(f"{fen}\t{best}\t{result.score}\t{result.depth}\t{result.nodes}")
+        else:
+            for fen, moves in legal_moves(source, args.workers, backend=args.backend):
+                if isinstance(moves, ValueError):
+                    failed += 1
+                    print(f"{fen}\tinvalid FEN: {moves}", file=sys.stderr)
+                    continue
+                print(f"{fen}\t{' '.join(moves)}")
+    except ValueError as error:
+        print(f"BATCH FAILED: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if args.file:
+            source.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+import argparse
+import random
+import sys
+import time
+import numpy as np
+import ChessEngine
+import Evaluation
+import Fen
+import Search
+
+
+"""
+Evaluation of many positions at once with NumPy, for analysis jobs that score positions in bulk
+rather than inside a search.
+
+Boards are packed into a contiguous int8 array of shape (N, 64), one row per position, squares in
+Game.board order (a8 first). Pieces are coded 1-6 for white pawn, knight, bishop, rook, queen and
+king, the negatives for black and 0 for an empty square. evaluate_batch() scores the whole array
+with table lookups and reductions over the batch axis, with no Python loop over positions or
+squares.
+
+The material and piece-square terms are Evaluation's, so with pawn_structure_terms=False the
+scores equal Evaluation.evaluate_white exactly; otherwise evaluate_batch also subtracts penalties for
+doubled and isolated pawns.
+"""
+
+
+PIECE_CODES = {"--": 0, "wP": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bP": -1, "bN": -2, "bB": -3, "bR": -4, "bQ": -5, "bK": -6}
+PIECE_TYPES = "PNBRQK"  # piece type of codes 1-6
+DOUBLED_PAWN_PENALTY = 12  # per pawn beyond the first on a file
+ISOLATED_PAWN_PENALTY = 15  # per pawn with no friendly pawn on either neighbouring file
+
+
+"""
+Score tables indexed by (code + 6) * 64 + square: signed middlegame and endgame scores from white's
+side (material plus piece-square value), and the phase weight of every code + 6
+"""
+
+
+def build_tables():
+    middlegame = np.zeros(13 * 64, dtype=np.int32)
+    endgame = np.zeros(13 * 64, dtype=np.int32)
+    phase = np.zeros(13, dtype=np.int32)
+    for code in range(1, 7):
+        piece_type = PIECE_TYPES[code - 1]
+        value = Evaluation.PIECE_VALUES[piece_type]
+        phase[code + 6] = phase[-code + 6] = Evaluation.PHASE_WEIGHTS[piece_type]
+        for square in range(64):
+            row, column = divmod(square, 8)
+            for sign, table_row in ((1, row), (-1, 7 - row)):
+                index = (sign * code + 6) * 64 + square
+                middlegame[index] = sign * (value + Evaluation.MIDDLEGAME_TABLES[piece_type][table_row][column])
+                endgame[index] = sign * (value + Evaluation.ENDGAME_TABLES[piece_type][table_row][column])
+    return middlegame, endgame, phase
+
+
+MIDDLEGAME_SCORES, ENDGAME_SCORES, PHASE_SCORES = build_tables()
+SQUARE_OFFSETS = np.arange(64, dtype=np.intp)
+
+
+"""
+Pack positions into an (N, 64) int8 array
+"""
+
+
+def encode_board(board, out=None):
+    if out is None:
+        out = np.empty(64, dtype=np.int8)
+    out[:] = [PIECE_CODES[piece] for row in board for piece in row]
+    return out
+
+
+"""
+(boards, white_to_move) for Games or FEN strings: the (N, 64) board array and an (N,) bool array
+"""
+
+
+def from_games(games):
+    games = list(games)
+    boards = np.empty((len(games), 64), dtype=np.int8)
+    white_to_move = np.empty(len(games), dtype=bool)
+    for index, game_state in enumerate(games):
+        encode_board(game_state.board, boards[index])
+        white_to_move[index] = game_state.white_turn
+    return boards, white_to_move
+
+
+def from_fens(fens):
+    fens = list(fens)
+    boards = np.empty((len(fens), 64), dtype=np.int8)
+    white_to_move = np.empty(len(fens), dtype=bool)
+    for index, fen in enumerate(fens):
+        board, white_turn, *_ = Fen.parse_fen(fen)
+        encode_board(board, boards[index])
+        white_to_move[index] = white_turn
+    return boards, white_to_move
+
+
+"""
+Doubled and isolated pawn penalties for white minus those for black, per position
+"""
+
+
+def pawn_structure(boards):
+    penalties = np.zeros(len(boards), dtype=np.int32)
+    squares = boards.reshape(-1, 8, 8)
+    for code, sign in ((1, -1), (-1, 1)):
+        files = (squares == code).sum(axis=1, dtype=np.int32)  # (N, 8) pawns per file
+        occupied = files > 0
+        neighbours = np.zeros_like(occupied)
+        neighbours[:, 1:] |= occupied[:, :-1]
+        neighbours[:, :-1] |= occupied[:, 1:]
+        doubled = np.maximum(files - 1, 0).sum(axis=1)
+        isolated = np.where(neighbours, 0, files).sum(axis=1)
+        penalties += sign * (doubled * DOUBLED_PAWN_PENALTY + isolated * ISOLATED_PAWN_PENALTY)
+    return penalties
+
+
+"""
+Scores in centipawns for an (N, 64) board array, from white's side, or from the side to move's if
+white_to_move (an (N,) bool array) is given
+"""
+
+
+def evaluate_batch(boards, white_to_move=None, pawn_structure_terms=True):
+    boards = np.ascontiguousarray(boards, dtype=np.int8)
+    indices = (boards.astype(np.intp) + 6) * 64 + SQUARE_OFFSETS
+    middlegame = MIDDLEGAME_SCORES[indices].sum(axis=1, dtype=np.int64)
+    endgame = ENDGAME_SCORES[indices].sum(axis=1, dtype=np.int64)
+    phase = np.minimum(PHASE_SCORES[boards.astype(np.intp) + 6].sum(axis=1, dtype=np.int64), Evaluation.MAX_PHASE)
+    total = middlegame * phase + endgame * (Evaluation.MAX_PHASE - phase)
+    scores = np.where(total >= 0, total // Evaluation.MAX_PHASE, -(-total // Evaluation.MAX_PHASE))  # as taper()
+    if pawn_structure_terms:
+        scores += pawn_structure(boards)
+    if white_to_move is not None:
+        scores = np.where(white_to_move, scores, -scores)
+    return scores
+
+
+"""
+The same score for one Game.board with the per-square loops of Evaluation, for comparison
+"""
+
+
+def evaluate_scalar(board, pawn_structure_terms=True):
+    score = Evaluation.evaluate_white(board)
+    if pawn_structure_terms:
+        for color, sign in (('w', -1), ('b', 1)):
+            files = [sum(board[row][column] == color + 'P' for row in range(8)) for column in range(8)]
+            for column, count in enumerate(files):
+                if count > 1:
+                    score += sign * (count - 1) * DOUBLED_PAWN_PENALTY
+                if count and not (column > 0 and files[column - 1] or column < 7 and files[column + 1]):
+                    score += sign * count * ISOLATED_PAWN_PENALTY
+    return score
+
+
+"""
+Positions from random play along the benchmark games: each game's moves, then random legal moves
+"""
+
+
+def sample_positions(count, seed=1):
+    rng = random.Random(seed)
+    boards = []
+    while len(boards) < count:
+        for moves in Search.BENCHMARK_POSITIONS:
+            game_state = ChessEngine.Game("bitboard")
+            for notation in moves.split():
+                game_state.make_move(next(move for move in game_state.get_valid_moves()
+                                          if move.get_chess_notation() == notation))
+            for _ in range(rng.randrange(60)):
+                valid_moves = game_state.get_valid_moves()
+                if not valid_moves:
+                    break
+                game_state.make_move(rng.choice(valid_moves))
+                boards.append([row[:] for row in game_state.board])
+    return boards[:count]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare batch NumPy evaluation with the per-square evaluator")
+    parser.add_argument("-n", "--positions", type=int, default=2000, help="distinct positions (default 2000)")
+    parser.add_argument("-r", "--repeat", type=int, default=50, help="times the batch is tiled (default 50)")
+    parser.add_argument("--no-pawns", action="store_true", help="material and piece-square terms only")
+    args = parser.parse_args(argv)
+    pawn_terms = not args.no_pawns
+
+    boards = sample_positions(args.positions)
+    start = time.perf_counter()
+    scalar_scores = [evaluate_scalar(board, pawn_terms) for board in boards]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packed = np.stack([encode_board(board) for board in boards])
+    pack_seconds = time.perf_counter() - start
+    if not np.array_equal(evaluate_batch(packed, pawn_structure_terms=pawn_terms), scalar_scores):
+        print("batch and scalar scores differ")
+        return 1
+
+    batch = np.tile(packed, (args.repeat, 1))
+    start = time.perf_counter()
+    evaluate_batch(batch, pawn_structure_terms=pawn_terms)
+    batch_seconds = time.perf_counter() - start
+
+    print(f"scalar  {len(boards):>9} positions  {len(boards) / scalar_seconds:>12.0f} positions/s")
+    print(f"pack    {len(boards):>9} positions  {len(boards) / pack_seconds:>12.0f} positions/s")
+    print(f"batch   {len(batch):>9} positions  {len(batch) / batch_seconds:>12.0f} positions/s  "
+          f"({len(batch) / batch_seconds / (len(boards) / scalar_seconds):.0f}x scalar)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,560 @@
+import threading
+import ChessEngine
+import Instrumentation
+import MoveCache
+
+
+"""
+Bitboard move generation backend for ChessEngine.Game.
+
+Every piece type of each color is kept as a 64-bit integer with one bit per square, where
+square = row * 8 + column (row 0 is the 8th rank, as on Game.board). Sliding attacks are read
+from per-square tables indexed by the relevant blocker bits, which is what magic bitboards
+compute with a multiply and shift; in Python the dict lookup plays the role of the magic hash.
+
+The string board is still maintained by Game.make_move / Game.undo so the UI and Move objects
+keep working unchanged. Select the backend with ChessEngine.Game(backend="bitboard").
+"""
+
+
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+PIECE_NAMES = {'w': PIECES[:6], 'b': PIECES[6:]}
+
+KNIGHT_ATTACKS = []
+KING_ATTACKS = []
+PAWN_ATTACKS = {'w': [], 'b': []}
+ROOK_MASKS = []
+BISHOP_MASKS = []
+ROOK_ATTACKS = []  # per square: {blockers: attacks}
+BISHOP_ATTACKS = []
+NOT_FILE_A = 0xFEFEFEFEFEFEFEFE
+NOT_FILE_H = 0x7F7F7F7F7F7F7F7F
+PROMOTION_RANKS = 0xFF000000000000FF
+BETWEEN = []  # BETWEEN[a][b]: squares strictly between a and b on a shared line, else 0
+LINE = []  # LINE[a][b]: the full line through a and b, else 0
+TABLE_LOCK = threading.Lock()
+
+
+def square_bit(row, column):
+    return 1 << (row * 8 + column)
+
+
+def offsets_mask(square, offsets):
+    row, column = divmod(square, 8)
+    mask = 0
+    for d_row, d_column in offsets:
+        if 0 <= row + d_row < 8 and 0 <= column + d_column < 8:
+            mask |= square_bit(row + d_row, column + d_column)
+    return mask
+
+
+def ray_attacks(square, blockers, directions):
+    row, column = divmod(square, 8)
+    attacks = 0
+    for d_row, d_column in directions:
+        end_row = row + d_row
+        end_column = column + d_column
+        while 0 <= end_row < 8 and 0 <= end_column < 8:
+            bit = square_bit(end_row, end_column)
+            attacks |= bit
+            if blockers & bit:
+                break
+            end_row += d_row
+            end_column += d_column
+    return attacks
+
+
+"""
+Squares whose occupancy can change a slider's attacks: the rays without their last square
+"""
+
+
+def relevant_mask(square, directions):
+    row, column = divmod(square, 8)
+    mask = 0
+    for d_row, d_column in directions:
+        end_row = row + d_row
+        end_column = column + d_column
+        while 0 <= end_row + d_row < 8 and 0 <= end_column + d_column < 8:
+            mask |= square_bit(end_row, end_column)
+            end_row += d_row
+            end_column += d_column
+    return mask
+
+
+def attack_table(square, mask, directions):
+    table = {}
+    subset = 0
+    while True:  # enumerate every subset of the mask (carry-rippler)
+        table[subset] = ray_attacks(square, subset, directions)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return table
+
+
+"""
+Build all lookup tables. Called on the first BitboardGame so importing the module stays cheap.
+The tables are built in locals and filled in at the end, ROOK_ATTACKS last, so a thread that
+finds ROOK_ATTACKS filled never sees the others half built; threads arriving during the build wait
+for it.
+"""
+
+
+def init_tables():
+    if ROOK_ATTACKS:
+        return
+    with TABLE_LOCK:
+        if not ROOK_ATTACKS:
+            build_tables()
+
+
+def build_tables():
+    knight_attacks = []
+    king_attacks = []
+    pawn_attacks = {'w': [], 'b': []}
+    rook_masks = []
+    bishop_masks = []
+    rook_tables = []
+    bishop_tables = []
+    for square in range(64):
+        knight_attacks.append(offsets_mask(square, KNIGHT_OFFSETS))
+        king_attacks.append(offsets_mask(square, KING_OFFSETS))
+        pawn_attacks['w'].append(offsets_mask(square, ((-1, -1), (-1, 1))))
+        pawn_attacks['b'].append(offsets_mask(square, ((1, -1), (1, 1))))
+        rook_masks.append(relevant_mask(square, ROOK_DIRECTIONS))
+        bishop_masks.append(relevant_mask(square, BISHOP_DIRECTIONS))
+        rook_tables.append(attack_table(square, rook_masks[square], ROOK_DIRECTIONS))
+        bishop_tables.append(attack_table(square, bishop_masks[square], BISHOP_DIRECTIONS))
+
+    between_table = []
+    line_table = []
+    for a in range(64):
+        between_row = []
+        line_row = []
+        for b in range(64):
+            between, line = 0, 0
+            for directions in (ROOK_DIRECTIONS, BISHOP_DIRECTIONS):
+                if ray_attacks(a, 0, directions) & (1 << b):
+                    between = ray_attacks(a, 1 << b, directions) & ray_attacks(b, 1 << a, directions)
+                    line = (ray_attacks(a, 0, directions) & ray_attacks(b, 0, directions)) | (1 << a) | (1 << b)
+            between_row.append(between)
+            line_row.append(line)
+        between_table.append(between_row)
+        line_table.append(line_row)
+
+    KNIGHT_ATTACKS[:] = knight_attacks
+    KING_ATTACKS[:] = king_attacks
+    PAWN_ATTACKS['w'][:] = pawn_attacks['w']
+    PAWN_ATTACKS['b'][:] = pawn_attacks['b']
+    ROOK_MASKS[:] = rook_masks
+    BISHOP_MASKS[:] = bishop_masks
+    BISHOP_ATTACKS[:] = bishop_tables
+    BETWEEN[:] = between_table
+    LINE[:] = line_table
+    ROOK_ATTACKS[:] = rook_tables
+
+
+def rook_attacks(square, occupied):
+    return ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]]
+
+
+def bishop_attacks(square, occupied):
+    return BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]]
+
+
+class BitboardGame(ChessEngine.Game):
+    __slots__ = ("pieces", "occupied")
+
+    def __init__(self, backend="bitboard", move_cache_size=MoveCache.DEFAULT_SIZE, move_cache=None):
+        super().__init__(backend, move_cache_size, move_cache)
+        init_tables()
+        self.load_bitboards()
+
+    def __setstate__(self, state):
+        # unpickled copies (e.g. in worker processes) skip __init__, so the tables may not be built yet
+        init_tables()
+        super().__setstate__(state)
+
+    def load_fen(self, fen):
+        super().load_fen(fen)
+        self.load_bitboards()
+
+    """
+    Rebuild every bitboard from the string board
+    """
+    def load_bitboards(self):
+        self.pieces = {piece: 0 for piece in PIECES}
+        self.occupied = {'w': 0, 'b': 0}
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece != "--":
+                    self.pieces[piece] |= square_bit(row, column)
+                    self.occupied[piece[0]] |= square_bit(row, column)
+
+    @Instrumentation.probe()
+    def make_move(self, move):
+        super().make_move(move)
+        self.toggle_move(move)
+
+    @Instrumentation.probe()
+    def undo(self):
+        if len(self.move_log) != 0:
+            move = self.move_log[-1]
+            super().undo()
+            self.toggle_move(move)
+
+    """
+    Flip the bits a move changes. XOR is its own inverse, so the same call applies and takes back a move.
+    """
+    def toggle_move(self, move):
+        pieces = self.pieces
+        occupied = self.occupied
+        color = move.piece_moved[0]
+        start_bit = square_bit(move.start_row, move.start_column)
+        end_bit = square_bit(move.end_row, move.end_column)
+        pieces[move.piece_moved] ^= start_bit
+        pieces[color + move.promotion_piece if move.is_pawn_promotion else move.piece_moved] ^= end_bit
+        occupied[color] ^= start_bit | end_bit
+
+        if move.piece_captured != "--":
+            captured_bit = square_bit(move.start_row, move.end_column) if move.is_en_passant else end_bit
+            pieces[move.piece_captured] ^= captured_bit
+            occupied[move.piece_captured[0]] ^= captured_bit
+
+        if move.is_castling:
+            if move.end_column - move.start_column == 2:  # king side castle
+                rook_bits = square_bit(move.end_row, move.end_column + 1) | square_bit(move.end_row, move.end_column - 1)
+            else:  # Queen side castle
+                rook_bits = square_bit(move.end_row, move.end_column - 2) | square_bit(move.end_row, move.end_column + 1)
+            pieces[color + 'R'] ^= rook_bits
+            occupied[color] ^= rook_bits
+
+    """
+    All enemy pieces attacking square, given the occupancy
+    """
+    @Instrumentation.probe("check_scans")
+    def attackers_to(self, square, occupied, enemy_color):
+        pawn, knight, bishop, rook, queen, king = PIECE_NAMES[enemy_color]
+        pieces = self.pieces
+        queens = pieces[queen]
+        return (KNIGHT_ATTACKS[square] & pieces[knight]) | \
+               (PAWN_ATTACKS['b' if enemy_color == 'w' else 'w'][square] & pieces[pawn]) | \
+               (KING_ATTACKS[square] & pieces[king]) | \
+               (ROOK_ATTACKS[square][occupied & ROOK_MASKS[square]] & (pieces[rook] | queens)) | \
+               (BISHOP_ATTACKS[square][occupied & BISHOP_MASKS[square]] & (pieces[bishop] | queens))
+
+    """
+    All moves considering checks
+    """
+    @Instrumentation.probe("moves_generated", count=len)
+    def generate_valid_moves(self):
+        moves = []
+        board = self.board
+        legal, pawn_shifts = self.get_legal_targets(moves)
+        for square, targets in legal:
+            promotions = targets & PROMOTION_RANKS if board[square >> 3][square & 7][1] == 'P' else 0
+            add_target_moves(square, targets ^ promotions, board, moves)
+            add_target_moves(square, promotions, board, moves, promotion=True)
+        for shift, targets in pawn_shifts:
+            promotions = targets & PROMOTION_RANKS
+            add_shift_moves(shift, targets ^ promotions, board, moves)
+            add_shift_moves(shift, promotions, board, moves, promotion=True)
+        if len(moves) == 0 and self.player_is_in_check:
+            self.check_mate = True
+        elif len(moves) == 0 and not self.player_is_in_check:
+            self.stale_mate = True
+        return moves
+
+    """
+    Number of legal moves, counted from the target bitboards without building Move objects
+    """
+    @Instrumentation.probe()
+    def count_valid_moves(self):
+        special_moves = []
+        board = self.board
+        legal, pawn_shifts = self.get_legal_targets(special_moves)
+        count = len(special_moves)
+        for square, targets in legal:
+            count += targets.bit_count()
+            if board[square >> 3][square & 7][1] == 'P':  # a pinned pawn
+                count += 3 * (targets & PROMOTION_RANKS).bit_count()
+        for shift, targets in pawn_shifts:
+            count += targets.bit_count() + 3 * (targets & PROMOTION_RANKS).bit_count()
+        return count
+
+    """
+    The legal moves by stage, with Move objects built per stage from the target bitboards. Moves
+    cached for this position are split instead.
+    """
+    def move_stages(self):
+        entry = self.move_cache.probe(self.zobrist_key)
+        if entry is not None:
+            self.player_is_in_check = entry[1]
+            return ChessEngine.MoveStages(list(entry[0]))
+        return BitboardMoveStages(self)
+
+    """
+    Legal moves as (start square, bitboard of target squares) pairs, plus unpinned pawn moves as
+    (target - start, bitboard of target squares) pairs. Castling and en passant need extra flags
+    on the Move, so those are appended to special_moves directly.
+    """
+    @Instrumentation.probe()
+    def get_legal_targets(self, special_moves):
+        pieces = self.pieces
+        ally_color, enemy_color = ('w', 'b') if self.white_turn else ('b', 'w')
+        _, knight, bishop, rook, queen, king = PIECE_NAMES[ally_color]
+        _, _, enemy_bishop, enemy_rook, enemy_queen, _ = PIECE_NAMES[enemy_color]
+        own = self.occupied[ally_color]
+        enemy = self.occupied[enemy_color]
+        occupied = own | enemy
+        king_bit = pieces[king]
+        king_square = king_bit.bit_length() - 1
+        legal = []
+        pawn_shifts = []
+
+        checkers = self.attackers_to(king_square, occupied, enemy_color)
+        self.player_is_in_check = checkers != 0
+
+        # king moves: the king itself must not block the rays of the pieces attacking it
+        candidates = KING_ATTACKS[king_square] & ~own
+        without_king = occupied ^ king_bit
+        targets = 0
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            if not self.attackers_to(bit.bit_length() - 1, without_king, enemy_color):
+                targets |= bit
+        legal.append((king_square, targets))
+
+        if checkers & (checkers - 1):  # double check, only the king can move
+            return legal, pawn_shifts
+
+        if checkers:
+            target_mask = checkers | BETWEEN[king_square][checkers.bit_length() - 1]
+        else:
+            target_mask = ~own & 0xFFFFFFFFFFFFFFFF
+            self.get_castling_bitboard_moves(king_square, occupied, enemy_color, special_moves)
+
+        # pinned pieces may only move along the line through the king and the pinner
+        pin_lines = {}
+        pinned = 0
+        queens = pieces[enemy_queen]
+        snipers = (ROOK_ATTACKS[king_square][0] & (pieces[enemy_rook] | queens)) | \
+                  (BISHOP_ATTACKS[king_square][0] & (pieces[enemy_bishop] | queens))
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            blockers = BETWEEN[king_square][bit.bit_length() - 1] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pin_lines[blockers.bit_length() - 1] = LINE[king_square][bit.bit_length() - 1]
+                pinned |= blockers
+
+        remaining = pieces[knight] & ~pinned  # a pinned knight can never move
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            square = bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[square] & target_mask
+            if targets:
+                legal.append((square, targets))
+
+        # queens are visited twice, once for each kind of slide
+        for remaining, attack_table, masks in (
+                (pieces[bishop] | pieces[queen], BISHOP_ATTACKS, BISHOP_MASKS),
+                (pieces[rook] | pieces[queen], ROOK_ATTACKS, ROOK_MASKS)):
+            while remaining:
+                bit = remaining & -remaining
+                remaining ^= bit
+                square = bit.bit_length() - 1
+                targets = attack_table[square][occupied & masks[square]] & target_mask
+                if pinned & bit:
+                    targets &= pin_lines[square]
+                if targets:
+                    legal.append((square, targets))
+
+        self.get_pawn_bitboard_targets(ally_color, enemy_color, occupied, enemy, target_mask, pin_lines,
+                                       king_square, legal, pawn_shifts, special_moves)
+        return legal, pawn_shifts
+
+    def get_pawn_bitboard_targets(self, ally_color, enemy_color, occupied, enemy, target_mask, pin_lines,
+                                  king_square, legal, pawn_shifts, special_moves):
+        pawns = self.pieces[ally_color + 'P']
+        empty = ~occupied & 0xFFFFFFFFFFFFFFFF
+        step = -8 if ally_color == 'w' else 8
+        pawn_attacks = PAWN_ATTACKS[ally_color]
+
+        # pinned pawns one at a time, the rest set-wise
+        pinned = 0
+        for square in pin_lines:
+            bit = 1 << square
+            if pawns & bit:
+                pinned |= bit
+                push = 1 << (square + step) & empty
+                double = 1 << (square + 2 * step) & empty if push and square // 8 == (6 if step < 0 else 1) else 0
+                targets = ((pawn_attacks[square] & enemy) | push | double) & target_mask & pin_lines[square]
+                if targets:
+                    legal.append((square, targets))
+        pawns ^= pinned
+
+        # (to - from, target bitboard) pairs for the whole pawn set
+        if ally_color == 'w':
+            single = (pawns >> 8) & empty
+            pawn_shifts.append((-8, single & target_mask))
+            pawn_shifts.append((-16, ((single & 0x0000FF0000000000) >> 8) & empty & target_mask))
+            pawn_shifts.append((-9, ((pawns & NOT_FILE_A) >> 9) & enemy & target_mask))
+            pawn_shifts.append((-7, ((pawns & NOT_FILE_H) >> 7) & enemy & target_mask))
+        else:
+            single = (pawns << 8) & empty
+            pawn_shifts.append((8, single & target_mask))
+            pawn_shifts.append((16, ((single & 0x0000000000FF0000) << 8) & empty & target_mask))
+            pawn_shifts.append((7, ((pawns & NOT_FILE_A) << 7) & enemy & target_mask))
+            pawn_shifts.append((9, ((pawns & NOT_FILE_H) << 9) & enemy & target_mask))
+
+        # en passant, checked by removing both pawns and looking for an attack on the king
+        if self.en_passant_valid_square != ():
+            board = self.board
+            ep_row, ep_column = self.en_passant_valid_square
+            ep_square = ep_row * 8 + ep_column
+            captured_bit = 1 << (ep_square - step)
+            candidates = PAWN_ATTACKS[enemy_color][ep_square] & self.pieces[ally_color + 'P']
+            while candidates:
+                bit = candidates & -candidates
+                candidates ^= bit
+                after = (occupied ^ bit ^ captured_bit) | (1 << ep_square)
+                self.pieces[enemy_color + 'P'] ^= captured_bit
+                exposed = self.attackers_to(king_square, after, enemy_color)
+                self.pieces[enemy_color + 'P'] ^= captured_bit
+                if not exposed:
+                    special_moves.append(ChessEngine.Move(divmod(bit.bit_length() - 1, 8), (ep_row, ep_column),
+                                                          board, is_en_passant=True))
+
+    def get_castling_bitboard_moves(self, square, occupied, enemy_color, moves):
+        row, column = divmod(square, 8)
+        rights = self.castling_rights
+        if self.white_turn:
+            king_side, queen_side = rights & ChessEngine.WHITE_KING_SIDE, rights & ChessEngine.WHITE_QUEEN_SIDE
+        else:
+            king_side, queen_side = rights & ChessEngine.BLACK_KING_SIDE, rights & ChessEngine.BLACK_QUEEN_SIDE
+        if king_side and not occupied & ((1 << (square + 1)) | (1 << (square + 2))):
+            if not self.attackers_to(square + 1, occupied, enemy_color) and \
+                    not self.attackers_to(square + 2, occupied, enemy_color):
+                moves.append(ChessEngine.Move((row, column), (row, column + 2), self.board, is_castling=True))
+        if queen_side and not occupied & ((1 << (square - 1)) | (1 << (square - 2)) | (1 << (square - 3))):
+            if not self.attackers_to(square - 1, occupied, enemy_color) and \
+                    not self.attackers_to(square - 2, occupied, enemy_color):
+                moves.append(ChessEngine.Move((row, column), (row, column - 2), self.board, is_castling=True))
+
+
+"""
+Add the moves from start to every square in targets, or for pawn shifts from target - shift to each
+target; promotions add one move per promotion piece
+"""
+
+
+def add_target_moves(start, targets, board, moves, promotion=False):
+    start_square = divmod(start, 8)
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        end = divmod(bit.bit_length() - 1, 8)
+        if promotion:
+            for piece in ChessEngine.PROMOTION_PIECES:
+                moves.append(ChessEngine.Move(start_square, end, board, promotion_piece=piece))
+        else:
+            moves.append(ChessEngine.Move(start_square, end, board))
+
+
+def add_shift_moves(shift, targets, board, moves, promotion=False):
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        end = bit.bit_length() - 1
+        start_square, end_square = divmod(end - shift, 8), divmod(end, 8)
+        if promotion:
+            for piece in ChessEngine.PROMOTION_PIECES:
+                moves.append(ChessEngine.Move(start_square, end_square, board, promotion_piece=piece))
+        else:
+            moves.append(ChessEngine.Move(start_square, end_square, board))
+
+
+class BitboardMoveStages(ChessEngine.MoveStages):
+    """
+    Legal target bitboards of a position (see get_legal_targets), turned into Move objects one stage
+    at a time, so a search that cuts off on the hash move or a capture never builds the quiet moves
+    """
+    def __init__(self, game_state):
+        self.board = game_state.board
+        self.special_moves = []  # castling and en passant
+        self.legal, self.pawn_shifts = game_state.get_legal_targets(self.special_moves)
+        self.targets = {}  # start square: targets, queens' two entries merged
+        for square, targets in self.legal:
+            self.targets[square] = self.targets.get(square, 0) | targets
+        self.enemy = game_state.occupied['b' if game_state.white_turn else 'w']
+
+    """
+    The legal move with the given move code, checked against the target bitboards; only that one
+    Move is built
+    """
+    def find(self, move_id):
+        flags = move_id >> 12
+        if flags == ChessEngine.FLAG_CASTLING or flags == ChessEngine.FLAG_EN_PASSANT:
+            for candidate in self.special_moves:
+                if candidate.move_id == move_id:
+                    return candidate
+            return None
+        start = move_id & 63
+        end = (move_id >> 6) & 63
+        legal = self.targets.get(start, 0) >> end & 1
+        if not legal and self.is_pawn(start):
+            for shift, targets in self.pawn_shifts:
+                if end - start == shift and targets >> end & 1:
+                    legal = 1
+                    break
+        if not legal:
+            return None
+        move = ChessEngine.Move.from_id(move_id, self.board)
+        return move if move.move_id == move_id else None  # promotion flags that don't fit this board
+
+    def is_pawn(self, square):
+        return self.board[square >> 3][square & 7][1] == 'P'
+
+    def captures(self):
+        moves = [move for move in self.special_moves if move.is_en_passant]
+        board = self.board
+        enemy = self.enemy
+        for square, targets in self.legal:
+            if self.is_pawn(square):
+                targets &= ~PROMOTION_RANKS
+            add_target_moves(square, targets & enemy, board, moves)
+        for shift, targets in self.pawn_shifts:
+            add_shift_moves(shift, targets & enemy & ~PROMOTION_RANKS, board, moves)
+        return moves
+
+    def promotions(self):
+        moves = []
+        board = self.board
+        for square, targets in self.legal:
+            if self.is_pawn(square):
+                add_target_moves(square, targets & PROMOTION_RANKS, board, moves, promotion=True)
+        for shift, targets in self.pawn_shifts:
+            add_shift_moves(shift, targets & PROMOTION_RANKS, board, moves, promotion=True)
+        return moves
+
+    def quiets(self):
+        moves = [move for move in self.special_moves if move.is_castling]
+        board = self.board
+        quiet = ~self.enemy & ~PROMOTION_RANKS
+        for square, targets in self.legal:
+            if not self.is_pawn(square):
+                add_target_moves(square, targets & ~self.enemy, board, moves)
+            else:
+                add_target_moves(square, targets & quiet, board, moves)
+        for shift, targets in self.pawn_shifts:
+            add_shift_moves(shift, targets & quiet, board, moves)
+        return moves
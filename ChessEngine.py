@@ -1,8 +1,61 @@
-import copy
+import AttackMaps
+import Evaluation
+import Fen
+import Instrumentation
+import MoveCache
+import MoveTables
+import Zobrist
+
+
+"""
+Castling rights are the four bits of Game.castling_rights
+"""
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+ALL_CASTLING_RIGHTS = 15
+
+# rights that survive a move starting or ending on each square: moving a king or rook, or capturing a rook,
+# on its starting square gives up the rights that depend on it
+CASTLING_MASKS = [ALL_CASTLING_RIGHTS] * 64
+CASTLING_MASKS[0] = ALL_CASTLING_RIGHTS & ~BLACK_QUEEN_SIDE
+CASTLING_MASKS[4] = ALL_CASTLING_RIGHTS & ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASKS[7] = ALL_CASTLING_RIGHTS & ~BLACK_KING_SIDE
+CASTLING_MASKS[56] = ALL_CASTLING_RIGHTS & ~WHITE_QUEEN_SIDE
+CASTLING_MASKS[60] = ALL_CASTLING_RIGHTS & ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASKS[63] = ALL_CASTLING_RIGHTS & ~WHITE_KING_SIDE
 
 
 class Game:
-    def __init__(self):
+    """
+    backend selects the move generator: "mailbox" scans this 8x8 board, "bitboard" uses the
+    integer bitboards in BitboardEngine. Both keep the same board, Move and make_move / undo interface.
+    get_valid_moves keeps the last move_cache_size positions' legal moves; pass move_cache to share
+    an existing MoveCache instead, e.g. across a reset.
+    """
+    __slots__ = ("backend", "move_cache", "board", "move_log", "undo_log", "white_turn", "white_king_location",
+                 "black_king_location", "check_mate", "stale_mate", "player_is_in_check", "pins", "checks",
+                 "enemy_attacks", "en_passant_valid_square", "castling_rights", "halfmove_clock", "fullmove_number",
+                 "zobrist_key", "attack_maps", "middlegame_score", "endgame_score", "phase", "white_material",
+                 "black_material")
+
+    # looked up by name on every call, so instrumentation can swap the methods (see Instrumentation.profile)
+    move_functions = {'P': "get_pawn_moves", 'R': "get_rook_moves", 'N': "get_knight_moves",
+                      'B': "get_bishop_moves", 'Q': "get_queen_moves", 'K': "get_king_moves"}
+
+    def __new__(cls, backend="mailbox", move_cache_size=MoveCache.DEFAULT_SIZE, move_cache=None):
+        if cls is Game and backend == "bitboard":
+            import BitboardEngine
+            cls = BitboardEngine.BitboardGame
+        elif backend not in ("mailbox", "bitboard"):
+            raise ValueError(f"Unknown move generation backend: {backend}")
+        return super().__new__(cls)
+
+    def __init__(self, backend="mailbox", move_cache_size=MoveCache.DEFAULT_SIZE, move_cache=None):
+        MoveTables.init_tables()
+        self.backend = backend
+        self.move_cache = move_cache if move_cache is not None else MoveCache.MoveCache(move_cache_size)
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
@@ -15,9 +68,8 @@ class Game:
 
         ]
         self.move_log = []
+        self.undo_log = []  # an UndoRecord for every move in move_log
         self.white_turn = True
-        self.move_functions = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
-                               'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
         self.white_king_location = (7, 4)
         self.black_king_location = (0, 4)
         self.check_mate = False
@@ -25,15 +77,104 @@ class Game:
         self.player_is_in_check = False
         self.pins = []
         self.checks = []
+        self.enemy_attacks = 0  # squares the side not to move attacks, set by get_valid_moves
         self.en_passant_valid_square = ()
-        self.current_castling_rights = Castling(True, True, True, True)
-        self.castling_rights_log = [Castling(self.current_castling_rights.wks, self.current_castling_rights.wqs,
-                                             self.current_castling_rights.bks, self.current_castling_rights.bqs)]
+        self.castling_rights = ALL_CASTLING_RIGHTS
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.fullmove_number = 1
+        self.zobrist_key = Zobrist.hash_position(self)
+        # evaluation sums, kept up to date by make_move and undo (see Evaluation.position_scores)
+        self.middlegame_score, self.endgame_score, self.phase, self.white_material, self.black_material = \
+            Evaluation.position_scores(self.board)
+        # the bitboard backend answers attack queries from its own bitboards
+        self.attack_maps = AttackMaps.AttackMaps(self.board) if backend == "mailbox" else None
+
+    """
+    Set up the position of a FEN string, replacing the current game and its move history.
+    Castling rights whose king or rook is not on its starting square are dropped, and so is an
+    en passant square without an enemy pawn in front of it that could just have pushed two squares.
+    Raises ValueError on a malformed FEN or one without exactly one king per side.
+    """
+    def load_fen(self, fen):
+        board, white_turn, rights, en_passant, halfmove_clock, fullmove_number = Fen.parse_fen(fen)
+        kings = {piece: [(row, column) for row in range(8) for column in range(8) if board[row][column] == piece]
+                 for piece in ("wK", "bK")}
+        if len(kings["wK"]) != 1 or len(kings["bK"]) != 1:
+            raise ValueError(f"FEN needs exactly one king per side: {fen!r}")
+        wks, wqs, bks, bqs = rights
+        castling_rights = (WHITE_KING_SIDE if wks and board[7][4] == "wK" and board[7][7] == "wR" else 0) | \
+            (WHITE_QUEEN_SIDE if wqs and board[7][4] == "wK" and board[7][0] == "wR" else 0) | \
+            (BLACK_KING_SIDE if bks and board[0][4] == "bK" and board[0][7] == "bR" else 0) | \
+            (BLACK_QUEEN_SIDE if bqs and board[0][4] == "bK" and board[0][0] == "bR" else 0)
+        if en_passant != ():
+            row, column = en_passant
+            forward = 1 if white_turn else -1  # towards the pawn that moved
+            if board[row + forward][column] != ("b" if white_turn else "w") + "P" or \
+                    board[row][column] != "--" or board[row - forward][column] != "--":
+                en_passant = ()
+
+        self.board = board
+        self.move_log = []
+        self.undo_log = []
+        self.white_turn = white_turn
+        self.white_king_location = kings["wK"][0]
+        self.black_king_location = kings["bK"][0]
+        self.check_mate = False
+        self.stale_mate = False
+        self.player_is_in_check = False
+        self.pins = []
+        self.checks = []
+        self.enemy_attacks = 0
+        self.en_passant_valid_square = en_passant
+        self.castling_rights = castling_rights
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.zobrist_key = Zobrist.hash_position(self)
+        self.middlegame_score, self.endgame_score, self.phase, self.white_material, self.black_material = \
+            Evaluation.position_scores(self.board)
+        if self.attack_maps is not None:
+            self.attack_maps.rebuild(self.board)
+
+    """
+    FEN string of the current position
+    """
+    def get_fen(self):
+        rights = self.castling_rights
+        return Fen.make_fen(self.board, self.white_turn,
+                            (bool(rights & WHITE_KING_SIDE), bool(rights & WHITE_QUEEN_SIDE),
+                             bool(rights & BLACK_KING_SIDE), bool(rights & BLACK_QUEEN_SIDE)),
+                            self.en_passant_valid_square, self.halfmove_clock, self.fullmove_number)
+
+    """
+    A new Game set up from a FEN string; other arguments are passed on to Game
+    """
+    @classmethod
+    def from_fen(cls, fen, *args, **kwargs):
+        game_state = cls(*args, **kwargs)
+        game_state.load_fen(fen)
+        return game_state
+
+    def __getstate__(self):
+        # copies sent to worker processes start with an empty cache rather than carrying this one along
+        state = {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ())
+                 if hasattr(self, name)}
+        state["move_cache"] = MoveCache.MoveCache(self.move_cache.size)
+        return state
+
+    def __setstate__(self, state):
+        # unpickled copies (e.g. in worker processes) skip __init__, so the tables may not be built yet
+        MoveTables.init_tables()
+        for name, value in state.items():
+            setattr(self, name, value)
 
     """
     Execute a Move object
     """
+    @Instrumentation.probe("make_move")
     def make_move(self, move):
+        previous_en_passant = self.en_passant_valid_square
+        previous_rights = self.castling_rights
+        self.undo_log.append(UndoRecord(previous_rights, previous_en_passant, self.halfmove_clock))
         self.board[move.start_row][move.start_column] = "--"
         self.board[move.end_row][move.end_column] = move.piece_moved
 
@@ -46,7 +187,7 @@ class Game:
 
         # pawn promotion
         if move.is_pawn_promotion:
-            self.board[move.end_row][move.end_column] = move.piece_moved[0] + 'Q'
+            self.board[move.end_row][move.end_column] = move.piece_moved[0] + move.promotion_piece
 
         #  en-passant
         self.en_passant_valid_square = ()
@@ -70,32 +211,69 @@ class Game:
                 self.board[move.end_row][move.end_column + 1] = self.board[move.end_row][move.end_column - 2]
                 self.board[move.end_row][move.end_column - 2] = "--"
 
+        middlegame, endgame, phase, captured, promoted = Evaluation.move_scores(move)
+        self.middlegame_score += middlegame
+        self.endgame_score += endgame
+        self.phase += phase
+        if self.white_turn:
+            self.white_material += promoted
+            self.black_material -= captured
+        else:
+            self.black_material += promoted
+            self.white_material -= captured
+
         self.move_log.append(move)  # log the move to undo later, or display history of moves
         self.white_turn = not self.white_turn  # switch turns
+        if move.piece_moved[1] == 'P' or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.white_turn:  # black just moved
+            self.fullmove_number += 1
+
+        self.castling_rights = previous_rights & CASTLING_MASKS[move.start_row * 8 + move.start_column] & \
+            CASTLING_MASKS[move.end_row * 8 + move.end_column]
 
-        self.update_castling(move)
-        self.castling_rights_log.append(Castling(self.current_castling_rights.wks, self.current_castling_rights.wqs,
-                                                 self.current_castling_rights.bks, self.current_castling_rights.bqs))
+        # update the position key with what changed
+        self.zobrist_key ^= Zobrist.move_key(move) ^ Zobrist.BLACK_TO_MOVE ^ \
+            Zobrist.en_passant_key(previous_en_passant) ^ Zobrist.en_passant_key(self.en_passant_valid_square) ^ \
+            Zobrist.castling_key(previous_rights) ^ Zobrist.castling_key(self.castling_rights)
+        if self.attack_maps is not None:
+            self.attack_maps.update(self.board, changed_squares(move))
 
     """
-    Undo last move
+    Undo last move. The board is put back from the Move; everything else comes from its UndoRecord.
     """
+    @Instrumentation.probe("undo")
     def undo(self):
         if len(self.move_log) != 0:
             move = self.move_log.pop()
+            record = self.undo_log.pop()
             if move.is_en_passant:
                 if move.piece_moved[0] == 'w':
                     self.board[move.end_row + 1][move.end_column] = move.piece_captured
                 else:
                     self.board[move.end_row - 1][move.end_column] = move.piece_captured
                 self.board[move.end_row][move.end_column] = "--"
-                self.en_passant_valid_square = (move.end_row, move.end_column)
 
             else:
                 self.board[move.end_row][move.end_column] = move.piece_captured
 
             self.board[move.start_row][move.start_column] = move.piece_moved
             self.white_turn = not self.white_turn
+            self.halfmove_clock = record.halfmove_clock
+            middlegame, endgame, phase, captured, promoted = Evaluation.move_scores(move)
+            self.middlegame_score -= middlegame
+            self.endgame_score -= endgame
+            self.phase -= phase
+            if self.white_turn:
+                self.white_material -= promoted
+                self.black_material += captured
+            else:
+                self.black_material -= promoted
+                self.white_material += captured
+            if not self.white_turn:
+                self.fullmove_number -= 1
 
             #  update kings location if undone
             if move.piece_moved[1] == "K":
@@ -107,9 +285,11 @@ class Game:
             if move.is_pawn_promotion:
                 self.board[move.start_row][move.start_column] = self.board[move.start_row][move.start_column][0] + 'P'
 
-            self.castling_rights_log.pop()
-            castle_rights = copy.deepcopy(self.castling_rights_log[-1])
-            self.current_castling_rights = castle_rights
+            self.zobrist_key ^= Zobrist.move_key(move) ^ Zobrist.BLACK_TO_MOVE ^ \
+                Zobrist.en_passant_key(self.en_passant_valid_square) ^ Zobrist.en_passant_key(record.en_passant_square) ^ \
+                Zobrist.castling_key(self.castling_rights) ^ Zobrist.castling_key(record.castling_rights)
+            self.en_passant_valid_square = record.en_passant_square
+            self.castling_rights = record.castling_rights
             if move.is_castling:
                 if move.end_column - move.start_column == 2:  # king side castle
                     self.board[move.end_row][move.end_column + 1] = self.board[move.end_row][move.end_column - 1]
@@ -117,87 +297,68 @@ class Game:
                 else:  # Queen side castle
                     self.board[move.end_row][move.end_column - 2] = self.board[move.end_row][move.end_column + 1]
                     self.board[move.end_row][move.end_column + 1] = "--"
+            if self.attack_maps is not None:
+                self.attack_maps.restore(self.board, changed_squares(move))
 
             if self.check_mate:
                 self.check_mate = False
             elif self.stale_mate:
                 self.stale_mate = False
 
-    def update_castling(self, move):
-        if move.piece_moved == "wK":
-            self.current_castling_rights.wks = False
-            self.current_castling_rights.wqs = False
-        elif move.piece_moved == "bK":
-            self.current_castling_rights.bks = False
-            self.current_castling_rights.bqs = False
-        elif move.piece_moved[1] == 'R':
-
-            if move.piece_moved[0] == 'w' and move.start_row == 7:
-                if move.start_column == 0:  # left Rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_column == 7:  # right Rook
-                    self.current_castling_rights.wks = False
-
-            elif move.piece_moved[0] == 'b' and move.start_row == 0:
-                if move.start_column == 0:  # left Rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_column == 7:  # right Rook
-                    self.current_castling_rights.bks = False
-
-        # if a rook is captured
-        if move.piece_captured == 'wR':
-            if move.end_row == 7:
-                if move.end_column == 0:
-                    self.current_castling_rights.wqs = False
-                elif move.end_column == 7:
-                    self.current_castling_rights.wks = False
-        elif move.piece_captured == 'bR':
-            if move.end_row == 0:
-                if move.end_column == 0:
-                    self.current_castling_rights.bqs = False
-                elif move.end_column == 7:
-                    self.current_castling_rights.bks = False
-
-    """
-    All moves considering checks
     """
+    All moves considering checks. Lists come from the move cache when the position was seen recently;
+    callers get their own copy and may reorder it.
+    """
+    @Instrumentation.probe()
     def get_valid_moves(self):
+        entry = self.move_cache.probe(self.zobrist_key)
+        if entry is not None:
+            valid_moves, self.player_is_in_check = entry
+            if len(valid_moves) == 0 and self.player_is_in_check:
+                self.check_mate = True
+            elif len(valid_moves) == 0 and not self.player_is_in_check:
+                self.stale_mate = True
+            return list(valid_moves)
+        valid_moves = self.generate_valid_moves()
+        self.move_cache.store(self.zobrist_key, valid_moves, self.player_is_in_check)
+        return list(valid_moves)
+
+    """
+    Generate all moves considering checks, setting the check, checkmate and stalemate flags
+    """
+    @Instrumentation.probe("moves_generated", count=len)
+    def generate_valid_moves(self):
         valid_moves = []
-        self.player_is_in_check, self.pins, self.checks = self.check_for_pins_and_checks()
         if self.white_turn:
             king_row = self.white_king_location[0]
             king_column = self.white_king_location[1]
         else:
             king_row = self.black_king_location[0]
             king_column = self.black_king_location[1]
+        ally_color, enemy_color = ('w', 'b') if self.white_turn else ('b', 'w')
+        self.player_is_in_check, self.pins, self.checks = self.attack_maps.pins_and_checks(
+            self.board, king_row, king_column, ally_color, enemy_color)
+        self.enemy_attacks = self.attack_maps.attacked_squares(enemy_color)
         if self.player_is_in_check:
             if len(self.checks) == 1:
-                valid_moves = self.get_possible_moves()
                 check = self.checks[0]
                 check_row = check[0]
                 check_column = check[1]
                 piece_checking = self.board[check_row][check_column]
-                valid_squares = []
                 if piece_checking[1] == 'N':
-                    valid_squares = [(check_row, check_column)]
+                    valid_squares = {(check_row, check_column)}
                 else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i, king_column + check[3] * i)
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_column:
-                            break
-                for i in range(len(valid_moves) - 1, -1, -1):
-                    if valid_moves[i].piece_moved[1] != 'K':
-                        if not (valid_moves[i].end_row, valid_moves[i].end_column) in valid_squares:
-                            valid_moves.remove(valid_moves[i])
+                    valid_squares = set(MoveTables.BETWEEN[king_row * 8 + king_column][check_row * 8 + check_column])
+                    valid_squares.add((check_row, check_column))
+                # the king looks after itself; other pieces must capture the checker or block
+                valid_moves = [move for move in self.get_possible_moves()
+                               if move.piece_moved[1] == 'K' or (move.end_row, move.end_column) in valid_squares or
+                               (move.is_en_passant and (move.start_row, move.end_column) == (check_row, check_column))]
             else:
                 self.get_king_moves(king_row, king_column, valid_moves)
         else:
             valid_moves = self.get_possible_moves()
 
-        for move in valid_moves:
-            print(str(move))
-
         if len(valid_moves) == 0 and self.player_is_in_check:
             self.check_mate = True
         elif len(valid_moves) == 0 and not self.player_is_in_check:
@@ -205,72 +366,24 @@ class Game:
 
         return valid_moves
 
-    def check_for_pins_and_checks(self, row=-1, column=-1):
-        pins = []
-        checks = []
-        in_check = False
-        if self.white_turn:
-            enemy_color = 'b'
-            ally_color = 'w'
-            start_row = self.white_king_location[0]
-            start_column = self.white_king_location[1]
-        else:
-            enemy_color = 'w'
-            ally_color = 'b'
-            start_row = self.black_king_location[0]
-            start_column = self.black_king_location[1]
-        if not row == column == -1:
-            start_row = row
-            start_column = column
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for i in range(len(directions)):
-            d = directions[i]
-            possible_pin = ()
-            for j in range(1, 8):
-                end_row = start_row + d[0] * j
-                end_column = start_column + d[1] * j
-                if 0 <= end_row < 8 and 0 <= end_column < 8:
-                    end_piece = self.board[end_row][end_column]
-                    if end_piece[0] == ally_color and end_piece[1] != 'K':
-                        if possible_pin == ():
-                            possible_pin = (end_row, end_column, d[0], d[1])
-                        else:
-                            break
-                    elif end_piece[0] == enemy_color:
-                        piece_type = end_piece[1]
-                        if(0 <= i <= 3 and piece_type == 'R') or \
-                                (4 <= i <= 7 and piece_type == 'B') or \
-                                (j == 1 and piece_type == 'P' and ((enemy_color == 'w' and 6 <= i <= 7) or (enemy_color == 'b' and 4 <= i <= 5))) or \
-                                (piece_type == 'Q') or (j == 1 and piece_type == 'K'):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_column, d[0], d[1]))
-                                break
-                            else:  # piece blocking so pin it
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying check
-                            break
-
-        knight_moves = [
-            (-2, -1), (-2, 1), (2, -1), (2, 1),
-            (-1, -2), (-1, 2), (1, -2), (1, 2)]
-
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_column = start_column + move[1]
-
-            if 0 <= end_row < 8 and 0 <= end_column < 8:
-                end_piece = self.board[end_row][end_column]
-                if end_piece[0] == enemy_color and end_piece[1] == 'N':
-                    in_check = True
-                    checks.append((end_row, end_column, move[0], move[1]))
-        return in_check, pins, checks
+    """
+    The legal moves split into stages for a staged generator (see MoveOrdering.staged_moves).
+    Sets player_is_in_check. This backend takes them from get_valid_moves; the bitboard backend
+    builds each stage's Move objects only when the stage is reached.
+    """
+    def move_stages(self):
+        return MoveStages(self.get_valid_moves())
+
+    """
+    Number of legal moves in the position (backends can count without building the moves)
+    """
+    def count_valid_moves(self):
+        return len(self.get_valid_moves())
 
     """
     All moves without considering checks
     """
+    @Instrumentation.probe()
     def get_possible_moves(self):
         moves = []
         for row in range(len(self.board)):
@@ -278,13 +391,14 @@ class Game:
                 piece_color = self.board[row][column][0]
                 piece_type = self.board[row][column][1]
                 if (piece_color == 'w' and self.white_turn) or (piece_color == 'b' and not self.white_turn):
-                    self.move_functions[piece_type](row, column, moves)  # calls the appropriate move function depending
+                    getattr(self, self.move_functions[piece_type])(row, column, moves)  # calls the appropriate move function depending
                                                                         # on the piece type
         return moves
 
     """
     Get all the pawn moves for the pawn located at row, column and add these moves to the list
     """
+    @Instrumentation.probe()
     def get_pawn_moves(self, row, column, moves):
         piece_pinned = False
         pin_direction = ()
@@ -298,8 +412,8 @@ class Game:
         if self.white_turn:
             if row > 0:
                 if self.board[row - 1][column] == "--":  # 1 square pawn move
-                    if not piece_pinned or pin_direction == (-1, 0):
-                        moves.append(Move((row, column), (row - 1, column), self.board))
+                    if not piece_pinned or pin_direction in ((-1, 0), (1, 0)):
+                        self.add_pawn_move((row, column), (row - 1, column), moves)
                         if row == 6 and self.board[row - 2][column] == "--":  # 2 square pawn move
                             moves.append(Move((row, column), (row - 2, column), self.board))
 
@@ -307,17 +421,17 @@ class Game:
                 if column - 1 >= 0:
                     if self.board[row - 1][column - 1][0] == 'b':
                         if not piece_pinned or pin_direction == (-1, -1):
-                            moves.append(Move((row, column), (row - 1, column - 1), self.board))
+                            self.add_pawn_move((row, column), (row - 1, column - 1), moves)
                 if column + 1 <= 7:
                     if self.board[row - 1][column + 1][0] == 'b':
                         if not piece_pinned or pin_direction == (-1, 1):
-                            moves.append(Move((row, column), (row - 1, column + 1), self.board))
+                            self.add_pawn_move((row, column), (row - 1, column + 1), moves)
 
         else:  # black pawn moves
             if row < 7:
                 if self.board[row + 1][column] == "--":  # 1 square pawn move
-                    if not piece_pinned or pin_direction == (1, 0):
-                        moves.append(Move((row, column), (row + 1, column), self.board))
+                    if not piece_pinned or pin_direction in ((1, 0), (-1, 0)):
+                        self.add_pawn_move((row, column), (row + 1, column), moves)
                         if row == 1 and self.board[row + 2][column] == "--":  # 2 square pawn move
                             moves.append(Move((row, column), (row + 2, column), self.board))
 
@@ -325,31 +439,60 @@ class Game:
                 if column - 1 >= 0:
                     if self.board[row + 1][column - 1][0] == 'w':
                         if not piece_pinned or pin_direction == (1, -1):
-                            moves.append(Move((row, column), (row + 1, column - 1), self.board))
+                            self.add_pawn_move((row, column), (row + 1, column - 1), moves)
                 if column + 1 <= 7:
                     if self.board[row + 1][column + 1][0] == 'w':
                         if not piece_pinned or pin_direction == (1, 1):
-                            moves.append(Move((row, column), (row + 1, column + 1), self.board))
+                            self.add_pawn_move((row, column), (row + 1, column + 1), moves)
         # en passant
         if not self.en_passant_valid_square == ():
             if abs(column - self.en_passant_valid_square[1]) == 1:
+                direction = (self.en_passant_valid_square[0] - row, self.en_passant_valid_square[1] - column)
+                if piece_pinned and pin_direction not in (direction, (-direction[0], -direction[1])):
+                    return
+                if self.en_passant_exposes_king(row, column, self.en_passant_valid_square[1]):
+                    return
 
                 if self.white_turn and row == self.en_passant_valid_square[0] + 1:
-                    move = Move((row, column), self.en_passant_valid_square, self.board)
-                    move.is_en_passant = True
-                    move.piece_captured = self.board[move.end_row + 1][move.end_column]
-                    moves.append(move)
+                    moves.append(Move((row, column), self.en_passant_valid_square, self.board, is_en_passant=True))
 
                 elif not self.white_turn and row == self.en_passant_valid_square[0] - 1:
-                    move = Move((row, column), self.en_passant_valid_square, self.board)
-                    move.is_en_passant = True
-                    move.piece_captured = self.board[move.end_row - 1][move.end_column]
-                    moves.append(move)
+                    moves.append(Move((row, column), self.en_passant_valid_square, self.board, is_en_passant=True))
+
+    """
+    A pawn move, or one move per promotion piece when it reaches the last rank
+    """
+    def add_pawn_move(self, start_square, end_square, moves):
+        if end_square[0] == 0 or end_square[0] == 7:
+            for piece in PROMOTION_PIECES:
+                moves.append(Move(start_square, end_square, self.board, promotion_piece=piece))
+        else:
+            moves.append(Move(start_square, end_square, self.board))
+
+    """
+    En passant removes two pawns from the same rank at once, which can uncover a rook or queen
+    attack on the king along that rank. The regular pin detection cannot see this.
+    """
+    def en_passant_exposes_king(self, row, column, captured_column):
+        king_row, king_column = self.white_king_location if self.white_turn else self.black_king_location
+        if king_row != row:
+            return False
+        enemy_color = 'b' if self.white_turn else 'w'
+        step = 1 if captured_column > king_column else -1
+        end_column = king_column + step
+        while 0 <= end_column < 8:
+            if end_column != column and end_column != captured_column:
+                end_piece = self.board[row][end_column]
+                if end_piece != "--":
+                    return end_piece[0] == enemy_color and end_piece[1] in ('R', 'Q')
+            end_column += step
+        return False
 
     """
     Get all the pawn moves for the rook located at row, column and add these moves to the list
     """
 
+    @Instrumentation.probe()
     def get_rook_moves(self, row, column, moves):
         piece_pinned = False
         pin_direction = ()
@@ -361,25 +504,20 @@ class Game:
                     self.pins.remove(self.pins[i])
                 break
 
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1)]  # N, W, S, E
         enemy_color = 'b' if self.white_turn else 'w'
-
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = column + d[1] * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:  # Check bounds
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # Empty space
-                            moves.append(Move((row, column), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # Capture enemy piece
-                            moves.append(Move((row, column), (end_row, end_col), self.board))
-                            break
-                        else:  # Friendly piece
-                            break
-                else:  # Out of bounds
+        rays = MoveTables.RAYS[row * 8 + column]
+
+        for d in MoveTables.ROOK_DIRECTIONS:  # N, W, S, E
+            if piece_pinned and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
+            for end_row, end_col in rays[d]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":  # Empty space
+                    moves.append(Move((row, column), (end_row, end_col), self.board))
+                elif end_piece[0] == enemy_color:  # Capture enemy piece
+                    moves.append(Move((row, column), (end_row, end_col), self.board))
+                    break
+                else:  # Friendly piece
                     break
         #  self.castling(row, column, moves)
 
@@ -387,6 +525,7 @@ class Game:
     Get all the pawn moves for the knight located at row, column and these moves to the list
     """
 
+    @Instrumentation.probe()
     def get_knight_moves(self, row, column, moves):
 
         piece_pinned = False
@@ -396,26 +535,20 @@ class Game:
                 self.pins.remove(self.pins[i])
                 break
 
-        knight_moves = [
-            (-2, -1), (-2, 1), (2, -1), (2, 1),
-            (-1, -2), (-1, 2), (1, -2), (1, 2)]
-
+        if piece_pinned:
+            return
         ally_color = 'w' if self.white_turn else 'b'
 
-        for move in knight_moves:
-            end_row = row + move[0]
-            end_col = column + move[1]
-
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:
-                        moves.append(Move((row, column), (end_row, end_col), self.board))
+        for end_row, end_col in MoveTables.KNIGHT_TARGETS[row * 8 + column]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] != ally_color:
+                moves.append(Move((row, column), (end_row, end_col), self.board))
 
     """
     Get all the pawn moves for the bishop located at row, column and these moves to the list
     """
 
+    @Instrumentation.probe()
     def get_bishop_moves(self, row, column, moves):
 
         piece_pinned = False
@@ -428,31 +561,27 @@ class Game:
                     self.pins.remove(self.pins[i])
                 break
 
-        directions = [(-1, 1), (-1, -1), (1, 1), (1, -1)]  # NE, NW, SE, SW
         enemy_color = 'b' if self.white_turn else 'w'
-
-        for d in directions:
-            for i in range(1, 8):
-                end_row = row + d[0] * i
-                end_col = column + d[1] * i
-
-                if 0 <= end_row < 8 and 0 <= end_col < 8:  # Check bounds
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # Empty space
-                            moves.append(Move((row, column), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # Capture enemy piece
-                            moves.append(Move((row, column), (end_row, end_col), self.board))
-                            break
-                        else:  # Friendly piece
-                            break
-                else:  # Out of bounds
+        rays = MoveTables.RAYS[row * 8 + column]
+
+        for d in MoveTables.BISHOP_DIRECTIONS:  # NW, NE, SW, SE
+            if piece_pinned and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue
+            for end_row, end_col in rays[d]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":  # Empty space
+                    moves.append(Move((row, column), (end_row, end_col), self.board))
+                elif end_piece[0] == enemy_color:  # Capture enemy piece
+                    moves.append(Move((row, column), (end_row, end_col), self.board))
+                    break
+                else:  # Friendly piece
                     break
 
     """
     Get all the queen moves for the pawn located at row, column and these moves to the list
     """
 
+    @Instrumentation.probe()
     def get_queen_moves(self, row, column, moves):
         self.get_rook_moves(row, column, moves)
         self.get_bishop_moves(row, column, moves)
@@ -461,65 +590,112 @@ class Game:
     Get all the king moves for the pawn located at row, column and these moves to the list
     """
 
+    @Instrumentation.probe()
     def get_king_moves(self, row, column, moves):
-        row_moves    = (-1, -1, -1,  0, 0,  1, 1, 1)
-        column_moves = (-1,  0,  1, -1, 1, -1, 0, 1)
         ally_color = 'w' if self.white_turn else 'b'
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_column = column + column_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_column < 8:
-                end_piece = self.board[end_row][end_column]
-                if end_piece[0] != ally_color:
-                    if ally_color == 'w':
-                        self.white_king_location = (end_row, end_column)
-                    else:
-                        self.black_king_location = (end_row, end_column)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((row, column), (end_row, end_column), self.board))
-
-                    if ally_color == 'w':
-                        self.white_king_location = (row, column)
-                    else:
-                        self.black_king_location = (row, column)
+        enemy_attacks = self.enemy_attacks
+        # a slider giving check also attacks the squares behind the king, which the king itself hides
+        x_rays = [(row - check[2], column - check[3]) for check in self.checks
+                  if self.board[check[0]][check[1]][1] in ('B', 'R', 'Q')]
+        for end_row, end_column in MoveTables.KING_TARGETS[row * 8 + column]:
+            end_piece = self.board[end_row][end_column]
+            if end_piece[0] != ally_color and not enemy_attacks >> (end_row * 8 + end_column) & 1 \
+                    and (end_row, end_column) not in x_rays:
+                moves.append(Move((row, column), (end_row, end_column), self.board))
         self.get_castling_moves(row, column, moves)
 
+    @Instrumentation.probe()
     def get_castling_moves(self, row, column, moves):
         if self.player_is_in_check:
             return
-        if (self.white_turn and self.current_castling_rights.wks) or \
-                (not self.white_turn and self.current_castling_rights.bks):
+        if self.castling_rights & (WHITE_KING_SIDE if self.white_turn else BLACK_KING_SIDE):
             self.get_king_side_castling_moves(row, column, moves)
 
-        if (self.white_turn and self.current_castling_rights.wqs) or \
-                (not self.white_turn and self.current_castling_rights.bqs):
+        if self.castling_rights & (WHITE_QUEEN_SIDE if self.white_turn else BLACK_QUEEN_SIDE):
             self.get_queen_side_castling_moves(row, column, moves)
 
     def get_king_side_castling_moves(self, row, column, moves):
         if self.board[row][column + 1] == self.board[row][column + 2] == "--":
-            in_check1, pins1, checks1 = self.check_for_pins_and_checks(row, column + 1)
-            in_check2, pins2, checks2 = self.check_for_pins_and_checks(row, column + 2)
-            if not in_check1 and not in_check2:
+            if not self.enemy_attacks >> (row * 8 + column + 1) & 1 and \
+                    not self.enemy_attacks >> (row * 8 + column + 2) & 1:
                 moves.append(Move((row, column), (row, column + 2), self.board, is_castling=True))
 
     def get_queen_side_castling_moves(self, row, column, moves):
         if self.board[row][column - 1] == self.board[row][column - 2] == self.board[row][column - 3] == "--":
-            in_check1, pins1, checks1 = self.check_for_pins_and_checks(row, column - 1)
-            in_check2, pins2, checks2 = self.check_for_pins_and_checks(row, column - 2)
-            if not in_check1 and not in_check2:
+            if not self.enemy_attacks >> (row * 8 + column - 1) & 1 and \
+                    not self.enemy_attacks >> (row * 8 + column - 2) & 1:
                 moves.append(Move((row, column), (row, column - 2), self.board, is_castling=True))
 
 
-class Castling:
-    def __init__(self, wks, wqs, bks, bqs):
-        self.wks = wks
-        self.wqs = wqs
-        self.bks = bks
-        self.bqs = bqs
+"""
+Board squares a move changes: start, end, the pawn taken en passant and the castling rook's squares
+"""
+
+
+def changed_squares(move):
+    squares = [(move.start_row, move.start_column), (move.end_row, move.end_column)]
+    if move.is_en_passant:
+        squares.append((move.start_row, move.end_column))
+    elif move.is_castling:
+        if move.end_column - move.start_column == 2:  # king side castle
+            squares += [(move.end_row, move.end_column + 1), (move.end_row, move.end_column - 1)]
+        else:  # Queen side castle
+            squares += [(move.end_row, move.end_column - 2), (move.end_row, move.end_column + 1)]
+    return squares
+
+
+class UndoRecord:
+    """
+    The state make_move overwrites and cannot work out again from the Move: castling rights, en passant
+    square and halfmove clock before the move. The captured piece is on the Move itself.
+    """
+    __slots__ = ("castling_rights", "en_passant_square", "halfmove_clock")
+
+    def __init__(self, castling_rights, en_passant_square, halfmove_clock):
+        self.castling_rights = castling_rights
+        self.en_passant_square = en_passant_square
+        self.halfmove_clock = halfmove_clock
+
+
+class MoveStages:
+    """
+    The legal moves of one position by kind: captures (en passant included, promotions not),
+    promotions, and quiet moves (castling included). find() returns the legal move with a move
+    code from elsewhere, such as a hash or killer move, or None.
+    """
+    def __init__(self, moves):
+        self.moves = moves
+
+    def find(self, move_id):
+        for candidate in self.moves:
+            if candidate.move_id == move_id:
+                return candidate
+        return None
+
+    def captures(self):
+        return [move for move in self.moves if move.piece_captured != "--" and not move.is_pawn_promotion]
+
+    def promotions(self):
+        return [move for move in self.moves if move.is_pawn_promotion]
+
+    def quiets(self):
+        return [move for move in self.moves if move.piece_captured == "--" and not move.is_pawn_promotion]
+
+
+"""
+A move packs into a 16-bit integer, kept as Move.move_id:
+bits 0-5 start square, bits 6-11 end square (square = row * 8 + column), bits 12-15 flags.
+"""
+FLAG_CASTLING = 1
+FLAG_EN_PASSANT = 2
+FLAG_PROMOTION = {'N': 4, 'B': 5, 'R': 6, 'Q': 7}
+PROMOTION_FLAGS = {flag: piece for piece, flag in FLAG_PROMOTION.items()}
+PROMOTION_PIECES = ('Q', 'R', 'B', 'N')
 
 
 class Move:
+    __slots__ = ("start_row", "start_column", "end_row", "end_column", "piece_moved", "piece_captured",
+                 "is_en_passant", "is_castling", "is_pawn_promotion", "promotion_piece", "move_id")
 
     ranks_to_rows = {"1": 7, "2": 6, "3": 5, "4": 4,
                      "5": 3, "6": 2, "7": 1, "8": 0}
@@ -529,19 +705,41 @@ class Move:
                         "e": 4, "f": 5, "g": 6, "h": 7}
     columns_to_files = {v: k for k, v in files_to_columns.items()}
 
-    def __init__(self, start_square, end_square, board, is_castling=False):
-        self.start_row = start_square[0]
-        self.start_column = start_square[1]
-        self.end_row = end_square[0]
-        self.end_column = end_square[1]
-        self.piece_moved = board[self.start_row][self.start_column]
-        self.piece_captured = board[self.end_row][self.end_column]
-        self.is_en_passant = False
+    def __init__(self, start_square, end_square, board, is_castling=False, is_en_passant=False,
+                 promotion_piece='Q'):
+        start_row, start_column = start_square
+        end_row, end_column = end_square
+        self.start_row = start_row
+        self.start_column = start_column
+        self.end_row = end_row
+        self.end_column = end_column
+        self.piece_moved = piece_moved = board[start_row][start_column]
+        self.is_en_passant = is_en_passant
         self.is_castling = is_castling
-        self.is_pawn_promotion = ((self.piece_moved == "wP" and self.end_row == 0)
-                                  or
-                                  (self.piece_moved == "bP" and self.end_row == 7))
-        self.move_id = self.start_row * 1000 + self.start_column * 100 + self.end_row * 10 + self.end_column
+        self.is_pawn_promotion = piece_moved[1] == 'P' and (end_row == 0 or end_row == 7)
+        if is_en_passant:  # the captured pawn is beside the moving pawn, not on the end square
+            self.piece_captured = board[start_row][end_column]
+            flags = FLAG_EN_PASSANT
+        else:
+            self.piece_captured = board[end_row][end_column]
+            flags = FLAG_CASTLING if is_castling else 0
+        if self.is_pawn_promotion:
+            self.promotion_piece = promotion_piece
+            flags = FLAG_PROMOTION[promotion_piece]
+        else:
+            self.promotion_piece = None
+        self.move_id = (start_row * 8 + start_column) | (end_row * 8 + end_column) << 6 | flags << 12
+
+    """
+    Rebuild the Move for a 16-bit move code on the given board
+    """
+    @classmethod
+    def from_id(cls, move_id, board):
+        start = move_id & 63
+        end = (move_id >> 6) & 63
+        flags = move_id >> 12
+        return cls(divmod(start, 8), divmod(end, 8), board, is_castling=flags == FLAG_CASTLING,
+                   is_en_passant=flags == FLAG_EN_PASSANT, promotion_piece=PROMOTION_FLAGS.get(flags, 'Q'))
 
     """
     Overriding the equals method
@@ -551,13 +749,23 @@ class Move:
             return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     def __str__(self):
         return f'Move piece: {self.piece_moved} from ({self.start_row}, {self.start_column})' \
                f' to ' \
                f'({self.end_row}, {self.end_column})'
 
+    """
+    Coordinate notation, with the promotion piece appended for promotions ("e7e8q")
+    """
     def get_chess_notation(self):
-        return self.get_rank_file(self.start_row, self.start_column) + self.get_rank_file(self.end_row, self.end_column)
+        notation = self.get_rank_file(self.start_row, self.start_column) + \
+            self.get_rank_file(self.end_row, self.end_column)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def get_rank_file(self, row, column):
         return self.columns_to_files[column] + self.rows_to_ranks[row]
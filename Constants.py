@@ -7,4 +7,10 @@ SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
 SQUARE_COLORS = []
 IMAGES = {}
 TRANSPARENCY = 100
-SOUNDS = {}
\ No newline at end of file
+SOUNDS = {}
+
+ENGINE_COLOR = None  # 'w' or 'b' to have the engine play that side, None for two players
+ENGINE_TIME = 1.0  # seconds per engine move
+ENGINE_PONDER = True  # keep searching the expected reply while the player thinks
+ENGINE_BOOK = None  # opening book file for the engine, see OpeningBook.py
+ENGINE_TABLEBASES = None  # endgame tablebase directory for the engine, see Tablebase.py
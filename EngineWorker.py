@@ -0,0 +1,190 @@
+import queue
+import threading
+import ChessEngine
+import OpeningBook
+import Search
+import Tablebase
+
+
+"""
+Background engine thread for the pygame loop. The loop submits requests (the legal moves of a
+position, or an engine reply) and calls poll() once per frame to collect whatever has finished,
+so slow move generation or search never blocks input or drawing.
+
+Requests carry the position as a FEN (and, for engine replies, the Zobrist keys of the positions
+played before it, so the search sees repetitions) and are worked on the thread's own Game, so the
+loop's Game is never touched from two threads; the Move objects that come back can be played on the loop's
+Game directly. cancel() (on undo or reset) drops queued requests, stops a running search and
+makes sure no result of an earlier request is handed out afterwards.
+
+With pondering on, after every engine reply the thread keeps searching the position after the
+reply it expects from the opponent (the second move of the principal variation) until the next
+request arrives. The search shares its transposition table with the next engine search, so if
+the opponent plays the expected move ("ponder hit") that search starts with the work already done.
+"""
+
+
+MAX_PONDER_DEPTH = 64  # pondering runs until interrupted; this only bounds it in theory
+
+
+class EngineResult:
+    """
+    kind is "moves" (moves, in_check, check_mate, stale_mate set) or "reply" (search set, and
+    best_move, or None with no legal move). zobrist_key identifies the position it is for.
+    """
+    def __init__(self, kind, zobrist_key):
+        self.kind = kind
+        self.zobrist_key = zobrist_key
+        self.moves = None
+        self.in_check = False
+        self.check_mate = False
+        self.stale_mate = False
+        self.search = None
+        self.best_move = None
+        self.ponder_hit = False
+
+
+class EngineWorker:
+    """
+    book_path names an opening book (see OpeningBook) for engine replies to play from, and
+    tablebase_directory a directory of endgame tables (see Tablebase) to play covered endgames from
+    """
+    def __init__(self, backend="bitboard", tt_megabytes=16, ponder=True, book_path=None, tablebase_directory=None):
+        self.game_state = ChessEngine.Game(backend)
+        self.searcher = Search.Searcher(tt_megabytes, book=OpeningBook.OpeningBook(book_path) if book_path else None,
+                                        tablebases=Tablebase.Tablebases(tablebase_directory)
+                                        if tablebase_directory else None)
+        self.ponder = ponder
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.generation = 0  # bumped by cancel(); jobs and results of older generations are dropped
+        self.ponder_fen = None  # position to ponder on when idle
+        self.ponder_history = []  # keys of the positions played before it
+        self.pondering = False
+        self.ponder_key = None  # position the last ponder search was on
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="engine", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, game_state, *args):
+        with self.lock:
+            self.jobs.put((self.generation, kind, game_state.get_fen(), game_state.zobrist_key, args))
+            if self.pondering:  # make way for real work
+                self.searcher.stop()
+
+    def request_moves(self, game_state):
+        self.submit("moves", game_state)
+
+    def request_reply(self, game_state, time_limit=None, depth=None):
+        if time_limit is None and depth is None:
+            raise ValueError("an engine reply needs a depth limit or a time limit")
+        self.submit("reply", game_state, time_limit, depth, Search.game_history(game_state))
+
+    """
+    Forget every request made so far: queued ones are dropped, a running search stops early and
+    poll() will not return their results. Pondering stops too.
+    """
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.ponder_fen = None
+            while True:
+                try:
+                    self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            self.searcher.stop()
+
+    """
+    Results finished since the last call, oldest first, without waiting
+    """
+    def poll(self):
+        results = []
+        while True:
+            try:
+                generation, result = self.results.get_nowait()
+            except queue.Empty:
+                return results
+            if generation == self.generation:
+                results.append(result)
+
+    def close(self):
+        self.cancel()
+        self.closed = True
+        self.jobs.put(None)
+        self.thread.join(timeout=1.0)
+
+    def run(self):
+        while not self.closed:
+            if self.ponder_fen is not None:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    self.ponder_once()
+                    continue
+            else:
+                job = self.jobs.get()
+            if job is None:
+                break
+            generation, kind, fen, zobrist_key, args = job
+            self.searcher.stop_requested = False
+            if generation != self.generation:
+                continue
+            if kind == "moves":
+                result = self.legal_moves(fen, zobrist_key)
+            else:
+                result = self.reply(fen, zobrist_key, *args)
+            with self.lock:
+                if generation != self.generation:  # cancelled while working: don't ponder on its behalf
+                    self.ponder_fen = None
+            self.results.put((generation, result))
+
+    def legal_moves(self, fen, zobrist_key):
+        game_state = self.game_state
+        game_state.load_fen(fen)
+        result = EngineResult("moves", zobrist_key)
+        result.moves = game_state.get_valid_moves()
+        result.in_check = game_state.player_is_in_check
+        result.check_mate = game_state.check_mate
+        result.stale_mate = game_state.stale_mate
+        return result
+
+    def reply(self, fen, zobrist_key, time_limit, depth, history):
+        game_state = self.game_state
+        game_state.load_fen(fen)
+        result = EngineResult("reply", zobrist_key)
+        result.ponder_hit = self.ponder_key == game_state.zobrist_key
+        self.ponder_fen = None
+        result.search = self.searcher.search(game_state, depth, time_limit, history=history)
+        result.best_move = result.search.best_move
+        if self.ponder and len(result.search.pv) >= 2 and not self.searcher.stop_requested:
+            # the position after our reply and the opponent's expected answer
+            self.ponder_history = history + [game_state.zobrist_key]
+            game_state.make_move(result.best_move)
+            self.ponder_history.append(game_state.zobrist_key)
+            game_state.make_move(result.search.pv[1])
+            self.ponder_fen = game_state.get_fen()
+        return result
+
+    """
+    Search the ponder position until a request interrupts it or the search completes
+    """
+    def ponder_once(self):
+        with self.lock:
+            fen = self.ponder_fen
+            history = self.ponder_history
+            if fen is None or not self.jobs.empty():
+                return
+            self.pondering = True
+            self.searcher.stop_requested = False
+        try:
+            self.game_state.load_fen(fen)
+            self.ponder_key = self.game_state.zobrist_key
+            self.searcher.search(self.game_state, MAX_PONDER_DEPTH, history=history)
+            if not self.searcher.stopped:  # searched to the end; nothing left to do here
+                with self.lock:
+                    if self.ponder_fen == fen:
+                        self.ponder_fen = None
+        finally:
+            self.pondering = False
@@ -0,0 +1,253 @@
+"""
+Static evaluation in centipawns: material plus piece-square tables, tapered between a middlegame
+and an endgame table by the amount of material left on the board.
+
+Tables are written from white's side with the 8th rank first, so they line up with Game.board;
+black pieces read them with the row mirrored.
+
+Game keeps the sums evaluate_white() would compute (middlegame and endgame scores, phase, and each
+side's material) up to date as moves are made and undone, using move_scores() for what a move
+changes, so evaluate() reads them in constant time instead of scanning the board.
+"""
+
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# game phase weights, 24 with all pieces on the board
+PHASE_WEIGHTS = {'P': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+MAX_PHASE = 24
+
+PAWN_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [10, 10, 20, 30, 30, 20, 10, 10],
+    [5, 5, 10, 25, 25, 10, 5, 5],
+    [0, 0, 0, 20, 20, 0, 0, 0],
+    [5, -5, -10, 0, 0, -10, -5, 5],
+    [5, 10, 10, -20, -20, 10, 10, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+
+PAWN_ENDGAME_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [80, 80, 80, 80, 80, 80, 80, 80],
+    [50, 50, 50, 50, 50, 50, 50, 50],
+    [30, 30, 30, 30, 30, 30, 30, 30],
+    [15, 15, 15, 15, 15, 15, 15, 15],
+    [5, 5, 5, 5, 5, 5, 5, 5],
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [0, 0, 0, 0, 0, 0, 0, 0]
+]
+
+KNIGHT_TABLE = [
+    [-50, -40, -30, -30, -30, -30, -40, -50],
+    [-40, -20, 0, 0, 0, 0, -20, -40],
+    [-30, 0, 10, 15, 15, 10, 0, -30],
+    [-30, 5, 15, 20, 20, 15, 5, -30],
+    [-30, 0, 15, 20, 20, 15, 0, -30],
+    [-30, 5, 10, 15, 15, 10, 5, -30],
+    [-40, -20, 0, 5, 5, 0, -20, -40],
+    [-50, -40, -30, -30, -30, -30, -40, -50]
+]
+
+BISHOP_TABLE = [
+    [-20, -10, -10, -10, -10, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 10, 10, 5, 0, -10],
+    [-10, 5, 5, 10, 10, 5, 5, -10],
+    [-10, 0, 10, 10, 10, 10, 0, -10],
+    [-10, 10, 10, 10, 10, 10, 10, -10],
+    [-10, 5, 0, 0, 0, 0, 5, -10],
+    [-20, -10, -10, -10, -10, -10, -10, -20]
+]
+
+ROOK_TABLE = [
+    [0, 0, 0, 0, 0, 0, 0, 0],
+    [5, 10, 10, 10, 10, 10, 10, 5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [-5, 0, 0, 0, 0, 0, 0, -5],
+    [0, 0, 0, 5, 5, 0, 0, 0]
+]
+
+QUEEN_TABLE = [
+    [-20, -10, -10, -5, -5, -10, -10, -20],
+    [-10, 0, 0, 0, 0, 0, 0, -10],
+    [-10, 0, 5, 5, 5, 5, 0, -10],
+    [-5, 0, 5, 5, 5, 5, 0, -5],
+    [0, 0, 5, 5, 5, 5, 0, -5],
+    [-10, 5, 5, 5, 5, 5, 0, -10],
+    [-10, 0, 5, 0, 0, 0, 0, -10],
+    [-20, -10, -10, -5, -5, -10, -10, -20]
+]
+
+KING_TABLE = [
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-30, -40, -40, -50, -50, -40, -40, -30],
+    [-20, -30, -30, -40, -40, -30, -30, -20],
+    [-10, -20, -20, -20, -20, -20, -20, -10],
+    [20, 20, 0, 0, 0, 0, 20, 20],
+    [20, 30, 10, 0, 0, 10, 30, 20]
+]
+
+KING_ENDGAME_TABLE = [
+    [-50, -40, -30, -20, -20, -30, -40, -50],
+    [-30, -20, -10, 0, 0, -10, -20, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 30, 40, 40, 30, -10, -30],
+    [-30, -10, 20, 30, 30, 20, -10, -30],
+    [-30, -30, 0, 0, 0, 0, -30, -30],
+    [-50, -30, -30, -30, -30, -30, -30, -50]
+]
+
+MIDDLEGAME_TABLES = {'P': PAWN_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE,
+                     'Q': QUEEN_TABLE, 'K': KING_TABLE}
+ENDGAME_TABLES = {'P': PAWN_ENDGAME_TABLE, 'N': KNIGHT_TABLE, 'B': BISHOP_TABLE, 'R': ROOK_TABLE,
+                  'Q': QUEEN_TABLE, 'K': KING_ENDGAME_TABLE}
+
+
+# material plus piece-square value of every piece on every square (row * 8 + column), negative for black
+MIDDLEGAME_SCORES = {}
+ENDGAME_SCORES = {}
+for _piece_type, _value in PIECE_VALUES.items():
+    for _color, _sign in (('w', 1), ('b', -1)):
+        MIDDLEGAME_SCORES[_color + _piece_type] = [
+            _sign * (_value + MIDDLEGAME_TABLES[_piece_type][_row if _color == 'w' else 7 - _row][_column])
+            for _row in range(8) for _column in range(8)]
+        ENDGAME_SCORES[_color + _piece_type] = [
+            _sign * (_value + ENDGAME_TABLES[_piece_type][_row if _color == 'w' else 7 - _row][_column])
+            for _row in range(8) for _column in range(8)]
+
+
+class EvaluationMismatch(Exception):
+    pass
+
+
+"""
+Score of the position for white in centipawns
+"""
+
+
+def evaluate_white(board):
+    middlegame = 0
+    endgame = 0
+    phase = 0
+    for row in range(8):
+        for column in range(8):
+            piece = board[row][column]
+            if piece == "--":
+                continue
+            piece_type = piece[1]
+            table_row = row if piece[0] == 'w' else 7 - row
+            value = PIECE_VALUES[piece_type]
+            middlegame_score = value + MIDDLEGAME_TABLES[piece_type][table_row][column]
+            endgame_score = value + ENDGAME_TABLES[piece_type][table_row][column]
+            if piece[0] == 'w':
+                middlegame += middlegame_score
+                endgame += endgame_score
+            else:
+                middlegame -= middlegame_score
+                endgame -= endgame_score
+            phase += PHASE_WEIGHTS[piece_type]
+    return taper(middlegame, endgame, phase)
+
+
+"""
+Blend middlegame and endgame scores by phase (MAX_PHASE = pure middlegame), rounding towards zero
+so a mirrored position scores exactly the negation
+"""
+
+
+def taper(middlegame, endgame, phase):
+    phase = min(phase, MAX_PHASE)
+    total = middlegame * phase + endgame * (MAX_PHASE - phase)
+    return total // MAX_PHASE if total >= 0 else -(-total // MAX_PHASE)
+
+
+"""
+The sums Game keeps for a board, computed from scratch: (middlegame score, endgame score, phase,
+white material, black material). Scores are from white's side; material counts every piece but the
+king at PIECE_VALUES.
+"""
+
+
+def position_scores(board):
+    middlegame = 0
+    endgame = 0
+    phase = 0
+    material = {'w': 0, 'b': 0}
+    for row in range(8):
+        for column in range(8):
+            piece = board[row][column]
+            if piece == "--":
+                continue
+            square = row * 8 + column
+            middlegame += MIDDLEGAME_SCORES[piece][square]
+            endgame += ENDGAME_SCORES[piece][square]
+            phase += PHASE_WEIGHTS[piece[1]]
+            material[piece[0]] += PIECE_VALUES[piece[1]]
+    return middlegame, endgame, phase, material['w'], material['b']
+
+
+"""
+What a move changes in those sums: (middlegame score, endgame score, phase, material captured,
+material gained by promoting). The first three are added by make_move and subtracted by undo.
+"""
+
+
+def move_scores(move):
+    start = move.start_row * 8 + move.start_column
+    end = move.end_row * 8 + move.end_column
+    moved = move.piece_moved
+    placed = moved[0] + move.promotion_piece if move.is_pawn_promotion else moved
+    middlegame = MIDDLEGAME_SCORES[placed][end] - MIDDLEGAME_SCORES[moved][start]
+    endgame = ENDGAME_SCORES[placed][end] - ENDGAME_SCORES[moved][start]
+    phase = PHASE_WEIGHTS[placed[1]] - PHASE_WEIGHTS[moved[1]]
+    promoted = PIECE_VALUES[placed[1]] - PIECE_VALUES[moved[1]]
+
+    captured = 0
+    if move.piece_captured != "--":
+        square = move.start_row * 8 + move.end_column if move.is_en_passant else end
+        middlegame -= MIDDLEGAME_SCORES[move.piece_captured][square]
+        endgame -= ENDGAME_SCORES[move.piece_captured][square]
+        phase -= PHASE_WEIGHTS[move.piece_captured[1]]
+        captured = PIECE_VALUES[move.piece_captured[1]]
+
+    if move.is_castling:
+        rook = moved[0] + 'R'
+        if move.end_column - move.start_column == 2:  # king side castle
+            rook_start, rook_end = end + 1, end - 1
+        else:  # Queen side castle
+            rook_start, rook_end = end - 2, end + 1
+        middlegame += MIDDLEGAME_SCORES[rook][rook_end] - MIDDLEGAME_SCORES[rook][rook_start]
+        endgame += ENDGAME_SCORES[rook][rook_end] - ENDGAME_SCORES[rook][rook_start]
+    return middlegame, endgame, phase, captured, promoted
+
+
+"""
+Raise EvaluationMismatch if the sums game_state keeps differ from a full recomputation over its board
+"""
+
+
+def check_incremental(game_state):
+    expected = position_scores(game_state.board)
+    actual = (game_state.middlegame_score, game_state.endgame_score, game_state.phase,
+              game_state.white_material, game_state.black_material)
+    if actual != expected:
+        raise EvaluationMismatch(f"incremental scores {actual} != recomputed {expected} after "
+                                 f"{' '.join(move.get_chess_notation() for move in game_state.move_log)}")
+
+
+"""
+Score of the position for the side to move, as negamax search expects, from the sums kept by Game
+"""
+
+
+def evaluate(game_state):
+    score = taper(game_state.middlegame_score, game_state.endgame_score, game_state.phase)
+    return score if game_state.white_turn else -score
@@ -0,0 +1,84 @@
+"""
+Forsyth-Edwards Notation: six space-separated fields giving the board from the 8th rank down,
+the side to move, castling rights, the en passant target square, the halfmove clock (plies
+since the last capture or pawn move) and the fullmove number.
+
+Game.load_fen and Game.get_fen use these to read and write a Game.
+"""
+
+
+INITIAL_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+FILES = "abcdefgh"
+
+
+"""
+Split a FEN into (board, white_turn, (wks, wqs, bks, bqs), en passant square, halfmove clock,
+fullmove number). The board is a new 8x8 list of "wP" style strings, the en passant square a
+(row, column) pair or (), and must be on the 6th rank with white to move and the 3rd with black.
+The clocks may be left out and default to 0 and 1. Raises ValueError on a malformed FEN.
+"""
+
+
+def parse_fen(fen):
+    fields = fen.split()
+    if len(fields) == 4:
+        fields += ["0", "1"]
+    if len(fields) != 6:
+        raise ValueError(f"FEN needs 6 fields: {fen!r}")
+    placement, side, castling, en_passant, halfmove, fullmove = fields
+
+    ranks = placement.split("/")
+    if len(ranks) != 8:
+        raise ValueError(f"FEN board needs 8 ranks: {fen!r}")
+    board = []
+    for rank in ranks:
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend(["--"] * int(char))
+            elif char.upper() in "PNBRQK":
+                row.append(('w' if char.isupper() else 'b') + char.upper())
+            else:
+                raise ValueError(f"Unknown piece {char!r} in FEN: {fen!r}")
+        if len(row) != 8:
+            raise ValueError(f"FEN rank {rank!r} does not have 8 squares: {fen!r}")
+        board.append(row)
+
+    if side not in ("w", "b"):
+        raise ValueError(f"FEN side to move must be w or b: {fen!r}")
+    if castling != "-" and (not set(castling) <= set("KQkq") or len(set(castling)) != len(castling)):
+        raise ValueError(f"Bad FEN castling rights {castling!r}: {fen!r}")
+    rights = ('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)
+
+    if en_passant == "-":
+        square = ()
+    elif len(en_passant) == 2 and en_passant[0] in FILES and en_passant[1] == ("6" if side == "w" else "3"):
+        square = (8 - int(en_passant[1]), FILES.index(en_passant[0]))
+    else:
+        raise ValueError(f"Bad FEN en passant square {en_passant!r}: {fen!r}")
+
+    if not halfmove.isdigit() or not fullmove.isdigit():
+        raise ValueError(f"FEN clocks must be numbers: {fen!r}")
+    return board, side == "w", rights, square, int(halfmove), max(1, int(fullmove))
+
+
+def make_fen(board, white_turn, rights, en_passant, halfmove_clock=0, fullmove_number=1):
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1] if piece[0] == 'w' else piece[1].lower()
+        if empty:
+            rank += str(empty)
+        ranks.append(rank)
+    castling = "".join(flag for flag, right in zip("KQkq", rights) if right) or "-"
+    square = FILES[en_passant[1]] + str(8 - en_passant[0]) if en_passant != () else "-"
+    return f'{"/".join(ranks)} {"w" if white_turn else "b"} {castling} {square} {halfmove_clock} {fullmove_number}'
@@ -0,0 +1,119 @@
+import contextlib
+import json
+import time
+
+
+"""
+Opt-in instrumentation for the move generation hot path.
+
+Methods are marked with @probe where they are defined. Outside a profile() block a probe is
+the plain method, so it costs nothing. Inside one, every probed method is swapped for a wrapper
+that counts its calls and records its run time in a histogram. A probe can also add to a named
+counter, e.g. the number of moves generated. Usage:
+
+    with Instrumentation.profile() as profiler:
+        Perft.perft(game_state, 4)
+    print(profiler.to_json())
+
+profile(profiler) also works as a decorator, collecting into the given Profiler.
+"""
+
+
+PROBES = []  # (class, attribute name, function, counter, count)
+
+
+class probe:
+    """
+    counter names a counter to add to on every call: 1 per call, or count(result) if count is given
+    """
+    def __init__(self, counter=None, count=None):
+        self.counter = counter
+        self.count = count
+        self.function = None
+
+    def __call__(self, function):
+        self.function = function
+        return self
+
+    def __set_name__(self, owner, name):
+        PROBES.append((owner, name, self.function, self.counter, self.count))
+        setattr(owner, name, self.function)  # the class keeps the undecorated method
+
+
+class Histogram:
+    """
+    Run times in power-of-two buckets of nanoseconds: bucket b holds times below 2 ** b ns
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.calls = 0
+        self.total_ns = 0
+
+    def add(self, nanoseconds):
+        bucket = nanoseconds.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.calls += 1
+        self.total_ns += nanoseconds
+
+    def snapshot(self):
+        return {"calls": self.calls, "total_seconds": self.total_ns / 1e9,
+                "mean_microseconds": self.total_ns / self.calls / 1e3 if self.calls else 0.0,
+                "histogram_ns": {f"<{2 ** bucket}": self.buckets[bucket] for bucket in sorted(self.buckets)}}
+
+
+class Profiler:
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+
+    def wrap(self, owner, name, function, counter, count):
+        histogram = self.timings.setdefault(f"{owner.__name__}.{name}", Histogram())
+        counters = self.counters
+        clock = time.perf_counter_ns
+        if counter is not None:
+            counters.setdefault(counter, 0)
+
+        def wrapper(*args, **kwargs):
+            start = clock()
+            result = function(*args, **kwargs)
+            histogram.add(clock() - start)
+            if counter is not None:
+                counters[counter] += count(result) if count is not None else 1
+            return result
+        wrapper.__wrapped__ = function
+        wrapper.profiler = self
+        return wrapper
+
+    def snapshot(self):
+        return {"counters": dict(self.counters),
+                "timings": {name: histogram.snapshot() for name, histogram in sorted(self.timings.items())}}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def dump(self, path):
+        with open(path, "w") as file:
+            file.write(self.to_json())
+
+
+"""
+Turn every probe on for the duration of the block and collect into profiler (a new Profiler if
+None). Probes go back to what they were on exit, so blocks can nest: an inner block wraps whatever
+the outer one installed, and calls inside it count for both profilers.
+"""
+
+
+@contextlib.contextmanager
+def profile(profiler=None):
+    profiler = profiler if profiler is not None else Profiler()
+    previous = []
+    for owner, name, function, counter, count in PROBES:
+        current = owner.__dict__[name]
+        previous.append((owner, name, current))
+        if getattr(current, "profiler", None) is not profiler:  # the same profiler nested counts once
+            setattr(owner, name, profiler.wrap(owner, name, current, counter, count))
+    try:
+        yield profiler
+    finally:
+        for owner, name, method in reversed(previous):
+            setattr(owner, name, method)
@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import subprocess
+import sys
+import time
+import Server
+
+
+"""
+Load test for Server.py. Opens a number of concurrent game sessions, multiplexed over a pool of
+TCP connections, and has every session play random legal moves (with the odd undo) for a fixed
+number of requests. Reports latency percentiles and requests per second for each session count.
+
+    python LoadTest.py --spawn --sessions 1000 10000
+"""
+
+
+class Connection:
+    """
+    One TCP connection carrying pipelined requests; replies are matched to requests by id
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count()
+        self.waiting = {}
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            reply = json.loads(line)
+            future = self.waiting.pop(reply.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, **request):
+        request_id = request["id"] = next(self.ids)
+        future = self.waiting[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(json.dumps(request, separators=(",", ":")).encode() + b"\n")
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        self.receiver.cancel()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def timed(connection, stats, **request):
+    start = time.perf_counter()
+    reply = await connection.request(**request)
+    stats.latencies.append(time.perf_counter() - start)
+    if not reply.get("ok"):
+        stats.errors += 1
+    return reply
+
+
+"""
+One session: start a game, then alternate legal-move lists with moves, undoing now and then and
+starting over when the game ends
+"""
+
+
+async def play_session(connection, stats, requests, rng):
+    reply = await timed(connection, stats, op="new")
+    session = reply["session"]
+    plies = 0
+    done = 1
+    while done < requests:
+        reply = await timed(connection, stats, op="moves", session=session)
+        done += 1
+        moves = reply.get("moves")
+        if done >= requests:
+            break
+        if not moves:
+            await timed(connection, stats, op="close", session=session)
+            reply = await timed(connection, stats, op="new")
+            session = reply["session"]
+            plies = 0
+            done += 2
+        elif plies and rng.random() < 0.1:
+            await timed(connection, stats, op="undo", session=session)
+            plies -= 1
+            done += 1
+        else:
+            await timed(connection, stats, op="move", session=session, move=rng.choice(moves))
+            plies += 1
+            done += 1
+    await connection.request(op="close", session=session)
+
+
+async def run(host, port, sessions, requests, connection_count, seed):
+    connections = [await Connection.open(host, port) for _ in range(min(sessions, connection_count))]
+    stats = Stats()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    await asyncio.gather(*(play_session(connections[index % len(connections)], stats, requests,
+                                        random.Random(rng.random()))
+                           for index in range(sessions)))
+    seconds = time.perf_counter() - start
+    for connection in connections:
+        await connection.close()
+    return stats, seconds
+
+
+async def wait_for_server(host, port, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=Server.DEFAULT_PORT)
+    parser.add_argument("-s", "--sessions", type=int, nargs="+", default=[1000, 10000],
+                        help="concurrent session counts to test (default 1000 10000)")
+    parser.add_argument("-r", "--requests", type=int, default=20, help="requests per session (default 20)")
+    parser.add_argument("-c", "--connections", type=int, default=64, help="TCP connections (default 64)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--spawn", action="store_true", help="start a server subprocess for the test")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard",
+                        help="backend of the spawned server")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, Server.__file__, "--host", args.host, "--port", str(args.port),
+                                   "--backend", args.backend], stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_for_server(args.host, args.port))
+        for sessions in args.sessions:
+            stats, seconds = asyncio.run(run(args.host, args.port, sessions, args.requests, args.connections,
+                                             args.seed))
+            count = len(stats.latencies)
+            print(f"sessions {sessions:>6}  requests {count:>8}  time {seconds:8.2f}s  "
+                  f"rps {count / seconds if seconds > 0 else 0:9.0f}  "
+                  f"p50 {stats.percentile(0.5) * 1e3:8.2f}ms  p99 {stats.percentile(0.99) * 1e3:8.2f}ms  "
+                  f"errors {stats.errors}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
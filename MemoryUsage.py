@@ -0,0 +1,79 @@
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+import ChessEngine
+
+
+"""
+Memory held by Game objects, measured with tracemalloc: bytes per new Game, and bytes per ply of
+history kept for undo (the move log and undo records, plus the attack map history of the mailbox
+backend). Games are created with move_cache_size=0 so cached move lists don't count.
+"""
+
+
+"""
+Move codes of a random game of up to plies plies from the initial position
+"""
+
+
+def random_line(backend, plies, rng):
+    game_state = ChessEngine.Game(backend, 0)
+    line = []
+    for _ in range(plies):
+        moves = game_state.get_valid_moves()
+        if not moves:
+            break
+        move = rng.choice(moves)
+        line.append(move.move_id)
+        game_state.make_move(move)
+    return line
+
+
+def traced_bytes():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+"""
+(bytes per Game, bytes per ply) averaged over games Games, each playing a random line of plies plies
+"""
+
+
+def measure(backend="mailbox", games=200, plies=100, seed=1):
+    rng = random.Random(seed)
+    lines = [random_line(backend, plies, rng) for _ in range(games)]
+    ChessEngine.Game(backend, 0)  # build lazy tables before measuring
+
+    tracemalloc.start()
+    try:
+        start = traced_bytes()
+        game_states = [ChessEngine.Game(backend, 0) for _ in range(games)]
+        created = traced_bytes()
+        for game_state, line in zip(game_states, lines):
+            for move_id in line:
+                game_state.make_move(ChessEngine.Move.from_id(move_id, game_state.board))
+        played = traced_bytes()
+    finally:
+        tracemalloc.stop()
+    total_plies = sum(len(line) for line in lines)
+    return (created - start) / games, (played - created) / total_plies if total_plies else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bytes per Game and per ply of undo history")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), nargs="+",
+                        default=["mailbox", "bitboard"])
+    parser.add_argument("-g", "--games", type=int, default=200, help="games to create (default 200)")
+    parser.add_argument("-p", "--plies", type=int, default=100, help="plies played in each (default 100)")
+    args = parser.parse_args(argv)
+
+    for backend in args.backend:
+        per_game, per_ply = measure(backend, args.games, args.plies)
+        print(f"{backend:<9} {per_game:9.0f} bytes/Game  {per_ply:7.0f} bytes/ply")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
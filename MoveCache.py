@@ -0,0 +1,55 @@
+import collections
+
+
+"""
+Least-recently-used cache of legal move lists keyed by Game.zobrist_key, consulted by
+Game.get_valid_moves. Entries are (moves, in_check) so a hit can restore the check flag and
+the check_mate / stale_mate flags that generation sets.
+"""
+
+
+DEFAULT_SIZE = 1024  # positions
+
+
+class MoveCache:
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    """
+    Entry stored for key, or None; a hit makes it the most recently used
+    """
+    def probe(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, moves, in_check):
+        if self.size <= 0:
+            return
+        self.entries[key] = (moves, in_check)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {"size": self.size, "filled": len(self.entries), "probes": probes, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / probes if probes else 0.0,
+                "evictions": self.evictions}
+
+    def __str__(self):
+        stats = self.stats()
+        return f'Move cache {stats["filled"]}/{stats["size"]} positions: {stats["hits"]} hits, ' \
+               f'{stats["misses"]} misses ({stats["hit_rate"]:.1%} hit rate), {stats["evictions"]} evictions'
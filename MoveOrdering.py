@@ -0,0 +1,281 @@
+import argparse
+import sys
+import ChessEngine
+import MoveTables
+
+
+"""
+Move ordering for alpha-beta search. Moves are tried in this order:
+hash move, captures and promotions by MVV-LVA (most valuable victim, least valuable attacker),
+the two killer moves of the ply, then quiet moves by their history score.
+
+order() sorts a complete move list. staged_moves() yields the moves in about the same order but
+builds each stage only when the previous one is used up, so a cutoff on the hash move or a good
+capture costs no generation of the quiet moves; captures that give up material wait until the end.
+The hash move and the killers are kept as 16-bit move codes (Move.move_id), not Move objects.
+"""
+
+
+PIECE_ORDER = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+EXCHANGE_VALUES = {'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0}  # a legal king capture never loses the king
+SEE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000}
+# rays from a square towards the pawns that attack it: white pawns capture towards row 0
+PAWN_ATTACK_DIRECTIONS = {'w': ((1, -1), (1, 1)), 'b': ((-1, -1), (-1, 1))}
+
+HASH_MOVE_SCORE = 10000000
+CAPTURE_SCORE = 1000000
+FIRST_KILLER_SCORE = 900000
+SECOND_KILLER_SCORE = 800000
+MAX_PLY = 128
+
+
+"""
+MVV-LVA score of a capture or promotion; a pawn taking a queen scores highest
+"""
+
+
+def mvv_lva(move):
+    victim = PIECE_ORDER[move.piece_captured[1]] if move.piece_captured != "--" else 0
+    if move.is_pawn_promotion:
+        victim += PIECE_ORDER[move.promotion_piece]
+    return victim * 10 - PIECE_ORDER[move.piece_moved[1]]
+
+
+"""
+Static exchange evaluation: the material the side playing a capture or promotion can expect from
+the exchange on its end square, in centipawns, if both sides keep recapturing with their least
+valuable piece and either may stop when it would lose more. Attackers are found by scanning
+the eight rays out from the square, plus the knight squares. A piece behind an attacker on the same ray joins in once the
+attacker has captured. Pins are ignored.
+"""
+
+
+def static_exchange(board, move):
+    square = move.end_row * 8 + move.end_column
+    gone = {(move.start_row, move.start_column)}  # the capturing piece is on the square now
+    if move.is_en_passant:
+        gone.add((move.start_row, move.end_column))
+    knights = {'w': [], 'b': []}
+    for row, column in MoveTables.KNIGHT_TARGETS[square]:
+        piece = board[row][column]
+        if piece[1] == 'N' and (row, column) not in gone:
+            knights[piece[0]].append(SEE_VALUES['N'])
+    rays = []  # per ray, the (color, value) of each piece that can capture along it, nearest first
+    for index, direction in enumerate(MoveTables.DIRECTIONS):
+        line = []
+        for distance, (row, column) in enumerate(MoveTables.RAYS[square][direction], 1):
+            piece = board[row][column]
+            if piece == "--" or (row, column) in gone:
+                continue
+            piece_type = piece[1]
+            if piece_type == 'Q' or piece_type == ('R' if index < 4 else 'B') or distance == 1 and \
+                    (piece_type == 'K' or piece_type == 'P' and direction in PAWN_ATTACK_DIRECTIONS[piece[0]]):
+                line.append((piece[0], SEE_VALUES[piece_type]))
+            else:
+                break  # anything behind is blocked for good
+        if line:
+            rays.append(line)
+
+    gains = [SEE_VALUES[move.piece_captured[1]] if move.piece_captured != "--" else 0]
+    on_square = SEE_VALUES[move.piece_moved[1]]
+    if move.is_pawn_promotion:
+        gains[0] += SEE_VALUES[move.promotion_piece] - SEE_VALUES['P']
+        on_square = SEE_VALUES[move.promotion_piece]
+    side = 'b' if move.piece_moved[0] == 'w' else 'w'
+    while True:
+        value = None
+        line = None
+        if knights[side]:
+            value = min(knights[side])
+        for candidate in rays:
+            if candidate and candidate[0][0] == side and (value is None or candidate[0][1] < value):
+                value = candidate[0][1]
+                line = candidate
+        if value is None:
+            break
+        if line is not None:
+            line.pop(0)
+        else:
+            knights[side].remove(value)
+        gains.append(on_square - gains[-1])  # what the recapturing side has gained so far
+        on_square = value
+        side = 'b' if side == 'w' else 'w'
+    while len(gains) > 1:  # either side may decline to recapture
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
+
+
+"""
+Whether a capture is tried with the good captures: it takes at least as much as the capturing
+piece is worth, or does not lose material in the exchange that follows
+"""
+
+
+def is_winning_capture(board, move):
+    return EXCHANGE_VALUES[move.piece_captured[1]] >= EXCHANGE_VALUES[move.piece_moved[1]] or \
+        static_exchange(board, move) >= 0
+
+
+"""
+Legal moves of the position one stage at a time: the hash move, winning and even captures by
+MVV-LVA, queen promotions, the killer moves, quiet moves by history score (history is a
+[start square][end square] table, or None to keep generation order), under-promotions, then
+losing captures; with defer_losing_captures=False all captures come first. The hash move and
+killers are move codes from elsewhere, only yielded if legal here. When nothing is yielded the game's checkmate
+or stalemate flag is set, as get_valid_moves would.
+"""
+
+
+def staged_moves(game_state, hash_move=None, killers=(), history=None, defer_losing_captures=True):
+    stages = game_state.move_stages()
+    tried = set()  # codes of the moves already yielded out of order
+    if hash_move is not None:
+        move = stages.find(hash_move)
+        if move is not None:
+            tried.add(hash_move)
+            yield move
+
+    losing_captures = []
+    captures = stages.captures()
+    captures.sort(key=mvv_lva, reverse=True)
+    for move in captures:
+        if move.move_id in tried:
+            continue
+        if not defer_losing_captures or is_winning_capture(game_state.board, move):
+            yield move
+        else:
+            losing_captures.append(move)
+
+    under_promotions = []
+    promotions = stages.promotions()
+    for move in promotions:
+        if move.move_id in tried:
+            continue
+        if move.promotion_piece == 'Q':
+            yield move
+        else:
+            under_promotions.append(move)
+
+    quiets = stages.quiets()
+    for killer in killers:
+        if killer is not None and killer not in tried:
+            for move in quiets:
+                if move.move_id == killer:
+                    tried.add(killer)
+                    yield move
+                    break
+    if history is not None:
+        quiets.sort(key=lambda move: history[move.start_row * 8 + move.start_column][move.end_row * 8 + move.end_column],
+                    reverse=True)
+    for move in quiets:
+        if move.move_id not in tried:
+            yield move
+
+    for move in under_promotions + losing_captures:
+        yield move
+
+    if not captures and not promotions and not quiets:  # every legal move is in one of these
+        if game_state.player_is_in_check:
+            game_state.check_mate = True
+        else:
+            game_state.stale_mate = True
+
+
+class MoveOrderer:
+    """
+    killers[ply] holds the codes of the last two quiet moves that cut off at ply; hash_move
+    arguments are move codes too
+    """
+    def __init__(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * 64 for _ in range(64)]  # [start square][end square]
+
+    def clear(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [[0] * 64 for _ in range(64)]
+
+    """
+    Keep what was learned in the previous search, but let new cutoffs outweigh it
+    """
+    def age(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        for row in self.history:
+            for i in range(64):
+                row[i] >>= 1
+
+    def score(self, move, ply, hash_move=None):
+        move_id = move.move_id
+        if move_id == hash_move:
+            return HASH_MOVE_SCORE
+        if move.piece_captured != "--" or move.is_pawn_promotion:
+            return CAPTURE_SCORE + mvv_lva(move)
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        if move_id == killers[0]:
+            return FIRST_KILLER_SCORE
+        if move_id == killers[1]:
+            return SECOND_KILLER_SCORE
+        return self.history[move.start_row * 8 + move.start_column][move.end_row * 8 + move.end_column]
+
+    def order(self, moves, ply, hash_move=None):
+        moves.sort(key=lambda move: self.score(move, ply, hash_move), reverse=True)
+        return moves
+
+    """
+    The legal moves of the position in this orderer's order, generated stage by stage (see staged_moves)
+    """
+    def staged(self, game_state, ply, hash_move=None, defer_losing_captures=True):
+        killers = self.killers[ply] if ply < MAX_PLY else ()
+        return staged_moves(game_state, hash_move, tuple(killers), self.history, defer_losing_captures)
+
+    """
+    A quiet move caused a beta cutoff: remember it as a killer for this ply and credit its history
+    """
+    def record_cutoff(self, move, ply, depth):
+        if move.piece_captured != "--" or move.is_pawn_promotion:
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if move.move_id != killers[0]:
+                killers[1] = killers[0]
+                killers[0] = move.move_id
+        self.history[move.start_row * 8 + move.start_column][move.end_row * 8 + move.end_column] += depth * depth
+
+
+"""
+Search each benchmark position to a fixed depth with and without move ordering and report the
+reduction in nodes searched
+"""
+
+
+def benchmark(depth, backend="bitboard", out=sys.stdout):
+    import Perft
+    import Search
+    rows = []
+    print(f"{'position':<60} {'unordered':>10} {'ordered':>10} {'reduction':>9}", file=out)
+    for moves in Search.BENCHMARK_POSITIONS:
+        nodes = {}
+        for ordering in (False, True):
+            game_state = ChessEngine.Game(backend)
+            Perft.play_moves(game_state, moves)
+            nodes[ordering] = Search.Searcher(ordering=ordering).search(game_state, depth).nodes
+        reduction = 1 - nodes[True] / nodes[False]
+        rows.append({"moves": moves, "unordered": nodes[False], "ordered": nodes[True], "reduction": reduction})
+        print(f"{moves:<60} {nodes[False]:>10} {nodes[True]:>10} {reduction:>9.1%}", file=out)
+    unordered = sum(row["unordered"] for row in rows)
+    ordered = sum(row["ordered"] for row in rows)
+    print(f"{'total':<60} {unordered:>10} {ordered:>10} {1 - ordered / unordered:>9.1%}", file=out)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Node reduction from move ordering")
+    parser.add_argument("-d", "--depth", type=int, default=4, help="search depth per position (default 4)")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    args = parser.parse_args(argv)
+    benchmark(args.depth, args.backend)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
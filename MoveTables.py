@@ -0,0 +1,83 @@
+import threading
+
+
+"""
+Precomputed per-square move tables for the mailbox backend. With these the generators walk
+ready-made lists of on-board squares instead of adding offsets and bounds-checking each target.
+
+Squares are (row, column) pairs, as on Game.board, and tables are indexed by row * 8 + column.
+"""
+
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))  # N, W, S, E
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # NW, NE, SW, SE
+DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+KNIGHT_TARGETS = []  # per square: squares a knight there attacks
+KING_TARGETS = []
+PAWN_ATTACKS = {'w': [], 'b': []}  # per square: squares a pawn of that color there attacks
+RAYS = []  # per square: {direction: squares from the nearest outwards to the board edge}
+BETWEEN = []  # BETWEEN[a][b]: squares strictly between a and b on a shared line, else ()
+TABLE_LOCK = threading.Lock()
+
+
+def offset_targets(row, column, offsets):
+    return tuple((row + d_row, column + d_column) for d_row, d_column in offsets
+                 if 0 <= row + d_row < 8 and 0 <= column + d_column < 8)
+
+
+def ray(row, column, direction):
+    d_row, d_column = direction
+    squares = []
+    end_row, end_column = row + d_row, column + d_column
+    while 0 <= end_row < 8 and 0 <= end_column < 8:
+        squares.append((end_row, end_column))
+        end_row += d_row
+        end_column += d_column
+    return tuple(squares)
+
+
+"""
+Build all tables. Called when the first Game is created so importing the module stays cheap.
+The tables are built in locals and filled in at the end, RAYS last, so a thread that finds RAYS
+filled never sees the others half built; threads arriving during the build wait for it.
+"""
+
+
+def init_tables():
+    if RAYS:
+        return
+    with TABLE_LOCK:
+        if not RAYS:
+            build_tables()
+
+
+def build_tables():
+    knight_targets = []
+    king_targets = []
+    pawn_attacks = {'w': [], 'b': []}
+    rays = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        knight_targets.append(offset_targets(row, column, KNIGHT_OFFSETS))
+        king_targets.append(offset_targets(row, column, KING_OFFSETS))
+        pawn_attacks['w'].append(offset_targets(row, column, ((-1, -1), (-1, 1))))
+        pawn_attacks['b'].append(offset_targets(row, column, ((1, -1), (1, 1))))
+        rays.append({direction: ray(row, column, direction) for direction in DIRECTIONS})
+
+    between = []
+    for a in range(64):
+        between_row = [()] * 64
+        for squares in rays[a].values():
+            for i, (row, column) in enumerate(squares):
+                between_row[row * 8 + column] = squares[:i]
+        between.append(between_row)
+
+    KNIGHT_TARGETS[:] = knight_targets
+    KING_TARGETS[:] = king_targets
+    PAWN_ATTACKS['w'][:] = pawn_attacks['w']
+    PAWN_ATTACKS['b'][:] = pawn_attacks['b']
+    BETWEEN[:] = between
+    RAYS[:] = rays
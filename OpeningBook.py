@@ -0,0 +1,231 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import ChessEngine
+import Fen
+import Pgn
+
+
+"""
+Opening book in the Polyglot file layout: 16-byte big-endian records (key u64, move u16,
+weight u16, learn u32) sorted by key. A lookup maps the file and binary searches it, so opening a
+book costs the same whatever its size and only the pages a lookup touches are read.
+
+Moves are encoded as in Polyglot (to file, to rank, from file, from rank, promotion piece in
+3-bit fields; castling as the king taking its own rook) but the keys are this engine's Zobrist
+keys (Game.zobrist_key), not Polyglot's: books built here and Polyglot books from elsewhere
+have the same layout but don't share positions.
+"""
+
+
+RECORD = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+PROMOTION_CODES = {'N': 1, 'B': 2, 'R': 3, 'Q': 4}
+MAX_WEIGHT = 0xFFFF
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1), "*": (1, 1)}  # weight for (white, black) moves
+
+
+"""
+The 16-bit Polyglot code of a Move
+"""
+
+
+def encode_move(move):
+    end_column = move.end_column
+    if move.is_castling:  # Polyglot writes castling as the king moving onto the rook
+        end_column = 7 if move.end_column > move.start_column else 0
+    code = end_column | (7 - move.end_row) << 3 | move.start_column << 6 | (7 - move.start_row) << 9
+    if move.is_pawn_promotion:
+        code |= PROMOTION_CODES[move.promotion_piece] << 12
+    return code
+
+
+"""
+The legal Move of game_state with the given Polyglot code, or None
+"""
+
+
+def decode_move(game_state, code, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = game_state.get_valid_moves()
+    for move in valid_moves:
+        if encode_move(move) == code:
+            return move
+    return None
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % RECORD.size:
+            self.file.close()
+            raise ValueError(f"{path} is not a book: size {size} is not a multiple of {RECORD.size}")
+        self.count = size // RECORD.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    """
+    (Polyglot move code, weight) of every entry for key, by binary search for the first one
+    """
+    def entries(self, key):
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self.count):
+            entry_key, code, weight, _ = RECORD.unpack_from(data, index * RECORD.size)
+            if entry_key != key:
+                break
+            entries.append((code, weight))
+        return entries
+
+    """
+    Book moves of the current position as (Move, weight) pairs, heaviest first; entries that are not
+    legal here (a hash collision or a damaged book) are skipped
+    """
+    def moves(self, game_state):
+        entries = self.entries(game_state.zobrist_key)
+        if not entries:
+            return []
+        valid_moves = game_state.get_valid_moves()
+        moves = []
+        for code, weight in entries:
+            move = decode_move(game_state, code, valid_moves)
+            if move is not None:
+                moves.append((move, weight))
+        moves.sort(key=lambda pair: -pair[1])
+        return moves
+
+    """
+    A book move for the current position, or None. Picks at random in proportion to weight, or
+    the heaviest move if rng is None.
+    """
+    def choose(self, game_state, rng=random):
+        moves = [(move, weight) for move, weight in self.moves(game_state) if weight > 0]
+        if not moves:
+            return None
+        if rng is None:
+            return moves[0][0]
+        return rng.choices([move for move, _ in moves], [weight for _, weight in moves])[0]
+
+
+"""
+Count every (position key, move code) in the first plies plies of each game, weighted by result:
+2 for the winner's moves, 1 for drawn or unfinished games, 0 for the loser's. Returns
+({(key, code): weight}, games read).
+"""
+
+
+def collect(pgn_games, plies=20, backend="bitboard"):
+    game_state = ChessEngine.Game(backend)
+    weights = {}
+    games = 0
+    for pgn_game in pgn_games:
+        games += 1
+        try:
+            game_state.load_fen(pgn_game.headers.get("FEN", Fen.INITIAL_FEN))
+        except ValueError:
+            continue
+        white_points, black_points = RESULT_POINTS.get(pgn_game.result, (1, 1))
+        for san in pgn_game.moves[:plies]:
+            try:
+                move = Pgn.san_to_move(game_state, san)
+            except Pgn.PgnError:
+                break
+            points = white_points if game_state.white_turn else black_points
+            entry = (game_state.zobrist_key, encode_move(move))
+            weights[entry] = weights.get(entry, 0) + points
+            game_state.make_move(move)
+    return weights, games
+
+
+"""
+Write the book file for collected weights, dropping moves with less than min_weight. Weights of a
+position are scaled down together when the largest does not fit in 16 bits; a positive weight never
+scales down to 0, and a weight of 0 stays 0 (listed, never played). Returns the record count.
+"""
+
+
+def write_book(path, weights, min_weight=1):
+    by_key = {}
+    for (key, code), weight in weights.items():
+        if weight >= min_weight:
+            by_key.setdefault(key, []).append((code, weight))
+    count = 0
+    with open(path, "wb") as file:
+        for key in sorted(by_key):
+            entries = by_key[key]
+            largest = max(weight for _, weight in entries)
+            scale = MAX_WEIGHT / largest if largest > MAX_WEIGHT else 1
+            for code, weight in sorted(entries, key=lambda entry: (-entry[1], entry[0])):
+                scaled = int(weight * scale)
+                file.write(RECORD.pack(key, code, max(1, scaled) if weight > 0 else scaled, 0))
+                count += 1
+    return count
+
+
+def build(pgn_path, book_path, plies=20, min_weight=1, backend="bitboard"):
+    with open(pgn_path, encoding="utf-8", errors="replace") as file:
+        weights, games = collect(Pgn.read_games(file), plies, backend)
+    return write_book(book_path, weights, min_weight), games
+
+
+def main(argv=None):
+    import Perft
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="compile a book from a PGN file")
+    build_parser.add_argument("pgn", help="PGN file")
+    build_parser.add_argument("book", help="book file to write")
+    build_parser.add_argument("-p", "--plies", type=int, default=20, help="plies of each game to use (default 20)")
+    build_parser.add_argument("--min-weight", type=int, default=1, help="drop moves weighing less (default 1)")
+    probe_parser = commands.add_parser("probe", help="list the book moves of a position")
+    probe_parser.add_argument("book", help="book file")
+    probe_parser.add_argument("-m", "--moves", default="", help='moves from the initial position, e.g. "e2e4 e7e5"')
+    probe_parser.add_argument("-f", "--fen", help="position as FEN instead")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        records, games = build(args.pgn, args.book, args.plies, args.min_weight)
+        print(f"{games} games, {records} book entries written to {args.book}")
+        return 0
+
+    game_state = ChessEngine.Game("bitboard")
+    if args.fen:
+        game_state.load_fen(args.fen)
+    Perft.play_moves(game_state, args.moves)
+    with OpeningBook(args.book) as book:
+        moves = book.moves(game_state)
+        total = sum(weight for _, weight in moves)
+        for move, weight in moves:
+            print(f"{move.get_chess_notation():<6} {weight:>6}  {weight / total if total else 0:6.1%}")
+        if not moves:
+            print("not in book")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+import ChessEngine
+import Search
+
+
+"""
+Multi-process search. Python threads cannot run the search on more than one core, so root
+moves are split across a pool of worker processes instead. Each task carries its own copy of
+the Game, and every worker keeps its Searcher (and transposition table) between tasks.
+
+At each depth the best move of the previous iteration is searched first with a full window.
+The remaining root moves then go to the workers, at most one per worker at a time, each
+searched against the best score known when it was handed out.
+"""
+
+
+_searcher = None
+
+
+def init_worker(tt_megabytes):
+    global _searcher
+    _searcher = Search.Searcher(tt_megabytes)
+
+
+"""
+Worker task: score one root move to the given depth. history holds the keys of the positions
+played before the root (Search.game_history). Returns (score, pv, nodes, stopped).
+"""
+
+
+def search_root_move(game_state, move, depth, alpha, time_left, history):
+    searcher = _searcher
+    searcher.nodes = 0
+    searcher.stopped = False
+    searcher.deadline = time.perf_counter() + time_left if time_left is not None else None
+    searcher.path = history + [game_state.zobrist_key]
+    game_state.make_move(move)
+    score, pv = searcher.negamax(game_state, depth - 1, -Search.INFINITY, -alpha, 1)
+    game_state.undo()
+    return -score, [move] + pv, searcher.nodes, searcher.stopped
+
+
+class ParallelSearcher:
+    def __init__(self, workers=None, tt_megabytes=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.tt_megabytes = tt_megabytes
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                                               initargs=(self.tt_megabytes,))
+            # make sure every worker process is running before anything is timed
+            list(self.pool.map(time.sleep, [0.05] * self.workers))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    """
+    Same contract as Search.Searcher.search: iterative deepening to max_depth or until time_limit
+    seconds have passed, returning the SearchResult of the deepest completed iteration.
+    """
+    def search(self, game_state, max_depth=None, time_limit=None, on_iteration=None, history=None):
+        if max_depth is None and time_limit is None:
+            raise ValueError("search needs a depth limit or a time limit")
+        self.start()
+        start = time.perf_counter()
+        deadline = start + time_limit if time_limit is not None else None
+        root_moves = game_state.get_valid_moves()
+        if not root_moves:
+            return Search.SearchResult(None, -Search.MATE_SCORE if game_state.player_is_in_check else 0, [], 0, 0,
+                                       time.perf_counter() - start)
+
+        if history is None:
+            history = Search.game_history(game_state)
+        nodes = 0
+        result = None
+        scores = {}
+        depth = 1
+        while max_depth is None or depth <= max_depth:
+            # best moves of the previous iteration first
+            ordered = sorted(root_moves, key=lambda move: -scores.get(move.move_id, -Search.INFINITY))
+            best_score, best_pv, stopped = -Search.INFINITY, None, False
+            pending = {}
+            next_move = 0
+            while next_move < len(ordered) or pending:
+                # the first move alone, then keep every worker busy
+                limit = 1 if best_pv is None else self.workers
+                while next_move < len(ordered) and len(pending) < limit and not stopped:
+                    move = ordered[next_move]
+                    time_left = deadline - time.perf_counter() if deadline is not None else None
+                    future = self.pool.submit(search_root_move, game_state, move, depth, best_score, time_left,
+                                              history)
+                    pending[future] = move
+                    next_move += 1
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    move = pending.pop(future)
+                    score, pv, move_nodes, move_stopped = future.result()
+                    nodes += move_nodes
+                    if move_stopped:
+                        stopped = True
+                        continue
+                    scores[move.move_id] = score
+                    if score > best_score:
+                        best_score, best_pv = score, pv
+            if stopped or best_pv is None:
+                break
+            result = Search.SearchResult(best_pv[0], best_score, best_pv, depth, nodes, time.perf_counter() - start)
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(best_score) > Search.MATE_THRESHOLD:
+                break
+            depth += 1
+
+        seconds = time.perf_counter() - start
+        if result is None:  # out of time before depth 1 finished
+            return Search.SearchResult(root_moves[0], 0, [root_moves[0]], 0, nodes, seconds)
+        return Search.SearchResult(result.best_move, result.score, result.pv, result.depth, nodes, seconds)
+
+
+"""
+Search every benchmark position to a fixed depth with each worker count and report the time,
+the speed-up over one worker and the efficiency (speed-up per worker)
+"""
+
+
+def benchmark(worker_counts, depth, backend="bitboard", out=sys.stdout):
+    import Perft
+    games = []
+    for moves in Search.BENCHMARK_POSITIONS:
+        game_state = ChessEngine.Game(backend)
+        Perft.play_moves(game_state, moves)
+        games.append(game_state)
+
+    rows = []
+    print(f"{'workers':>7} {'time':>9} {'nodes':>10} {'nps':>9} {'speed-up':>9} {'efficiency':>10} "
+          f"{'node overhead':>13}", file=out)
+    for workers in worker_counts:
+        seconds = 0.0
+        nodes = 0
+        with ParallelSearcher(workers) as searcher:
+            searcher.start()
+            for game_state in games:
+                result = searcher.search(game_state, depth)
+                seconds += result.seconds
+                nodes += result.nodes
+        row = {"workers": workers, "seconds": seconds, "nodes": nodes}
+        rows.append(row)
+        baseline = rows[0]
+        speed_up = baseline["seconds"] / seconds if seconds > 0 else 0.0
+        row.update({"speed_up": speed_up, "efficiency": speed_up * baseline["workers"] / workers,
+                    "node_overhead": nodes / baseline["nodes"] if baseline["nodes"] else 0.0})
+        print(f'{workers:>7} {seconds:>8.2f}s {nodes:>10} {nodes / seconds if seconds > 0 else 0:>9.0f} '
+              f'{row["speed_up"]:>8.2f}x {row["efficiency"]:>10.1%} {row["node_overhead"]:>12.2f}x', file=out)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel root-split search and its scaling benchmark")
+    parser.add_argument("-w", "--workers", type=int, nargs="+",
+                        help="worker counts to benchmark (default 1, 2, 4, ... up to the CPU count)")
+    parser.add_argument("-d", "--depth", type=int, default=4, help="search depth per position (default 4)")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    args = parser.parse_args(argv)
+
+    worker_counts = args.workers
+    if not worker_counts:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+    print(f"{len(Search.BENCHMARK_POSITIONS)} positions, depth {args.depth}, {os.cpu_count()} CPUs")
+    benchmark(worker_counts, args.depth, args.backend)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
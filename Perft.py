@@ -0,0 +1,251 @@
+import argparse
+import sys
+import time
+import ChessEngine
+import Evaluation
+import Instrumentation
+
+
+"""
+Reference positions used to check the move generator. Each position is reached by playing the
+listed moves (in coordinate notation) from its FEN, or from the initial board when it has none,
+and carries the known node counts for depth 1, 2, 3, ...
+"""
+
+
+REFERENCE_POSITIONS = [
+    {
+        "name": "initial",
+        "moves": "",
+        "nodes": (20, 400, 8902, 197281, 4865609),
+    },
+    {
+        "name": "en-passant",
+        "moves": "e2e4 d7d5 e4e5 f7f5",
+        "nodes": (31, 707, 21637, 524138),
+    },
+    {
+        "name": "castled",
+        "moves": "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 e1g1",
+        "nodes": (29, 862, 25740, 782943),
+    },
+    {
+        "name": "check",
+        "moves": "d2d4 e7e5 d4e5 f8b4",
+        "nodes": (5, 163, 3899, 124498),
+    },
+    {
+        "name": "queen-side",
+        "moves": "d2d4 d7d5 c1f4 c8f5 b1c3 b8c6 d1d2 d8d7",
+        "nodes": (35, 1219, 43480, 1535923),
+    },
+    {
+        "name": "pins",
+        "moves": "e2e4 e7e5 g1f3 d7d6 f1b5 c7c6 b5a4 c8g4",
+        "nodes": (26, 892, 24678, 827024),
+    },
+    {
+        # promotions by capture on both sides of g8, and black's h-pawn promoting two plies later
+        "name": "promotion",
+        "moves": "h2h4 g7g5 h4g5 h7h5 g5g6 h5h4 g6g7 h4h3",
+        "nodes": (29, 605, 17953, 426889),
+    },
+    {
+        "name": "kiwipete",
+        "fen": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+        "moves": "",
+        "nodes": (48, 2039, 97862, 4085603),
+    },
+    {
+        "name": "endgame",
+        "fen": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+        "moves": "",
+        "nodes": (14, 191, 2812, 43238, 674624),
+    },
+    {
+        "name": "underpromotion",
+        "fen": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+        "moves": "",
+        "nodes": (6, 264, 9467, 422333),
+    },
+    {
+        "name": "discovered",
+        "fen": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+        "moves": "",
+        "nodes": (44, 1486, 62379, 2103487),
+    },
+]
+
+
+class PerftMismatch(Exception):
+    pass
+
+
+"""
+Play a sequence of moves given in coordinate notation ("e2e4 e7e5", promotions as "g7h8n") on the game
+"""
+
+
+def play_moves(game_state, moves):
+    for notation in moves.split():
+        for move in game_state.get_valid_moves():
+            if move.get_chess_notation() == notation:
+                game_state.make_move(move)
+                break
+        else:
+            raise ValueError(f"Illegal move in sequence: {notation}")
+
+
+"""
+Count the leaf nodes of the legal move tree to the given depth
+"""
+
+
+def perft(game_state, depth):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return game_state.count_valid_moves()
+    valid_moves = game_state.get_valid_moves()
+    nodes = 0
+    for move in valid_moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo()
+    return nodes
+
+
+"""
+perft that also checks the evaluation sums Game keeps against a recomputation after every
+make_move and undo (Evaluation.check_incremental); much slower, for verification only
+"""
+
+
+def checked_perft(game_state, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        Evaluation.check_incremental(game_state)
+        nodes += checked_perft(game_state, depth - 1)
+        game_state.undo()
+        Evaluation.check_incremental(game_state)
+    return nodes
+
+
+"""
+Node counts split by root move, to narrow down which branch a mismatch comes from
+"""
+
+
+def divide(game_state, depth, count=perft):
+    counts = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        counts[move.get_chess_notation()] = count(game_state, depth - 1)
+        game_state.undo()
+    return counts
+
+
+"""
+Everything make_move / undo should give back after a walk of the tree
+"""
+
+
+def snapshot(game_state):
+    return ([row[:] for row in game_state.board], game_state.white_turn, game_state.white_king_location,
+            game_state.black_king_location, game_state.en_passant_valid_square,
+            game_state.castling_rights, len(game_state.move_log), game_state.zobrist_key,
+            game_state.halfmove_clock, game_state.fullmove_number, game_state.middlegame_score,
+            game_state.endgame_score, game_state.phase, game_state.white_material, game_state.black_material)
+
+
+"""
+Run perft on one reference position for every depth up to max_depth and return the result rows.
+Raises PerftMismatch on a wrong node count, or if the game is not restored after the walk, and
+EvaluationMismatch if the evaluation sums drift (at every node with check_evaluation).
+"""
+
+
+def run_position(position, max_depth, show_divide=False, out=sys.stdout, backend="mailbox", check_evaluation=False):
+    results = []
+    game_state = ChessEngine.Game(backend, move_cache_size=0)  # count generated moves, not cache hits
+    if "fen" in position:
+        game_state.load_fen(position["fen"])
+    play_moves(game_state, position["moves"])
+    Evaluation.check_incremental(game_state)
+    count = checked_perft if check_evaluation else perft
+    for depth in range(1, min(max_depth, len(position["nodes"])) + 1):
+        before = snapshot(game_state)
+        start = time.perf_counter()
+        if show_divide:
+            counts = divide(game_state, depth, count)
+            nodes = sum(counts.values())
+        else:
+            nodes = count(game_state, depth)
+        elapsed = time.perf_counter() - start
+        expected = position["nodes"][depth - 1]
+        nps = nodes / elapsed if elapsed > 0 else 0.0
+        results.append({"name": position["name"], "depth": depth, "nodes": nodes, "expected": expected,
+                        "seconds": elapsed, "nps": nps})
+        print(f'{position["name"]:<12} depth {depth}  nodes {nodes:>10}  time {elapsed:8.3f}s  '
+              f'nps {nps:>10.0f}  {"ok" if nodes == expected else "MISMATCH (expected " + str(expected) + ")"}',
+              file=out)
+        if show_divide:
+            for notation in sorted(counts):
+                print(f"    {notation}: {counts[notation]}", file=out)
+        if snapshot(game_state) != before:
+            raise PerftMismatch(f'{position["name"]}: game state not restored after depth {depth}')
+        if nodes != expected:
+            raise PerftMismatch(f'{position["name"]} depth {depth}: {nodes} nodes, expected {expected}')
+    return results
+
+
+def run_suite(max_depth, names=None, show_divide=False, out=sys.stdout, backend="mailbox", check_evaluation=False):
+    results = []
+    for position in REFERENCE_POSITIONS:
+        if names and position["name"] not in names:
+            continue
+        results.extend(run_position(position, max_depth, show_divide, out, backend, check_evaluation))
+    total_nodes = sum(result["nodes"] for result in results)
+    total_time = sum(result["seconds"] for result in results)
+    print(f"total nodes {total_nodes}  time {total_time:.3f}s  "
+          f"nps {total_nodes / total_time if total_time > 0 else 0.0:.0f}", file=out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts for the chess engine")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="maximum depth to search (default 3)")
+    parser.add_argument("-p", "--position", action="append",
+                        choices=[position["name"] for position in REFERENCE_POSITIONS],
+                        help="only run the named reference position (repeatable)")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="mailbox",
+                        help="move generation backend (default mailbox)")
+    parser.add_argument("--divide", action="store_true", help="print the node count for each root move")
+    parser.add_argument("--check-evaluation", action="store_true",
+                        help="recompute the incremental evaluation sums after every move and undo (slow)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="instrument move generation and write the counters and timings to FILE as JSON")
+    args = parser.parse_args(argv)
+    profiler = Instrumentation.Profiler()
+    try:
+        if args.profile:
+            with Instrumentation.profile(profiler):
+                run_suite(args.depth, args.position, args.divide, backend=args.backend,
+                          check_evaluation=args.check_evaluation)
+        else:
+            run_suite(args.depth, args.position, args.divide, backend=args.backend,
+                      check_evaluation=args.check_evaluation)
+    except (PerftMismatch, Evaluation.EvaluationMismatch) as error:
+        print(f"PERFT FAILED: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if args.profile:
+            profiler.dump(args.profile)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
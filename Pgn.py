@@ -0,0 +1,229 @@
+import argparse
+import re
+import sys
+import time
+import Batch
+import ChessEngine
+import Fen
+
+
+"""
+Streaming PGN replay. read_games yields one game at a time while reading the file line by line,
+so archives of any size can be checked without loading them. Each game's SAN moves are resolved
+against Game.get_valid_moves and played with make_move; a move that matches no legal move (or
+more than one) marks the game invalid. Games can be spread over a process pool.
+"""
+
+
+TAG = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class PgnError(Exception):
+    pass
+
+
+class PgnGame:
+    def __init__(self, index, headers, moves, result):
+        self.index = index  # position of the game in the file, from 0
+        self.headers = headers
+        self.moves = moves  # SAN strings
+        self.result = result
+
+
+"""
+Yield a PgnGame for every game in the open text file, reading it line by line. Comments,
+variations, move numbers, NAGs and "e.p." written after an en passant capture are dropped.
+"""
+
+
+def read_games(file):
+    index = 0
+    headers = {}
+    tokens = []
+    in_comment = False
+    variation_depth = 0
+    for line in file:
+        if not in_comment:
+            if line.startswith("%"):
+                continue
+            stripped = line.strip()
+            match = TAG.match(stripped) if variation_depth == 0 else None
+            if match:
+                if tokens:  # a game without a result marker ended here
+                    yield PgnGame(index, headers, tokens, "*")
+                    index += 1
+                    headers, tokens = {}, []
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        position = 0
+        while position < len(line):
+            if in_comment:
+                end = line.find("}", position)
+                if end < 0:
+                    break
+                in_comment = False
+                position = end + 1
+                continue
+            char = line[position]
+            if char == "{":
+                in_comment = True
+                position += 1
+            elif char == ";":
+                break
+            elif char == "(":
+                variation_depth += 1
+                position += 1
+            elif char == ")":
+                variation_depth = max(0, variation_depth - 1)
+                position += 1
+            elif char.isspace():
+                position += 1
+            else:
+                end = position
+                while end < len(line) and not line[end].isspace() and line[end] not in "{;()":
+                    end += 1
+                token = line[position:end]
+                position = end
+                if variation_depth:
+                    continue
+                if token in RESULTS:
+                    yield PgnGame(index, headers, tokens, token)
+                    index += 1
+                    headers, tokens = {}, []
+                    continue
+                token = token.lstrip("0123456789.")  # "12.e4", "12...Nf6"
+                if token and not token.startswith("$") and token.rstrip("+#!?") != "e.p.":
+                    tokens.append(token)
+    if tokens or headers:
+        yield PgnGame(index, headers, tokens, "*")
+
+
+"""
+The legal Move for a SAN string, or PgnError if no legal move or several match it
+"""
+
+
+def san_to_move(game_state, san, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = game_state.get_valid_moves()
+    text = san.rstrip("+#!?")
+    if text.endswith("e.p."):  # "exd6e.p."
+        text = text[:-4].rstrip("+#!?")
+    if text.replace("0", "O") in ("O-O", "O-O-O"):
+        king_side = text.replace("0", "O") == "O-O"
+        for move in valid_moves:
+            if move.is_castling and (move.end_column > move.start_column) == king_side:
+                return move
+        raise PgnError(f"illegal move {san}")
+
+    match = SAN.match(text)
+    if not match:
+        raise PgnError(f"unreadable move {san}")
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece = piece or 'P'
+    end_row = ChessEngine.Move.ranks_to_rows[target[1]]
+    end_column = ChessEngine.Move.files_to_columns[target[0]]
+    candidates = [move for move in valid_moves
+                  if move.end_row == end_row and move.end_column == end_column
+                  and move.piece_moved[1] == piece and not move.is_castling
+                  and (from_file is None or move.start_column == ChessEngine.Move.files_to_columns[from_file])
+                  and (from_rank is None or move.start_row == ChessEngine.Move.ranks_to_rows[from_rank])
+                  and (move.promotion_piece == (promotion or 'Q') if move.is_pawn_promotion else promotion is None)]
+    if len(candidates) != 1:
+        raise PgnError(f"{'illegal' if not candidates else 'ambiguous'} move {san}")
+    return candidates[0]
+
+
+_game = None
+
+
+def init_worker(backend):
+    global _game
+    _game = ChessEngine.Game(backend)
+
+
+"""
+Replay one game on the worker's Game. Returns a dict with the game index, its headers, the number
+of plies played, the error that stopped it (None for a valid game) and, if positions is True, the
+FEN after every ply.
+"""
+
+
+def replay(pgn_game, positions=False):
+    game_state = _game
+    fens = []
+    plies = 0
+    error = None
+    try:
+        game_state.load_fen(pgn_game.headers.get("FEN", Fen.INITIAL_FEN))
+    except ValueError as exception:
+        return {"index": pgn_game.index, "headers": pgn_game.headers, "plies": 0, "error": str(exception),
+                "fens": fens}
+    if positions:
+        fens.append(game_state.get_fen())
+    try:
+        for san in pgn_game.moves:
+            game_state.make_move(san_to_move(game_state, san))
+            plies += 1
+            if positions:
+                fens.append(game_state.get_fen())
+    except PgnError as exception:
+        error = f"ply {plies + 1}: {exception}"
+    return {"index": pgn_game.index, "headers": pgn_game.headers, "plies": plies, "error": error,
+            "fens": fens}
+
+
+def replay_task(pgn_games, positions):
+    return [replay(pgn_game, positions) for pgn_game in pgn_games]
+
+
+"""
+Replay every game from an iterable of PgnGames and yield the replay dicts, in file order or,
+with ordered=False, as soon as each chunk of games is done
+"""
+
+
+def replay_games(pgn_games, workers=1, ordered=True, positions=False, chunk_size=32, backend="bitboard"):
+    return Batch.run_chunks(pgn_games, replay_task, (positions,), workers, chunk_size, init_worker, (backend,),
+                            ordered)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and validate the games of a PGN file")
+    parser.add_argument("file", help="PGN file")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="worker processes (default 1)")
+    parser.add_argument("-u", "--unordered", action="store_true",
+                        help="report games as they finish instead of in file order")
+    parser.add_argument("-p", "--positions", metavar="FILE", help="write the FEN after every ply to FILE")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    args = parser.parse_args(argv)
+
+    games = plies = invalid = 0
+    start = time.perf_counter()
+    positions = open(args.positions, "w") if args.positions else None
+    try:
+        with open(args.file, encoding="utf-8", errors="replace") as file:
+            for result in replay_games(read_games(file), args.workers, not args.unordered, positions is not None,
+                                       backend=args.backend):
+                games += 1
+                plies += result["plies"]
+                if result["error"] is not None:
+                    invalid += 1
+                    headers = result["headers"]
+                    print(f'game {result["index"] + 1} ({headers.get("White", "?")} - {headers.get("Black", "?")}): '
+                          f'{result["error"]}')
+                if positions is not None:
+                    positions.writelines(fen + "\n" for fen in result["fens"])
+    finally:
+        if positions is not None:
+            positions.close()
+    seconds = time.perf_counter() - start
+    print(f"{games} games ({invalid} invalid), {plies} plies in {seconds:.2f}s: "
+          f"{games / seconds if seconds > 0 else 0:.1f} games/s, {plies / seconds if seconds > 0 else 0:.0f} plies/s")
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
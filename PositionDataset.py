@@ -0,0 +1,323 @@
+import argparse
+import os
+import sys
+import numpy as np
+import BatchEvaluation
+import ChessEngine
+import Evaluation
+import Fen
+import Pgn
+import Search
+
+
+"""
+Position datasets for training and analysis in a compact binary file: a 16-byte header (magic,
+format version, record size) followed by fixed-width 39-byte records, one per position:
+
+    board            32 bytes  two squares per byte, Game.board order (a8 first), the even square
+                               in the low four bits; each square is its BatchEvaluation piece code
+                               (1-6 white, negatives black, 0 empty) as a signed 4-bit number
+    white_to_move     u8       1 or 0
+    castling_rights   u8       Game.castling_rights bits
+    en_passant        u8       square (row * 8 + column) a pawn may capture onto, or 255 for none
+    halfmove_clock    u8       capped at 255
+    score            i16       centipawns from white's side, clipped to the int16 range
+    result            i8       1 white won, 0 draw, -1 black won, -128 unknown
+
+On replayed games the records take 62% of the space of the same positions as FEN text, which
+carries no score or result, and they need no parsing to read back.
+
+DatasetWriter streams Game states to a file, buffering records and writing them in blocks, so
+self-play or a PGN replay can export as it goes. PositionDataset maps a file with numpy.memmap:
+indexing gives records straight from the page cache (a slice is a view, no copy), and batches()
+walks the file in order or shuffled without ever holding more than a window of it in memory, so
+files larger than RAM work the same as small ones. boards() unpacks records into the (N, 64) int8
+array BatchEvaluation.evaluate_batch takes.
+"""
+
+
+MAGIC = b"CHESSPOS"
+VERSION = 1
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("record_size", "<u4")])
+RECORD = np.dtype([("board", "u1", 32), ("white_to_move", "u1"), ("castling_rights", "u1"), ("en_passant", "u1"),
+                   ("halfmove_clock", "u1"), ("score", "<i2"), ("result", "i1")])
+NO_EN_PASSANT = 255
+SCORE_LIMIT = 32767
+WHITE_WIN, DRAW, BLACK_WIN, UNKNOWN_RESULT = 1, 0, -1, -128
+RESULTS = {"1-0": WHITE_WIN, "1/2-1/2": DRAW, "0-1": BLACK_WIN}  # PGN result tags; anything else is unknown
+BUFFER_RECORDS = 4096  # records a writer collects before writing them out
+SHUFFLE_BLOCK = 4096  # records read together by shuffled batching
+SHUFFLE_WINDOW = 64  # blocks shuffled together
+
+
+"""
+The 32 packed board bytes of (N, 64) int8 piece codes, and back
+"""
+
+
+def pack_boards(boards):
+    nibbles = np.asarray(boards, dtype=np.int8).view(np.uint8) & 0x0F
+    return nibbles[..., 0::2] | (nibbles[..., 1::2] << 4)
+
+
+def unpack_boards(packed):
+    packed = np.asarray(packed, dtype=np.uint8)
+    nibbles = np.empty(packed.shape[:-1] + (64,), dtype=np.uint8)
+    nibbles[..., 0::2] = packed & 0x0F
+    nibbles[..., 1::2] = packed >> 4
+    return ((nibbles ^ 8).view(np.int8) - 8).astype(np.int8)  # sign-extend the 4-bit codes
+
+
+"""
+Fill one record (an element of a RECORD array) from a Game; score is from white's side
+"""
+
+
+def encode_position(game_state, record, score=0, result=UNKNOWN_RESULT, codes=None):
+    codes = BatchEvaluation.encode_board(game_state.board, codes)
+    record["board"] = pack_boards(codes)
+    record["white_to_move"] = game_state.white_turn
+    record["castling_rights"] = game_state.castling_rights
+    square = game_state.en_passant_valid_square
+    record["en_passant"] = square[0] * 8 + square[1] if square != () else NO_EN_PASSANT
+    record["halfmove_clock"] = min(game_state.halfmove_clock, 255)
+    record["score"] = max(-SCORE_LIMIT, min(SCORE_LIMIT, score))
+    record["result"] = result
+
+
+"""
+FEN of one record; the fullmove number is not stored and comes out as 1
+"""
+
+
+def record_fen(record):
+    codes = unpack_boards(record["board"])
+    pieces = {code: piece for piece, code in BatchEvaluation.PIECE_CODES.items()}
+    board = [[pieces[int(code)] for code in codes[row * 8:row * 8 + 8]] for row in range(8)]
+    rights = int(record["castling_rights"])
+    square = int(record["en_passant"])
+    return Fen.make_fen(board, bool(record["white_to_move"]),
+                        (bool(rights & ChessEngine.WHITE_KING_SIDE), bool(rights & ChessEngine.WHITE_QUEEN_SIDE),
+                         bool(rights & ChessEngine.BLACK_KING_SIDE), bool(rights & ChessEngine.BLACK_QUEEN_SIDE)),
+                        divmod(square, 8) if square != NO_EN_PASSANT else (), int(record["halfmove_clock"]))
+
+
+"""
+(boards, white_to_move) of a record array, as BatchEvaluation.from_games returns them
+"""
+
+
+def boards(records):
+    return unpack_boards(records["board"]), records["white_to_move"].astype(bool)
+
+
+def read_header(file, path):
+    header = np.frombuffer(file.read(HEADER.itemsize), dtype=HEADER, count=-1)
+    if len(header) != 1 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{path} is not a position dataset")
+    if header["version"][0] != VERSION or header["record_size"][0] != RECORD.itemsize:
+        raise ValueError(f"{path} has dataset format version {header['version'][0]} with "
+                         f"{header['record_size'][0]}-byte records, expected version {VERSION}")
+
+
+class DatasetWriter:
+    """
+    Writes positions to a dataset file as they come. With append=True an existing dataset is
+    extended, otherwise the file is replaced. Records are written in blocks of buffer_records, and
+    on flush() and close().
+    """
+    def __init__(self, path, append=False, buffer_records=BUFFER_RECORDS):
+        self.path = path
+        if append and os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as file:
+                read_header(file, path)
+            size = os.path.getsize(path) - HEADER.itemsize
+            if size % RECORD.itemsize:
+                raise ValueError(f"{path} ends in a partial record")
+            self.file = open(path, "ab")
+        else:
+            self.file = open(path, "wb")
+            header = np.zeros(1, dtype=HEADER)
+            header[0] = (MAGIC, VERSION, RECORD.itemsize)
+            self.file.write(header.tobytes())
+        self.buffer = np.zeros(buffer_records, dtype=RECORD)
+        self.codes = np.empty(64, dtype=np.int8)
+        self.pending = 0
+        self.count = 0  # records written by this writer
+
+    """
+    Add the current position of game_state with its score (centipawns from white's side) and the
+    result of its game
+    """
+    def write(self, game_state, score=0, result=UNKNOWN_RESULT):
+        encode_position(game_state, self.buffer[self.pending], score, result, self.codes)
+        self.pending += 1
+        self.count += 1
+        if self.pending == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(self.buffer[:self.pending].tobytes())
+            self.pending = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PositionDataset:
+    """
+    A dataset file mapped read-only. records is a RECORD array backed by the file; dataset[i] and
+    dataset[a:b] index it without copying, an index array copies just the records it picks.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            read_header(file, path)
+        size = os.path.getsize(path) - HEADER.itemsize
+        if size % RECORD.itemsize:
+            raise ValueError(f"{path} ends in a partial record")
+        self.count = size // RECORD.itemsize
+        if self.count:
+            self.records = np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.itemsize, shape=(self.count,))
+        else:
+            self.records = np.zeros(0, dtype=RECORD)  # numpy cannot map an empty range
+
+    def close(self):
+        mapping = getattr(self.records, "_mmap", None)
+        self.records = np.zeros(0, dtype=RECORD)
+        if mapping is not None:
+            mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    """
+    Record arrays of batch_size positions (the last one may be shorter) covering the dataset once.
+    In order they are views of the mapping. Shuffled, the file is cut into blocks of block_records;
+    the blocks are visited in random order, window_blocks at a time, and the records of a window
+    are dealt out in random order, so memory holds one window of indices and one batch of records
+    whatever the file size.
+    """
+    def batches(self, batch_size, shuffle=False, seed=None, block_records=SHUFFLE_BLOCK, window_blocks=SHUFFLE_WINDOW):
+        if not shuffle:
+            for start in range(0, self.count, batch_size):
+                yield self.records[start:start + batch_size]
+            return
+        rng = np.random.default_rng(seed)
+        block_count = -(-self.count // block_records)
+        block_order = rng.permutation(block_count)
+        pending = np.zeros(0, dtype=np.int64)
+        for first in range(0, block_count, window_blocks):
+            window = [np.arange(block * block_records, min((block + 1) * block_records, self.count))
+                      for block in block_order[first:first + window_blocks]]
+            indices = np.concatenate([pending, rng.permutation(np.concatenate(window))])
+            full = len(indices) - len(indices) % batch_size
+            for start in range(0, full, batch_size):
+                yield self.records[indices[start:start + batch_size]]
+            pending = indices[full:]
+        if len(pending):
+            yield self.records[pending]
+
+
+"""
+Replay PGN games into a writer: every position of each game (after skip_plies plies) with the
+game's result and a score, the static evaluation with depth 0 or else a search to that depth.
+Games stop at the first move that does not replay; games whose FEN does not load are skipped and
+not counted. Returns (games, positions written).
+"""
+
+
+def export_pgn(pgn_games, writer, depth=0, skip_plies=0, backend="bitboard"):
+    game_state = ChessEngine.Game(backend)
+    searcher = Search.Searcher() if depth > 0 else None
+    games = 0
+    start_count = writer.count
+    for pgn_game in pgn_games:
+        try:
+            game_state.load_fen(pgn_game.headers.get("FEN", Fen.INITIAL_FEN))
+        except ValueError:
+            continue
+        games += 1
+        result = RESULTS.get(pgn_game.result, UNKNOWN_RESULT)
+        for ply in range(len(pgn_game.moves) + 1):
+            if ply >= skip_plies:
+                if searcher is None:
+                    score = Evaluation.evaluate(game_state)  # from the sums Game keeps
+                else:
+                    score = searcher.search(game_state, depth).score
+                writer.write(game_state, score if game_state.white_turn else -score, result)
+            if ply == len(pgn_game.moves):
+                break
+            try:
+                game_state.make_move(Pgn.san_to_move(game_state, pgn_game.moves[ply]))
+            except Pgn.PgnError:
+                break
+    return games, writer.count - start_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export positions to a binary dataset or inspect one")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write the positions of a PGN file")
+    export_parser.add_argument("pgn", help="PGN file")
+    export_parser.add_argument("dataset", help="dataset file to write")
+    export_parser.add_argument("-d", "--depth", type=int, default=0,
+                               help="score by a search to this depth (default 0: static evaluation)")
+    export_parser.add_argument("-s", "--skip-plies", type=int, default=0, help="leave out each game's first plies")
+    export_parser.add_argument("-a", "--append", action="store_true", help="add to an existing dataset")
+    info_parser = commands.add_parser("info", help="count the positions and results of a dataset")
+    info_parser.add_argument("dataset", help="dataset file")
+    sample_parser = commands.add_parser("sample", help="print random positions of a dataset as FEN")
+    sample_parser.add_argument("dataset", help="dataset file")
+    sample_parser.add_argument("-n", "--count", type=int, default=10, help="positions to print (default 10)")
+    sample_parser.add_argument("--seed", type=int, help="random seed")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        with open(args.pgn, encoding="utf-8", errors="replace") as file, \
+                DatasetWriter(args.dataset, args.append) as writer:
+            games, positions = export_pgn(Pgn.read_games(file), writer, args.depth, args.skip_plies)
+        print(f"{games} games, {positions} positions written to {args.dataset} "
+              f"({positions * RECORD.itemsize} bytes of records)")
+        return 0
+
+    with PositionDataset(args.dataset) as dataset:
+        if args.command == "info":
+            print(f"{len(dataset)} positions, {RECORD.itemsize} bytes each")
+            counts = {WHITE_WIN: 0, DRAW: 0, BLACK_WIN: 0, UNKNOWN_RESULT: 0}
+            for batch in dataset.batches(1 << 20):  # in steps, to keep memory flat on large files
+                for value in counts:
+                    counts[value] += int(np.count_nonzero(batch["result"] == value))
+            for name, value in (("white wins", WHITE_WIN), ("draws", DRAW), ("black wins", BLACK_WIN),
+                                ("unknown", UNKNOWN_RESULT)):
+                print(f"{name:<11} {counts[value]:>10}")
+            return 0
+        if len(dataset):
+            rng = np.random.default_rng(args.seed)
+            for index in np.sort(rng.choice(len(dataset), min(args.count, len(dataset)), replace=False)):
+                record = dataset[index]
+                print(f"{index:>10} {int(record['score']):>6} {int(record['result']):>4}  {record_fen(record)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
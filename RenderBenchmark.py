@@ -0,0 +1,147 @@
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # before pygame is imported: no window or display needed
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import sys
+import time
+import pygame as pg
+import ChessEngine
+import Constants as C
+import Renderer
+import Search
+
+
+"""
+Off-screen rendering benchmark. Replays scripted games through Renderer under SDL's dummy video
+driver and times every frame by kind:
+
+    idle      nothing changed since the last frame
+    select    a piece is selected and its targets highlighted
+    move      the frame after a move, with the selection cleared
+    animate   each frame of Renderer.animate_move
+    text      a frame with the end-of-game text over the board
+    full      the whole board repainted (what every frame cost before the dirty-rectangle renderer)
+
+Runs on machines without a display, so it can catch rendering regressions in CI.
+"""
+
+
+FRAME_KINDS = ("idle", "select", "move", "animate", "text", "full")
+
+
+def load_images():
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images1")
+    for piece in ("bR", "bN", "bB", "bQ", "bK", "bP", "wR", "wN", "wB", "wQ", "wK", "wP"):
+        C.IMAGES[piece] = pg.transform.scale(pg.image.load(os.path.join(directory, piece + ".png")).convert_alpha(),
+                                             (C.SQUARE_SIZE, C.SQUARE_SIZE))
+
+
+class FrameClock:
+    """
+    Stands in for pg.time.Clock in animate_move: records the time since the previous tick instead of
+    waiting for the next frame
+    """
+    def __init__(self, times):
+        self.times = times
+        self.last = time.perf_counter_ns()
+
+    def start(self):
+        self.last = time.perf_counter_ns()
+
+    def tick(self, framerate=0):
+        now = time.perf_counter_ns()
+        self.times.append(now - self.last)
+        self.last = now
+        return 0
+
+
+def timed_draw(renderer, times, *args):
+    start = time.perf_counter_ns()
+    renderer.draw(*args)
+    times.append(time.perf_counter_ns() - start)
+
+
+def find_move(game_state, notation):
+    for move in game_state.get_valid_moves():
+        if move.get_chess_notation() == notation:
+            return move
+    raise ValueError(f"Illegal move in sequence: {notation}")
+
+
+"""
+Play each move sequence from the initial position, timing the frames around every move. Returns
+{frame kind: [nanoseconds, ...]}.
+"""
+
+
+def run(renderer, games, idle_frames=5):
+    times = {kind: [] for kind in FRAME_KINDS}
+    clock = FrameClock(times["animate"])
+    for moves in games:
+        game_state = ChessEngine.Game()
+        renderer.invalidate()
+        valid_moves = game_state.get_valid_moves()
+        renderer.draw(game_state, valid_moves, ())
+        for notation in moves.split():
+            move = find_move(game_state, notation)
+            for _ in range(idle_frames):
+                timed_draw(renderer, times["idle"], game_state, valid_moves, ())
+            timed_draw(renderer, times["select"], game_state, valid_moves, (move.start_row, move.start_column))
+            game_state.make_move(move)
+            clock.start()
+            renderer.animate_move(move, game_state.board, clock)
+            valid_moves = game_state.get_valid_moves()
+            timed_draw(renderer, times["move"], game_state, valid_moves, ())
+            timed_draw(renderer, times["text"], game_state, valid_moves, (), "Stalemate")
+            timed_draw(renderer, times["text"], game_state, valid_moves, ())  # and take it away again
+            renderer.invalidate()
+            timed_draw(renderer, times["full"], game_state, valid_moves, ())
+    return times
+
+
+def summary(nanoseconds):
+    if not nanoseconds:
+        return {"frames": 0}
+    ordered = sorted(nanoseconds)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1e3
+
+    return {"frames": len(ordered), "mean_us": sum(ordered) / len(ordered) / 1e3, "p50_us": percentile(0.5),
+            "p90_us": percentile(0.9), "p99_us": percentile(0.99), "max_us": ordered[-1] / 1e3}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time rendering frames off-screen with the SDL dummy driver")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="times to replay the scripted games (default 3)")
+    parser.add_argument("-i", "--idle", type=int, default=5, help="idle frames before each move (default 5)")
+    parser.add_argument("--json", metavar="FILE", help="also write the summary as JSON to FILE")
+    args = parser.parse_args(argv)
+
+    pg.init()
+    screen = pg.display.set_mode((C.BOARD_WIDTH, C.BOARD_HEIGHT))
+    load_images()
+    renderer = Renderer.Renderer(screen)
+    times = {kind: [] for kind in FRAME_KINDS}
+    for _ in range(args.repeat):
+        for kind, frame_times in run(renderer, Search.BENCHMARK_POSITIONS, args.idle).items():
+            times[kind] += frame_times
+    pg.quit()
+
+    results = {kind: summary(frame_times) for kind, frame_times in times.items()}
+    print(f"{'frame':<8} {'frames':>7} {'mean us':>9} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>9}")
+    for kind, result in results.items():
+        if result["frames"]:
+            print(f"{kind:<8} {result['frames']:>7} {result['mean_us']:9.1f} {result['p50_us']:9.1f} "
+                  f"{result['p90_us']:9.1f} {result['p99_us']:9.1f} {result['max_us']:9.1f}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import pygame as pg
+import Constants as C
+
+
+"""
+Dirty-rectangle drawing for the board window. The checkerboard is rendered once to a surface;
+each frame compares what every square should show (piece and highlight) with what it shows now,
+repaints only the squares that differ and passes just their rectangles to pg.display.update.
+An unchanged position costs 64 comparisons and no drawing. Fonts and rendered text are cached.
+"""
+
+
+SQUARE_COLORS = ("light gray", "dark gray")
+NO_HIGHLIGHT, SELECTED, TARGET = 0, 1, 2
+HIGHLIGHT_COLORS = {SELECTED: "blue", TARGET: "yellow"}
+TEXT_FONT = ("Adobe Arabic", 64, True, False)  # name, size, bold, italic
+TEXT_COLOR = "purple"
+FRAMES_PER_SQUARE = 5
+
+
+def square_rect(row, column):
+    return pg.Rect(column * C.SQUARE_SIZE, row * C.SQUARE_SIZE, C.SQUARE_SIZE, C.SQUARE_SIZE)
+
+
+class Renderer:
+    def __init__(self, screen):
+        self.screen = screen
+        self.board_surface = pg.Surface((C.BOARD_WIDTH, C.BOARD_HEIGHT)).convert()
+        for row in range(C.DIMENSION):
+            for column in range(C.DIMENSION):
+                self.board_surface.fill(pg.Color(SQUARE_COLORS[(row + column) % 2]), square_rect(row, column))
+        self.highlights = {}
+        for highlight, color in HIGHLIGHT_COLORS.items():
+            surface = pg.Surface((C.SQUARE_SIZE, C.SQUARE_SIZE)).convert()
+            surface.set_alpha(C.TRANSPARENCY)
+            surface.fill(pg.Color(color))
+            self.highlights[highlight] = surface
+        self.rects = [[square_rect(row, column) for column in range(C.DIMENSION)] for row in range(C.DIMENSION)]
+        self.fonts = {}
+        self.texts = {}
+        self.invalidate()
+
+    """
+    Forget what is on screen so the next draw repaints everything, e.g. after the window was exposed
+    """
+    def invalidate(self):
+        self.shown = [[None] * C.DIMENSION for _ in range(C.DIMENSION)]  # (piece, highlight) per square
+        self.shown_text = None
+
+    def font(self, name, size, bold=False, italic=False):
+        key = (name, size, bold, italic)
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = pg.font.SysFont(name, size, bold, italic)
+        return font
+
+    """
+    The rendered surface for text and its rectangle, centred on the board
+    """
+    def text(self, text):
+        entry = self.texts.get(text)
+        if entry is None:
+            surface = self.font(*TEXT_FONT).render(text, False, pg.Color(TEXT_COLOR))
+            entry = self.texts[text] = (surface, surface.get_rect(center=(C.BOARD_WIDTH // 2, C.BOARD_HEIGHT // 2)))
+        return entry
+
+    def draw_square(self, row, column, piece, highlight):
+        rect = self.rects[row][column]
+        self.screen.blit(self.board_surface, rect, rect)
+        if highlight != NO_HIGHLIGHT:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(C.IMAGES[piece], rect)
+        self.shown[row][column] = (piece, highlight)
+        return rect
+
+    """
+    What each square should show: the selected square of the side to move and its legal targets
+    are highlighted
+    """
+    @staticmethod
+    def highlight_map(game_state, valid_moves, square_selected):
+        highlighted = {}
+        if square_selected != ():
+            row, column = square_selected
+            if game_state.board[row][column][0] == ('w' if game_state.white_turn else 'b'):
+                highlighted[square_selected] = SELECTED
+                for move in valid_moves:
+                    if move.start_row == row and move.start_column == column:
+                        highlighted[(move.end_row, move.end_column)] = TARGET
+        return highlighted
+
+    """
+    Bring the screen up to date with the game and update only the rectangles that changed.
+    text, if given, is drawn over the middle of the board. Returns the updated rectangles.
+    """
+    def draw(self, game_state, valid_moves, square_selected, text=None):
+        board = game_state.board
+        highlighted = self.highlight_map(game_state, valid_moves, square_selected)
+        shown = self.shown
+        dirty = []
+        if self.shown_text is not None and self.shown_text != text:  # uncover the squares under the old text
+            text_rect = self.text(self.shown_text)[1]
+            for row in range(C.DIMENSION):
+                for column in range(C.DIMENSION):
+                    if self.rects[row][column].colliderect(text_rect):
+                        shown[row][column] = None
+            self.shown_text = None
+
+        for row in range(C.DIMENSION):
+            board_row = board[row]
+            shown_row = shown[row]
+            for column in range(C.DIMENSION):
+                wanted = (board_row[column], highlighted.get((row, column), NO_HIGHLIGHT))
+                if shown_row[column] != wanted:
+                    dirty.append(self.draw_square(row, column, *wanted))
+
+        if text is not None:
+            surface, text_rect = self.text(text)
+            if self.shown_text != text or text_rect.collidelist(dirty) != -1:
+                self.screen.blit(surface, text_rect)
+                dirty.append(text_rect)
+                self.shown_text = text
+        if dirty:
+            pg.display.update(dirty)
+        return dirty
+
+    """
+    Slide the moved piece from its start to its end square; board is the position after the move.
+    The static pieces are drawn once to a background surface and each frame only the rectangle the
+    piece leaves and the one it enters are redrawn.
+    """
+    def animate_move(self, move, board, clock):
+        background = self.board_surface.copy()
+        for row in range(C.DIMENSION):
+            for column in range(C.DIMENSION):
+                piece = board[row][column]
+                if (row, column) == (move.end_row, move.end_column):  # the captured piece stays until the end
+                    piece = move.piece_captured if not move.is_en_passant else "--"
+                if piece != "--":
+                    background.blit(C.IMAGES[piece], self.rects[row][column])
+        self.screen.blit(background, (0, 0))
+        pg.display.update(pg.Rect(0, 0, C.BOARD_WIDTH, C.BOARD_HEIGHT))
+
+        image = C.IMAGES[move.piece_moved]
+        delta_row = move.end_row - move.start_row
+        delta_column = move.end_column - move.start_column
+        frame_count = (abs(delta_row) + abs(delta_column)) * FRAMES_PER_SQUARE
+        previous = square_rect(move.start_row, move.start_column)
+        for frame in range(frame_count + 1):
+            row = move.start_row + delta_row * frame / frame_count
+            column = move.start_column + delta_column * frame / frame_count
+            current = pg.Rect(round(column * C.SQUARE_SIZE), round(row * C.SQUARE_SIZE), C.SQUARE_SIZE, C.SQUARE_SIZE)
+            self.screen.blit(background, previous, previous)
+            self.screen.blit(image, current)
+            pg.display.update(previous.union(current))
+            previous = current
+            clock.tick(C.FPS)
+
+        # the screen now shows the background with the moved piece on top of its end square
+        for row in range(C.DIMENSION):
+            for column in range(C.DIMENSION):
+                self.shown[row][column] = (board[row][column], NO_HIGHLIGHT)
+        self.shown[move.end_row][move.end_column] = None
+        self.shown_text = None
@@ -0,0 +1,345 @@
+import argparse
+import sys
+import time
+import ChessEngine
+import Evaluation
+import MoveOrdering
+import Tablebase
+import TranspositionTable
+
+
+"""
+Negamax alpha-beta search with iterative deepening, driven entirely through
+Game.get_valid_moves, Game.make_move and Game.undo.
+"""
+
+
+MATE_SCORE = 100000
+MATE_THRESHOLD = MATE_SCORE - 1000  # scores beyond this are mates, stored relative to the node in the TT
+INFINITY = MATE_SCORE + 1
+TIME_CHECK_INTERVAL = 1024  # nodes between clock checks
+DELTA_MARGIN = 200  # a capture is skipped in quiescence if even this much on top of the piece taken can't raise alpha
+
+# fixed positions for benchmarks, as move sequences from the initial position
+BENCHMARK_POSITIONS = [
+    "e2e4 e7e5 g1f3 b8c6 f1c4 g8f6",
+    "d2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7",
+    "e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6",
+    "e2e4 e7e5 g1f3 d7d6 f1b5 c7c6 b5a4 c8g4",
+]
+
+
+class SearchResult:
+    def __init__(self, best_move, score, pv, depth, nodes, seconds, from_book=False, from_tablebase=False):
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.nps = nodes / seconds if seconds > 0 else 0.0
+        self.from_book = from_book  # played from the opening book without searching
+        self.from_tablebase = from_tablebase  # looked up in the endgame tablebases without searching
+
+    def __str__(self):
+        if self.from_book:
+            return f'book move {self.best_move.get_chess_notation()}'
+        if self.from_tablebase:
+            return f'tablebase move {self.best_move.get_chess_notation()}  score {self.score}'
+        return f'depth {self.depth}  score {self.score}  nodes {self.nodes}  time {self.seconds:.3f}s  ' \
+               f'nps {self.nps:.0f}  pv {" ".join(move.get_chess_notation() for move in self.pv)}'
+
+
+class Searcher:
+    """
+    ordering=False searches moves in generation order, with only the hash move tried first.
+    book, an OpeningBook.OpeningBook, is checked before every search; a book move is played at once.
+    tablebases, a Tablebase.Tablebases, likewise answers positions it covers without a search.
+    quiescence=False scores the horizon with the static evaluation instead of a quiescence search.
+    """
+    def __init__(self, tt_megabytes=16, ordering=True, book=None, tablebases=None, quiescence=True):
+        self.tt = TranspositionTable.TranspositionTable(tt_megabytes)
+        self.ordering = ordering
+        self.book = book
+        self.tablebases = tablebases
+        self.quiescence_search = quiescence
+        self.orderer = MoveOrdering.MoveOrderer()
+        self.nodes = 0
+        self.stopped = False
+        self.stop_requested = False  # set from another thread by stop()
+        self.deadline = None
+
+    """
+    Ask a search running in another thread to finish early. It notices within TIME_CHECK_INTERVAL
+    nodes and returns its last complete iteration; the request stays set until the caller clears
+    stop_requested, so a search started afterwards stops at once.
+    """
+    def stop(self):
+        self.stop_requested = True
+
+    """
+    Search the current position. Stops after max_depth plies, or when time_limit seconds have passed,
+    whichever comes first; the result of the deepest fully searched iteration is returned.
+    on_iteration, if given, is called with the SearchResult of every completed depth.
+    history lists the Zobrist keys of the game's earlier positions (see game_history), which count
+    as repetitions like positions on the search line; by default it is read from game_state's move log.
+    """
+    def search(self, game_state, max_depth=None, time_limit=None, on_iteration=None, history=None):
+        if max_depth is None and time_limit is None:
+            raise ValueError("search needs a depth limit or a time limit")
+        start = time.perf_counter()
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.nodes = 0
+        self.stopped = False
+        self.path = list(history) if history is not None else game_history(game_state)
+        self.orderer.age()
+        result = None
+
+        root_moves = game_state.get_valid_moves()
+        if not root_moves:
+            return SearchResult(None, -MATE_SCORE if game_state.player_is_in_check else 0, [], 0, 0,
+                                time.perf_counter() - start)
+        if self.book is not None:
+            book_move = self.book.choose(game_state)
+            if book_move is not None:
+                return SearchResult(book_move, 0, [book_move], 0, 0, time.perf_counter() - start, from_book=True)
+        if self.tablebases is not None:
+            outcome = self.tablebases.probe(game_state)
+            best_move = self.tablebases.best_move(game_state) if outcome is not None else None
+            if best_move is not None:
+                result, plies = outcome
+                score = 0 if result == Tablebase.DRAW else result * (MATE_SCORE - plies)
+                return SearchResult(best_move, score, [best_move], 0, 0, time.perf_counter() - start,
+                                    from_tablebase=True)
+        depth = 1
+        while max_depth is None or depth <= max_depth:
+            score, pv = self.negamax(game_state, depth, -INFINITY, INFINITY, 0)
+            if self.stopped:
+                break
+            result = SearchResult(pv[0], score, pv, depth, self.nodes, time.perf_counter() - start)
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(score) > MATE_THRESHOLD:  # forced mate found, deeper search cannot change it
+                break
+            depth += 1
+
+        if result is None:  # out of time before depth 1 finished
+            result = SearchResult(root_moves[0], 0, [root_moves[0]], 0, self.nodes, time.perf_counter() - start)
+        else:
+            result.nodes = self.nodes
+            result.seconds = time.perf_counter() - start
+            result.nps = result.nodes / result.seconds if result.seconds > 0 else 0.0
+        return result
+
+    """
+    Score of the position for the side to move, and the principal variation from here
+    """
+    def negamax(self, game_state, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and \
+                (self.stop_requested or self.deadline is not None and time.perf_counter() > self.deadline):
+            self.stopped = True
+        if self.stopped:
+            return 0, []
+
+        key = game_state.zobrist_key
+        if ply > 0 and key in self.path:  # repetition along the current line or of a position played before
+            return 0, []
+
+        original_alpha = alpha
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = score_from_tt(entry[2], ply)
+                if entry[3] == TranspositionTable.EXACT or \
+                        (entry[3] == TranspositionTable.LOWER_BOUND and score >= beta) or \
+                        (entry[3] == TranspositionTable.UPPER_BOUND and score <= alpha):
+                    return score, [ChessEngine.Move.from_id(tt_move, game_state.board)] if tt_move is not None else []
+
+        if depth == 0:
+            if self.quiescence_search:
+                return self.quiescence(game_state, alpha, beta, ply)
+            if game_state.count_valid_moves() == 0:
+                return (-MATE_SCORE + ply if game_state.player_is_in_check else 0), []
+            return Evaluation.evaluate(game_state), []
+        if self.ordering:  # generated stage by stage: a cutoff skips building the later stages
+            # without quiescence the recapture one ply from the horizon is never searched, so every capture looks
+            # like a gain there
+            moves = self.orderer.staged(game_state, ply, tt_move,
+                                        defer_losing_captures=self.quiescence_search or depth > 1)
+        else:
+            moves = game_state.get_valid_moves()
+            for index, move in enumerate(moves):  # hash move first
+                if move.move_id == tt_move:
+                    moves.insert(0, moves.pop(index))
+                    break
+
+        best_score = -INFINITY
+        best_pv = []
+        searched = 0
+        self.path.append(key)
+        for move in moves:
+            searched += 1
+            game_state.make_move(move)
+            score, pv = self.negamax(game_state, depth - 1, -beta, -alpha, ply + 1)
+            game_state.undo()
+            if self.stopped:
+                break
+            score = -score
+            if score > best_score:
+                best_score = score
+                best_pv = [move] + pv
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if self.ordering:
+                            self.orderer.record_cutoff(move, ply, depth)
+                        break
+        self.path.pop()
+        if self.stopped:
+            return 0, []
+        if searched == 0:
+            return (-MATE_SCORE + ply if game_state.player_is_in_check else 0), []
+
+        if best_score <= original_alpha:
+            flag = TranspositionTable.UPPER_BOUND
+        elif best_score >= beta:
+            flag = TranspositionTable.LOWER_BOUND
+        else:
+            flag = TranspositionTable.EXACT
+        self.tt.store(key, depth, score_to_tt(best_score, ply), flag, best_pv[0].move_id)
+        return best_score, best_pv
+
+    """
+    Score of a position at the horizon: the static evaluation, unless captures or promotions improve
+    on it. The side to move may "stand pat" on the evaluation since it need not capture; captures
+    that cannot raise alpha even with DELTA_MARGIN to spare (delta pruning) and captures that lose
+    material by static exchange are not searched. In check, every evasion is searched instead.
+    """
+    def quiescence(self, game_state, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and \
+                (self.stop_requested or self.deadline is not None and time.perf_counter() > self.deadline):
+            self.stopped = True
+        if self.stopped:
+            return 0, []
+
+        if ply >= MoveOrdering.MAX_PLY:
+            return Evaluation.evaluate(game_state), []
+        stages = game_state.move_stages()
+        in_check = game_state.player_is_in_check
+        if in_check:
+            moves = stages.captures() + stages.promotions() + stages.quiets()
+            if not moves:
+                return -MATE_SCORE + ply, []
+            stand_pat = -INFINITY
+        else:
+            stand_pat = Evaluation.evaluate(game_state)
+            if stand_pat >= beta:
+                return stand_pat, []
+            alpha = max(alpha, stand_pat)
+            moves = stages.captures() + [move for move in stages.promotions() if move.promotion_piece == 'Q']
+        moves.sort(key=MoveOrdering.mvv_lva, reverse=True)
+
+        best_score = stand_pat
+        best_pv = []
+        board = game_state.board
+        for move in moves:
+            if not in_check:
+                gain = MoveOrdering.SEE_VALUES[move.piece_captured[1]] if move.piece_captured != "--" else 0
+                if move.is_pawn_promotion:
+                    gain += MoveOrdering.SEE_VALUES['Q'] - MoveOrdering.SEE_VALUES['P']
+                if stand_pat + gain + DELTA_MARGIN <= alpha or MoveOrdering.static_exchange(board, move) < 0:
+                    continue
+            game_state.make_move(move)
+            score, pv = self.quiescence(game_state, -beta, -alpha, ply + 1)
+            game_state.undo()
+            if self.stopped:
+                return 0, []
+            score = -score
+            if score > best_score:
+                best_score = score
+                best_pv = [move] + pv
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score, best_pv
+
+
+"""
+Zobrist keys of the positions played before the current one, oldest first, back to the last capture
+or pawn move (no earlier position can occur again); found by undoing the moves in game_state's
+move log and playing them again
+"""
+
+
+def game_history(game_state):
+    moves = []
+    keys = []
+    for _ in range(min(game_state.halfmove_clock, len(game_state.move_log))):
+        moves.append(game_state.move_log[-1])
+        game_state.undo()
+        keys.append(game_state.zobrist_key)
+    for move in reversed(moves):
+        game_state.make_move(move)
+    keys.reverse()
+    return keys
+
+
+"""
+Mate scores count plies from the root; the table stores them counted from the node instead
+"""
+
+
+def score_to_tt(score, ply):
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+def main(argv=None):
+    import OpeningBook
+    import Perft
+    parser = argparse.ArgumentParser(description="Search a position for the best move")
+    parser.add_argument("-d", "--depth", type=int, help="maximum depth in plies")
+    parser.add_argument("-t", "--time", type=float, help="time limit in seconds")
+    parser.add_argument("-m", "--moves", default="", help='moves from the initial position, e.g. "e2e4 e7e5"')
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    parser.add_argument("--hash", type=float, default=16, help="transposition table size in MB (default 16)")
+    parser.add_argument("--book", metavar="FILE", help="opening book to play from before searching")
+    parser.add_argument("--tablebases", metavar="DIR", help="endgame tablebase directory to look positions up in")
+    parser.add_argument("--no-quiescence", action="store_true", help="stop at the search depth without quiescence")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.time is None:
+        args.time = 5.0
+
+    game_state = ChessEngine.Game(args.backend)
+    Perft.play_moves(game_state, args.moves)
+    book = OpeningBook.OpeningBook(args.book) if args.book else None
+    tablebases = Tablebase.Tablebases(args.tablebases) if args.tablebases else None
+    searcher = Searcher(args.hash, book=book, tablebases=tablebases, quiescence=not args.no_quiescence)
+    result = searcher.search(game_state, args.depth, args.time, on_iteration=print)
+    if result.from_book or result.from_tablebase:
+        print(result)
+    print(f"bestmove {result.best_move.get_chess_notation() if result.best_move else '(none)'}  "
+          f"score {result.score}  nodes {result.nodes}  nps {result.nps:.0f}")
+    print(searcher.tt)
+    print(game_state.move_cache)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import sys
+import threading
+import ChessEngine
+import Search
+
+
+"""
+Headless game server: many Game sessions in one process, driven over TCP with one JSON object per
+line. Every request carries an "op" and, except "new", the "session" it applies to; an optional
+"id" is echoed back so a client can pipeline requests on one connection. Replies are
+{"id": ..., "ok": true, ...} or {"id": ..., "ok": false, "error": "..."}.
+
+    new                          -> session, fen            (optional "fen" to start from)
+    move    "move": "e2e4"       -> fen, status             (coordinate notation, "e7e8q" to promote)
+    undo                         -> fen, status
+    moves                        -> moves, status
+    search  "depth" / "time"     -> move, score, depth, nodes
+    fen                          -> fen, status
+    close                        -> (nothing)
+
+Move generation and search run in a thread pool, off the event loop. Requests for one session
+are serialised by that session's lock; requests for different sessions run concurrently.
+"""
+
+
+DEFAULT_PORT = 8765
+SESSION_MOVE_CACHE_SIZE = 32  # positions per session; thousands of sessions share the process
+MAX_SEARCH_DEPTH = 8
+MAX_SEARCH_TIME = 10.0  # seconds
+
+
+class ServerError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.lock = asyncio.Lock()
+
+
+"""
+Status of the side to move, after get_valid_moves has set the mate flags
+"""
+
+
+def status(game_state):
+    if game_state.check_mate:
+        return "checkmate"
+    if game_state.stale_mate:
+        return "stalemate"
+    return "check" if game_state.player_is_in_check else "ongoing"
+
+
+class GameServer:
+    def __init__(self, backend="bitboard", workers=None, tt_megabytes=4, max_sessions=100000):
+        self.backend = backend
+        self.tt_megabytes = tt_megabytes
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="game")
+        self.local = threading.local()  # one Searcher per executor thread
+        self.requests = 0
+        self.handlers = {"new": self.new_game, "move": self.move, "undo": self.undo, "moves": self.legal_moves,
+                         "search": self.search, "fen": self.fen, "close": self.close}
+
+    def run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def session(self, request):
+        session = self.sessions.get(str(request.get("session")))
+        if session is None:
+            raise ServerError(f"unknown session {request.get('session')!r}")
+        return session
+
+    """
+    Executor jobs. Each runs with its session's lock held, so it has the Game to itself.
+    """
+    def create_game(self, fen):
+        game_state = ChessEngine.Game(self.backend, SESSION_MOVE_CACHE_SIZE)
+        if fen is not None:
+            game_state.load_fen(fen)
+        game_state.get_valid_moves()
+        return game_state
+
+    @staticmethod
+    def play(game_state, notation):
+        for move in game_state.get_valid_moves():
+            if move.get_chess_notation() == notation:
+                game_state.make_move(move)
+                game_state.get_valid_moves()
+                return {"fen": game_state.get_fen(), "status": status(game_state)}
+        raise ServerError(f"illegal move {notation!r}")
+
+    @staticmethod
+    def take_back(game_state):
+        if not game_state.move_log:
+            raise ServerError("no move to undo")
+        game_state.undo()
+        game_state.get_valid_moves()
+        return {"fen": game_state.get_fen(), "status": status(game_state)}
+
+    @staticmethod
+    def list_moves(game_state):
+        moves = [move.get_chess_notation() for move in game_state.get_valid_moves()]
+        return {"moves": moves, "status": status(game_state)}
+
+    def think(self, game_state, depth, time_limit):
+        searcher = getattr(self.local, "searcher", None)
+        if searcher is None:
+            searcher = self.local.searcher = Search.Searcher(self.tt_megabytes)
+        result = searcher.search(game_state, depth, time_limit)
+        return {"move": result.best_move.get_chess_notation() if result.best_move else None,
+                "score": result.score, "depth": result.depth, "nodes": result.nodes}
+
+    """
+    Request handlers, run on the event loop
+    """
+    async def new_game(self, request):
+        if len(self.sessions) >= self.max_sessions:
+            raise ServerError("too many sessions")
+        fen = request.get("fen")
+        try:
+            game_state = await self.run(self.create_game, fen)
+        except ValueError as error:
+            raise ServerError(str(error))
+        session_id = str(next(self.session_ids))
+        self.sessions[session_id] = Session(game_state)
+        return {"session": session_id, "fen": game_state.get_fen()}
+
+    async def move(self, request):
+        session = self.session(request)
+        async with session.lock:
+            return await self.run(self.play, session.game_state, str(request.get("move")))
+
+    async def undo(self, request):
+        session = self.session(request)
+        async with session.lock:
+            return await self.run(self.take_back, session.game_state)
+
+    async def legal_moves(self, request):
+        session = self.session(request)
+        async with session.lock:
+            return await self.run(self.list_moves, session.game_state)
+
+    async def search(self, request):
+        session = self.session(request)
+        depth = request.get("depth")
+        time_limit = request.get("time")
+        if depth is None and time_limit is None:
+            depth = 3
+        try:
+            depth = min(int(depth), MAX_SEARCH_DEPTH) if depth is not None else None
+            time_limit = min(float(time_limit), MAX_SEARCH_TIME) if time_limit is not None else None
+        except (TypeError, ValueError):
+            raise ServerError("depth and time must be numbers")
+        async with session.lock:
+            return await self.run(self.think, session.game_state, depth, time_limit)
+
+    async def fen(self, request):
+        session = self.session(request)
+        async with session.lock:  # not while a move or undo is half done in the executor
+            game_state = session.game_state
+            return {"fen": game_state.get_fen(), "status": status(game_state)}
+
+    async def close(self, request):
+        self.session(request)
+        del self.sessions[str(request["session"])]
+        return {}
+
+    """
+    The reply to one request line
+    """
+    async def handle(self, line):
+        self.requests += 1
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                raise ServerError("malformed JSON")
+            if not isinstance(request, dict):
+                raise ServerError("request must be a JSON object")
+            request_id = request.get("id")
+            handler = self.handlers.get(request.get("op"))
+            if handler is None:
+                raise ServerError(f"unknown op {request.get('op')!r}")
+            reply = await handler(request)
+            reply["ok"] = True
+        except ServerError as error:
+            reply = {"ok": False, "error": str(error)}
+        except Exception as error:  # reply anyway, or a pipelining client would wait forever
+            reply = {"ok": False, "error": f"internal error: {error!r}"}
+        reply["id"] = request_id
+        return reply
+
+    """
+    Serve one connection. Requests are handled concurrently, so replies to pipelined requests can
+    come back out of order; match them by id.
+    """
+    async def serve_connection(self, reader, writer):
+        pending = set()
+
+        async def respond(line):
+            reply = await self.handle(line)
+            writer.write(json.dumps(reply, separators=(",", ":")).encode() + b"\n")
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+            if pending:
+                await asyncio.gather(*pending)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, ready=None):
+        server = await asyncio.start_server(self.serve_connection, host, port, limit=1 << 20, backlog=4096)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless JSON-over-TCP chess game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", type=int, help="executor threads (default: Python's choice)")
+    parser.add_argument("-b", "--backend", choices=("mailbox", "bitboard"), default="bitboard")
+    parser.add_argument("--hash", type=float, default=4, help="transposition table size in MB per thread (default 4)")
+    args = parser.parse_args(argv)
+
+    game_server = GameServer(args.backend, args.workers, args.hash)
+
+    def ready(server):
+        print(f"listening on {', '.join(str(sock.getsockname()) for sock in server.sockets)}", flush=True)
+
+    try:
+        asyncio.run(game_server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        game_server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,552 @@
+import argparse
+import array
+import mmap
+import os
+import sys
+import threading
+import time
+import MoveTables
+
+
+"""
+Endgame tablebases for a lone king against king and one or two pieces: KQK, KRK, KPK and KBNK.
+
+generate() builds a table by retrograde analysis: it marks every checkmate, then works
+backwards, one ply at a time, through the moves that could have led to positions already
+solved. A position with white to move is won as soon as one white move reaches a lost
+position; a position with black to move is lost once every black move reaches a won one.
+Positions left over are draws. The move rules are those of MoveTables.
+
+Symmetry cuts the tables down: without pawns the white king is brought into the a1-d1-d4
+triangle by the board's eight reflections and rotations, with a pawn the board is only mirrored
+so the pawn is on files a-d. The strong side is always stored as white; positions where black
+has the pieces are probed with the board flipped.
+
+A table file holds one signed byte per position for white to move, then one per position for
+black to move: 0 is a draw, v > 0 means the side to move mates in v plies, and v < 0 that it is
+mated in -v - 1 plies. Files are opened lazily and memory-mapped, so probing never loads a
+whole table.
+"""
+
+
+SETS = {"KQK": "Q", "KRK": "R", "KPK": "P", "KBNK": "BN"}  # the strong side's pieces besides its king
+PROMOTION_SETS = {'Q': "KQK", 'R': "KRK"}  # tables a KPK promotion continues in
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+WIN, DRAW, LOSS = 1, 0, -1
+MAX_PLIES = 126
+
+KING_TARGETS = []  # per square: squares one king step away
+KING_MASKS = []
+KNIGHT_TARGETS = []
+KNIGHT_MASKS = []
+PAWN_MASKS = []  # per square: squares a white pawn there attacks
+SLIDER_RAYS = {'R': [], 'B': []}  # per square: rays of squares, nearest first
+LINES = []  # LINES[a][b]: 'R' or 'B' if a rook or bishop on a could reach b on an empty board, else None
+BETWEEN_MASKS = []  # BETWEEN_MASKS[a][b]: squares strictly between a and b, as bits
+TRANSFORMS = []  # the board's 8 symmetries, each a list mapping square to square
+TRIANGLE = []  # the 10 squares a1-d1-d4 the white king is moved into
+TRIANGLE_INDEX = [-1] * 64
+CANONICAL_TRANSFORMS = []  # per white king square: the transforms that bring it into the triangle
+TABLE_LOCK = threading.Lock()
+
+
+def square_mask(squares):
+    mask = 0
+    for row, column in squares:
+        mask |= 1 << (row * 8 + column)
+    return mask
+
+
+"""
+Build the tables, once. They are built in locals and filled in at the end, KING_MASKS last, so a
+thread that finds KING_MASKS filled never sees the others half built.
+"""
+
+
+def init_tables():
+    if KING_MASKS:
+        return
+    with TABLE_LOCK:
+        if not KING_MASKS:
+            build_tables()
+
+
+def build_tables():
+    MoveTables.init_tables()
+    king_targets, king_masks, knight_targets, knight_masks, pawn_masks = [], [], [], [], []
+    slider_rays = {'R': [], 'B': []}
+    for square in range(64):
+        king_targets.append(tuple(row * 8 + column for row, column in MoveTables.KING_TARGETS[square]))
+        king_masks.append(square_mask(MoveTables.KING_TARGETS[square]))
+        knight_targets.append(tuple(row * 8 + column for row, column in MoveTables.KNIGHT_TARGETS[square]))
+        knight_masks.append(square_mask(MoveTables.KNIGHT_TARGETS[square]))
+        pawn_masks.append(square_mask(MoveTables.PAWN_ATTACKS['w'][square]))
+        for piece, directions in (('R', MoveTables.ROOK_DIRECTIONS), ('B', MoveTables.BISHOP_DIRECTIONS)):
+            slider_rays[piece].append(tuple(tuple(row * 8 + column for row, column in
+                                                  MoveTables.RAYS[square][direction]) for direction in directions))
+    lines_table = []
+    between_masks = []
+    for a in range(64):
+        lines = [None] * 64
+        for piece in ('R', 'B'):
+            for ray in slider_rays[piece][a]:
+                for b in ray:
+                    lines[b] = piece
+        lines_table.append(lines)
+        between_masks.append([square_mask(MoveTables.BETWEEN[a][b]) for b in range(64)])
+
+    transforms = []
+    for transform in range(8):
+        mapping = []
+        for square in range(64):
+            row, column = divmod(square, 8)
+            if transform & 1:
+                column = 7 - column
+            if transform & 2:
+                row = 7 - row
+            if transform & 4:
+                row, column = 7 - column, 7 - row  # reflect in the a1-h8 diagonal
+            mapping.append(row * 8 + column)
+        transforms.append(mapping)
+    triangle = []
+    triangle_index = [-1] * 64
+    for square in range(64):
+        row, column = divmod(square, 8)
+        rank = 7 - row
+        if column <= 3 and rank <= column:
+            triangle_index[square] = len(triangle)
+            triangle.append(square)
+    canonical_transforms = []
+    for square in range(64):
+        canonical_transforms.append([transforms[transform] for transform in range(8)
+                                     if triangle_index[transforms[transform][square]] >= 0])
+
+    KING_TARGETS[:] = king_targets
+    KNIGHT_TARGETS[:] = knight_targets
+    KNIGHT_MASKS[:] = knight_masks
+    PAWN_MASKS[:] = pawn_masks
+    SLIDER_RAYS['R'][:] = slider_rays['R']
+    SLIDER_RAYS['B'][:] = slider_rays['B']
+    LINES[:] = lines_table
+    BETWEEN_MASKS[:] = between_masks
+    TRANSFORMS[:] = transforms
+    TRIANGLE[:] = triangle
+    TRIANGLE_INDEX[:] = triangle_index
+    CANONICAL_TRANSFORMS[:] = canonical_transforms
+    KING_MASKS[:] = king_masks
+
+
+class Layout:
+    """
+    Numbering of the positions of one piece set. A position is the white king, black king and
+    the other pieces' squares in the order of the set's letters; index() first applies the
+    symmetry that brings it to its canonical form, so symmetric positions share an index.
+    """
+    def __init__(self, pieces):
+        init_tables()
+        self.pieces = pieces
+        self.pawn = pieces == 'P'
+        if 'P' in pieces and not self.pawn:
+            raise ValueError("only a single pawn is supported")
+        if self.pawn:
+            self.size = 32 * 64 * 64  # pawn on files a-d, then the two kings
+        else:
+            self.size = len(TRIANGLE) * 64 ** (1 + len(pieces))
+
+    def index(self, white_king, black_king, others):
+        if self.pawn:
+            pawn = others[0]
+            if pawn & 7 > 3:  # mirror files
+                pawn ^= 7
+                white_king ^= 7
+                black_king ^= 7
+            return (((pawn >> 3) * 4 + (pawn & 7)) * 64 + white_king) * 64 + black_king
+        transforms = CANONICAL_TRANSFORMS[white_king]
+        transform = transforms[0]
+        if len(transforms) > 1:  # the king is on the diagonal: pick the smaller of the two mirror images
+            other = transforms[1]
+            first = [transform[black_king]] + [transform[square] for square in others]
+            second = [other[black_king]] + [other[square] for square in others]
+            if second < first:
+                transform = other
+        index = TRIANGLE_INDEX[transform[white_king]] * 64 + transform[black_king]
+        for square in others:
+            index = index * 64 + transform[square]
+        return index
+
+    def squares(self, index):
+        if self.pawn:
+            rest, black_king = divmod(index, 64)
+            pawn_index, white_king = divmod(rest, 64)
+            return white_king, black_king, ((pawn_index >> 2) * 8 + (pawn_index & 3),)
+        others = []
+        for _ in self.pieces:
+            index, square = divmod(index, 64)
+            others.append(square)
+        triangle, black_king = divmod(index, 64)
+        return TRIANGLE[triangle], black_king, tuple(reversed(others))
+
+
+"""
+Whether a white piece attacks target, given the occupied squares
+"""
+
+
+def white_attacks(target, white_king, pieces, others, occupied):
+    if KING_MASKS[white_king] >> target & 1:
+        return True
+    for piece, square in zip(pieces, others):
+        if square == target:
+            continue
+        if piece == 'N':
+            if KNIGHT_MASKS[square] >> target & 1:
+                return True
+        elif piece == 'P':
+            if PAWN_MASKS[square] >> target & 1:
+                return True
+        else:
+            line = LINES[square][target]
+            if line is not None and (piece == 'Q' or piece == line) and not BETWEEN_MASKS[square][target] & occupied:
+                return True
+    return False
+
+
+"""
+Squares a white piece on square could have come from, on the occupied board
+"""
+
+
+def white_origins(piece, square, occupied):
+    if piece == 'N':
+        return [origin for origin in KNIGHT_TARGETS[square] if not occupied >> origin & 1]
+    if piece == 'K':
+        return [origin for origin in KING_TARGETS[square] if not occupied >> origin & 1]
+    if piece == 'P':
+        origins = []
+        row = square >> 3
+        if row <= 5 and not occupied >> (square + 8) & 1:
+            origins.append(square + 8)
+            if row == 4 and not occupied >> (square + 16) & 1:
+                origins.append(square + 16)
+        return origins
+    origins = []
+    for slider in (('R', 'B') if piece == 'Q' else (piece,)):
+        for ray in SLIDER_RAYS[slider][square]:
+            for origin in ray:
+                if occupied >> origin & 1:
+                    break
+                origins.append(origin)
+    return origins
+
+
+def occupancy(white_king, black_king, others):
+    occupied = 1 << white_king | 1 << black_king
+    for square in others:
+        occupied |= 1 << square
+    return occupied
+
+
+"""
+Solve the set named name (a key of SETS). Returns the values for white to move and black to
+move as two array('b') of Layout(SETS[name]).size. load(name) is called for tables a
+promotion leads into.
+"""
+
+
+def solve(name, load=None, progress=None):
+    pieces = SETS[name]
+    layout = Layout(pieces)
+    size = layout.size
+    white_values = array.array('b', bytes(size))
+    black_values = array.array('b', bytes(size))
+    white_done = bytearray(size)
+    black_done = bytearray(size)
+    black_moves = bytearray(size)  # black moves not yet known to lose
+    buckets = [[] for _ in range(MAX_PLIES + 2)]  # positions solved at each ply, black to move on even plies
+    promotions = [[] for _ in range(MAX_PLIES + 2)]  # white-to-move wins by promoting, by ply
+    promotion_tables = {}
+    if layout.pawn:
+        for piece, promotion_set in PROMOTION_SETS.items():
+            promotion_tables[piece] = (Layout(SETS[promotion_set]), load(promotion_set))
+
+    # every position on its own: illegal ones, mates, stalemates and positions black can draw by a capture
+    for index in range(size):
+        white_king, black_king, others = layout.squares(index)
+        if layout.index(white_king, black_king, others) != index:  # only the canonical form is used
+            white_done[index] = black_done[index] = 1
+            continue
+        occupied = occupancy(white_king, black_king, others)
+        if occupied.bit_count() != 2 + len(others) or KING_MASKS[white_king] >> black_king & 1 or \
+                (layout.pawn and not 0 < others[0] >> 3 < 7):
+            white_done[index] = black_done[index] = 1
+            continue
+        in_check = white_attacks(black_king, white_king, pieces, others, occupied)
+        if in_check:
+            white_done[index] = 1  # black cannot be in check with white to move
+        elif layout.pawn and others[0] >> 3 == 1 and not occupied >> (others[0] - 8) & 1:
+            for piece, (promotion_layout, values) in promotion_tables.items():
+                value = values[1][promotion_layout.index(white_king, black_king, (others[0] - 8,))]
+                if value < 0:  # black to move is mated after the promotion
+                    promotions[-value].append(index)
+
+        without_king = occupied & ~(1 << black_king)
+        moves = set()  # what black's moves lead to, counted once each: on the diagonal two moves can mirror each other
+        drawn = False
+        for target in KING_TARGETS[black_king]:
+            if KING_MASKS[white_king] >> target & 1 or target == white_king:
+                continue
+            if occupied >> target & 1:  # a capture: the rest is too little to mate
+                rest = tuple(square for square in others if square != target)
+                rest_pieces = "".join(piece for piece, square in zip(pieces, others) if square != target)
+                if not white_attacks(target, white_king, rest_pieces, rest, without_king):
+                    drawn = True
+                    break
+            elif not white_attacks(target, white_king, pieces, others, without_king):
+                moves.add(layout.index(white_king, target, others) if len(CANONICAL_TRANSFORMS[white_king]) > 1 else target)
+        if drawn:
+            black_done[index] = 1
+        elif not moves:
+            black_done[index] = 1
+            if in_check:
+                black_values[index] = -1
+                buckets[0].append(index)
+        else:
+            black_moves[index] = len(moves)
+        if progress is not None and index % 1000000 == 999999:
+            progress(f"{name}: {index + 1}/{size} positions set up")
+
+    for ply in range(MAX_PLIES + 1):
+        if ply % 2:  # white to move wins in ply plies
+            for index in promotions[ply]:
+                if not white_done[index]:
+                    white_done[index] = 1
+                    white_values[index] = ply
+                    buckets[ply].append(index)
+            for index in buckets[ply]:
+                white_king, black_king, others = layout.squares(index)
+                occupied = occupancy(white_king, black_king, others)
+                previous_positions = set()
+                for origin in KING_TARGETS[black_king]:
+                    if not occupied >> origin & 1 and not KING_MASKS[white_king] >> origin & 1:
+                        previous_positions.add(layout.index(white_king, origin, others))
+                for previous in previous_positions:
+                    if not black_done[previous]:
+                        black_moves[previous] -= 1
+                        if black_moves[previous] == 0:  # every black move loses
+                            black_done[previous] = 1
+                            black_values[previous] = -(ply + 1) - 1
+                            buckets[ply + 1].append(previous)
+        else:  # black to move is mated in ply plies
+            for index in buckets[ply]:
+                white_king, black_king, others = layout.squares(index)
+                occupied = occupancy(white_king, black_king, others)
+                for position, (piece, square) in enumerate((('K', white_king),) + tuple(zip(pieces, others))):
+                    for origin in white_origins(piece, square, occupied):
+                        if piece == 'K':
+                            if KING_MASKS[black_king] >> origin & 1:
+                                continue
+                            king, rest = origin, others
+                        else:
+                            king = white_king
+                            rest = others[:position - 1] + (origin,) + others[position:]
+                        moved = occupied & ~(1 << square) | 1 << origin
+                        if white_attacks(black_king, king, pieces, rest, moved):
+                            continue  # black would have been in check with white to move
+                        previous = layout.index(king, black_king, rest)
+                        if not white_done[previous]:
+                            white_done[previous] = 1
+                            white_values[previous] = ply + 1
+                            buckets[ply + 1].append(previous)
+        if progress is not None and buckets[ply]:
+            progress(f"{name}: ply {ply}, {len(buckets[ply])} positions")
+        buckets[ply] = None
+    return white_values, black_values
+
+
+"""
+Solve the set and write its table file to directory; returns the file path
+"""
+
+
+def generate(name, directory=DEFAULT_DIRECTORY, progress=None):
+    if 'P' in SETS[name]:  # the tables a promotion continues in come first
+        for needed in PROMOTION_SETS.values():
+            if not os.path.exists(table_path(directory, needed)):
+                generate(needed, directory, progress)
+
+    def load(needed):
+        with open(table_path(directory, needed), "rb") as file:
+            data = file.read()
+        half = len(data) // 2
+        return array.array('b', data[:half]), array.array('b', data[half:])
+
+    white_values, black_values = solve(name, load, progress)
+    os.makedirs(directory, exist_ok=True)
+    path = table_path(directory, name)
+    with open(path + ".tmp", "wb") as file:
+        white_values.tofile(file)
+        black_values.tofile(file)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def table_path(directory, name):
+    return os.path.join(directory, name + ".tb")
+
+
+"""
+(result, plies) from a stored value, for the side to move: WIN, DRAW or LOSS, and plies to mate
+"""
+
+
+def decode_value(value):
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, 0
+
+
+class Tablebases:
+    """
+    Probes the table files in directory. Tables are memory-mapped the first time a position of
+    their set is probed; a set whose file is missing is simply not covered.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        init_tables()
+        self.directory = directory
+        self.tables = {}  # set name: (Layout, mmap) or None when the file is missing
+        self.files = []
+
+    def table(self, name):
+        if name not in self.tables:
+            path = table_path(self.directory, name)
+            layout = Layout(SETS[name])
+            if not os.path.exists(path):
+                self.tables[name] = None
+            else:
+                file = open(path, "rb")
+                if os.fstat(file.fileno()).st_size != 2 * layout.size:
+                    file.close()
+                    raise ValueError(f"{path} does not hold a {name} table")
+                self.files.append(file)
+                self.tables[name] = (layout, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self.tables[name]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[1].close()
+        for file in self.files:
+            file.close()
+        self.tables = {}
+        self.files = []
+
+    """
+    (result, plies to mate) for the side to move, result being WIN, DRAW or LOSS, or None when the
+    position is not covered (another material balance, a missing table, or castling rights left)
+    """
+    def probe(self, game_state):
+        if game_state.castling_rights:
+            return None
+        pieces = {'w': [], 'b': []}
+        kings = {}
+        for row in range(8):
+            for column in range(8):
+                piece = game_state.board[row][column]
+                if piece == "--":
+                    continue
+                if piece[1] == 'K':
+                    kings[piece[0]] = row * 8 + column
+                else:
+                    pieces[piece[0]].append((piece[1], row * 8 + column))
+                    if len(pieces['w']) + len(pieces['b']) > 2:
+                        return None
+        if pieces['w'] and pieces['b']:
+            return None
+        strong = 'w' if pieces['w'] else 'b'
+        material = "".join(sorted((piece for piece, _ in pieces[strong]), key="QRBNP".index))
+        if material in ("", "B", "N"):
+            return DRAW, 0
+        name = "K" + material + "K"
+        if name not in SETS:
+            return None
+        table = self.table(name)
+        if table is None:
+            return None
+        layout, data = table
+        flip = 56 if strong == 'b' else 0  # mirror the ranks so the strong side is white
+        squares = dict((piece, square ^ flip) for piece, square in pieces[strong])
+        others = tuple(squares[piece] for piece in SETS[name])
+        index = layout.index(kings[strong] ^ flip, kings['b' if strong == 'w' else 'w'] ^ flip, others)
+        strong_to_move = game_state.white_turn == (strong == 'w')
+        value = data[index if strong_to_move else layout.size + index]
+        return decode_value(value - 256 if value > 127 else value)
+
+    """
+    The move with the best outcome for the side to move: the fastest mate when winning, a drawing
+    move when drawn, the longest resistance when losing. None when the position is not covered.
+    """
+    def best_move(self, game_state):
+        if self.probe(game_state) is None:
+            return None
+        best = None
+        best_key = None
+        for move in game_state.get_valid_moves():
+            game_state.make_move(move)
+            outcome = self.probe(game_state)
+            game_state.undo()
+            if outcome is None:
+                continue
+            result, plies = outcome
+            key = (-result, -plies if result == LOSS else plies)  # our outcome first, then the quickest win or slowest loss
+            if best_key is None or key > best_key:
+                best, best_key = move, key
+        return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="solve piece sets and write their tables")
+    generate_parser.add_argument("sets", nargs="*", default=list(SETS),
+                                 help=f"sets to generate: {', '.join(SETS)} (default all)")
+    generate_parser.add_argument("-d", "--directory", default=DEFAULT_DIRECTORY)
+    generate_parser.add_argument("-v", "--verbose", action="store_true", help="report progress")
+    probe_parser = commands.add_parser("probe", help="look up a position")
+    probe_parser.add_argument("fen", help="position as FEN")
+    probe_parser.add_argument("-d", "--directory", default=DEFAULT_DIRECTORY)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        unknown = [name for name in args.sets if name not in SETS]
+        if unknown:
+            parser.error(f"unknown sets: {', '.join(unknown)}")
+        for name in args.sets:
+            start = time.perf_counter()
+            path = generate(name, args.directory, print if args.verbose else None)
+            with open(path, "rb") as file:
+                values = array.array('b', file.read())
+            results = [decode_value(value) for value in values]
+            wins = sum(result == WIN for result, _ in results)
+            longest = max(plies for result, plies in results if result != DRAW)
+            print(f"{name}: {time.perf_counter() - start:.1f}s, {len(values)} entries, {wins} wins, "
+                  f"longest mate {longest} plies -> {path}")
+        return 0
+
+    import ChessEngine
+    game_state = ChessEngine.Game.from_fen(args.fen)
+    with_tablebases = Tablebases(args.directory)
+    outcome = with_tablebases.probe(game_state)
+    if outcome is None:
+        print("not covered")
+        return 1
+    result, plies = outcome
+    best = with_tablebases.best_move(game_state)
+    print(f"{ {WIN: 'win', DRAW: 'draw', LOSS: 'loss'}[result] } {plies} plies  "
+          f"best move {best.get_chess_notation() if best else '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
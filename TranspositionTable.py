@@ -0,0 +1,81 @@
+import sys
+
+
+"""
+Fixed-size transposition table keyed by Game.zobrist_key.
+
+Each bucket has two slots: a depth-preferred slot that is only replaced by an entry searched
+at least as deep, and an always-replace slot that takes everything else. Entries are tuples
+(key, depth, score, flag, move), the move as its 16-bit code (Move.move_id) or None.
+"""
+
+
+EXACT = 0
+LOWER_BOUND = 1  # score is at least this (fail high)
+UPPER_BOUND = 2  # score is at most this (fail low)
+
+# rough size of one entry: the tuple, its key and score ints, and the list slot that holds it
+ENTRY_BYTES = sys.getsizeof((0, 0, 0, 0, None)) + sys.getsizeof(2 ** 63) + sys.getsizeof(2 ** 20) + 8
+
+
+class TranspositionTable:
+    def __init__(self, megabytes=16):
+        self.megabytes = megabytes
+        self.size = max(1, int(megabytes * 1024 * 1024) // (2 * ENTRY_BYTES))  # buckets
+        self.clear()
+
+    def clear(self):
+        self.depth_preferred = [None] * self.size
+        self.always_replace = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    """
+    Entry stored for key, or None
+    """
+    def probe(self, key):
+        index = key % self.size
+        entry = self.depth_preferred[index]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        entry = self.always_replace[index]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, flag, move=None):
+        index = key % self.size
+        entry = (key, depth, score, flag, move)
+        self.stores += 1
+        current = self.depth_preferred[index]
+        if current is None or current[0] == key or depth >= current[1]:
+            if current is not None and current[0] != key:
+                self.overwrites += 1
+            self.depth_preferred[index] = entry
+        else:
+            current = self.always_replace[index]
+            if current is not None and current[0] != key:
+                self.overwrites += 1
+            self.always_replace[index] = entry
+
+    def filled(self):
+        return sum(entry is not None for entry in self.depth_preferred) + \
+            sum(entry is not None for entry in self.always_replace)
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return {"megabytes": self.megabytes, "slots": 2 * self.size, "filled": self.filled(),
+                "probes": probes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / probes if probes else 0.0,
+                "stores": self.stores, "overwrites": self.overwrites}
+
+    def __str__(self):
+        stats = self.stats()
+        return f'TT {stats["megabytes"]} MB: {stats["filled"]}/{stats["slots"]} slots filled, ' \
+               f'{stats["hits"]} hits, {stats["misses"]} misses ({stats["hit_rate"]:.1%} hit rate), ' \
+               f'{stats["stores"]} stores, {stats["overwrites"]} overwrites'
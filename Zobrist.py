@@ -0,0 +1,82 @@
+import random
+
+
+"""
+Zobrist hashing: every (piece, square), castling right, en passant file and the side to move
+gets a fixed random 64-bit number, and a position's key is the XOR of the numbers for
+everything present. Making or undoing a move only XORs in and out what changed.
+"""
+
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+
+_random = random.Random(0x5EED)  # fixed seed so keys are the same in every process
+PIECE_SQUARE = {piece: [_random.getrandbits(64) for _ in range(64)] for piece in PIECES}
+CASTLING_RIGHT = [_random.getrandbits(64) for _ in range(4)]  # wks, wqs, bks, bqs
+EN_PASSANT_FILE = [_random.getrandbits(64) for _ in range(8)]
+BLACK_TO_MOVE = _random.getrandbits(64)
+
+# every combination of the four castling rights, indexed by Game.castling_rights (wks | wqs << 1 | bks << 2 | bqs << 3)
+CASTLING = []
+for _rights in range(16):
+    _key = 0
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            _key ^= CASTLING_RIGHT[_bit]
+    CASTLING.append(_key)
+
+
+def castling_key(rights):
+    return CASTLING[rights]
+
+
+def en_passant_key(square):
+    return EN_PASSANT_FILE[square[1]] if square != () else 0
+
+
+def piece_key(piece, row, column):
+    return PIECE_SQUARE[piece][row * 8 + column]
+
+
+"""
+Key of a whole position, computed from scratch
+"""
+
+
+def hash_position(game_state):
+    key = 0
+    for row in range(8):
+        for column in range(8):
+            piece = game_state.board[row][column]
+            if piece != "--":
+                key ^= PIECE_SQUARE[piece][row * 8 + column]
+    key ^= castling_key(game_state.castling_rights)
+    key ^= en_passant_key(game_state.en_passant_valid_square)
+    if not game_state.white_turn:
+        key ^= BLACK_TO_MOVE
+    return key
+
+
+"""
+XOR of the piece-square keys a move changes. The same value applies and takes back the move.
+"""
+
+
+def move_key(move):
+    color = move.piece_moved[0]
+    start = move.start_row * 8 + move.start_column
+    end = move.end_row * 8 + move.end_column
+    key = PIECE_SQUARE[move.piece_moved][start] ^ \
+        PIECE_SQUARE[color + move.promotion_piece if move.is_pawn_promotion else move.piece_moved][end]
+
+    if move.piece_captured != "--":
+        captured = move.start_row * 8 + move.end_column if move.is_en_passant else end
+        key ^= PIECE_SQUARE[move.piece_captured][captured]
+
+    if move.is_castling:
+        rook = PIECE_SQUARE[color + 'R']
+        if move.end_column - move.start_column == 2:  # king side castle
+            key ^= rook[end + 1] ^ rook[end - 1]
+        else:  # Queen side castle
+            key ^= rook[end - 2] ^ rook[end + 1]
+    return key
@@ -3,6 +3,8 @@
 import pygame as pg
 import ChessEngine
 import Constants as C
+import EngineWorker
+import Renderer
 
 pg.init()
 pg.mixer.init()
@@ -39,10 +41,18 @@ def main():
     # chess_window = pg.display.set_mode((C.SCREEN_WIDTH, C.SCREEN_HEIGHT))
     board_screen = pg.display.set_mode((C.BOARD_WIDTH, C.BOARD_HEIGHT))
     clock = pg.time.Clock()
-    game_state = ChessEngine.Game()
+    game_state = ChessEngine.Game(move_cache_size=0)  # legal moves come from the engine worker's Game
     load_images()
-
-    valid_moves = game_state.get_valid_moves()
+    renderer = Renderer.Renderer(board_screen)
+    # move generation and search run off this loop
+    engine = EngineWorker.EngineWorker(ponder=C.ENGINE_PONDER, book_path=C.ENGINE_BOOK,
+                                       tablebase_directory=C.ENGINE_TABLEBASES)
+
+    # filled in from the engine thread's results
+    valid_moves = []
+    moves_by_squares = {}
+    check_mate = stale_mate = False
+    request_engine_work(engine, game_state)
     square_selected = ()
     player_clicks = []  # keep track of squares that the player clicked
 
@@ -58,8 +68,11 @@ def main():
             if event.type == pg.QUIT:
                 run = False
 
+            elif event.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED):
+                renderer.invalidate()  # the window contents were lost, repaint all of it
+
             elif event.type == pg.MOUSEBUTTONDOWN:
-                if not game_over:
+                if not game_over and not engine_to_move(game_state):
                     location = pg.mouse.get_pos()
                     column = location[0] // C.SQUARE_SIZE
                     row = location[1] // C.SQUARE_SIZE
@@ -74,23 +87,14 @@ def main():
 
                     # after 2nd click
                     if len(player_clicks) == 2:
-                        move = ChessEngine.Move(player_clicks[0], player_clicks[1], game_state.board)
-                        for i in range(len(valid_moves)):
-
-                            if move == valid_moves[i]:
-                                game_state.make_move(valid_moves[i])
-                                move_made = True
-                                animate = True
-                                square_selected = ()  # reset user clicks
-                                player_clicks = []
-                                if valid_moves[i].is_pawn_promotion:
-                                    pg.mixer.Sound.play(promotion_sound)
-                                elif valid_moves[i].is_castling:
-                                    pg.mixer.Sound.play(castling_sound)
-                                elif valid_moves[i].piece_captured == "--":
-                                    pg.mixer.Sound.play(move_sound)
-                                else:
-                                    pg.mixer.Sound.play(capture_sound)
+                        move = moves_by_squares.get((player_clicks[0], player_clicks[1]))
+                        if move is not None:
+                            game_state.make_move(move)
+                            move_made = True
+                            animate = True
+                            square_selected = ()  # reset user clicks
+                            player_clicks = []
+                            play_move_sound(move)
 
                         if not move_made:
                             player_clicks = [square_selected]
@@ -99,7 +103,10 @@ def main():
             elif event.type == pg.KEYDOWN:
                 # undo
                 if event.key == pg.K_z:
+                    engine.cancel()  # whatever it was working on is for a position that is gone
                     game_state.undo()
+                    if engine_to_move(game_state):  # take back the engine's move too, or it would just replay it
+                        game_state.undo()
                     move_made = True
                     animate = False
                     if game_over:
@@ -107,160 +114,98 @@ def main():
                     pg.mixer.Sound.play(undo_sound)
                 # reset
                 if event.key == pg.K_r:
-                    game_state = ChessEngine.Game()
-                    valid_moves = game_state.get_valid_moves()
+                    engine.cancel()
+                    game_state = ChessEngine.Game(move_cache_size=0)
                     square_selected = ()
                     player_clicks = []
-                    move_made = False
+                    move_made = True
                     animate = False
+                    game_over = False
 
         if move_made:
             if animate:
-                animate_move(game_state.move_log[-1], board_screen, game_state.board, clock)
-            valid_moves = game_state.get_valid_moves()
+                renderer.animate_move(game_state.move_log[-1], game_state.board, clock)
+            valid_moves = []
+            moves_by_squares = {}
+            check_mate = stale_mate = False
+            request_engine_work(engine, game_state)
             move_made = False
             animate = False
-        draw_game_state(board_screen, game_state, valid_moves, square_selected)
+
+        for result in engine.poll():
+            if result.zobrist_key != game_state.zobrist_key:
+                continue
+            if result.kind == "moves":
+                valid_moves = result.moves
+                moves_by_squares = index_moves(valid_moves)
+                check_mate, stale_mate = result.check_mate, result.stale_mate
+            elif result.best_move is not None and not game_over:  # the engine's reply
+                game_state.make_move(result.best_move)
+                play_move_sound(result.best_move)
+                move_made = True
+                animate = True
 
         # Game end
-        if game_state.check_mate:
+        text = None
+        if check_mate:
             game_over = True
             if game_state.white_turn:
-                draw_text(board_screen, "Black wins")
+                text = "Black wins"
             else:
-                draw_text(board_screen, "White wins")
-        elif game_state.stale_mate:
+                text = "White wins"
+        elif stale_mate:
             game_over = True
-            draw_text(board_screen, "Stalemate")
+            text = "Stalemate"
 
+        renderer.draw(game_state, valid_moves, square_selected, text)  # redraws and updates only what changed
         clock.tick(C.FPS)
-        pg.display.flip()
 
+    engine.close()
     pg.quit()
 
 
 """
-Highlight square selected and moves available for that piece
+Whether the engine plays the side to move (Constants.ENGINE_COLOR)
 """
 
 
-def highlight_possible_squares(board_screen, game_state, valid_moves, square_selected):
-    if square_selected != ():
-        row, column = square_selected
-        if game_state.board[row][column][0] == ('w' if game_state.white_turn else 'b'):
-            surface = pg.Surface((C.SQUARE_SIZE, C.SQUARE_SIZE))
-            surface.set_alpha(C.TRANSPARENCY)
-            surface.fill(pg.Color('blue'))
-            board_screen.blit(surface, (column * C.SQUARE_SIZE, row * C.SQUARE_SIZE))
-
-            surface.fill(pg.Color("yellow"))
-            for move in valid_moves:
-                if move.start_row == row and move.start_column == column:
-                    board_screen.blit(surface, (C.SQUARE_SIZE * move.end_column, C.SQUARE_SIZE * move.end_row))
+def engine_to_move(game_state):
+    return C.ENGINE_COLOR is not None and C.ENGINE_COLOR == ('w' if game_state.white_turn else 'b')
 
 
 """
-Highlight the last move made
+Ask the engine thread for the legal moves of the position and, on its turn, for its reply
 """
 
 
-def highlight_last_move(board_screen, move):
-    pass
+def request_engine_work(engine, game_state):
+    engine.request_moves(game_state)
+    if engine_to_move(game_state):
+        engine.request_reply(game_state, C.ENGINE_TIME)
 
 
-"""
-Graphics handler for the current game state.
-"""
-
-
-def draw_game_state(board_screen, game_state, valid_moves, square_selected):
-    draw_board(board_screen)
-    highlight_possible_squares(board_screen, game_state, valid_moves, square_selected)
-    draw_pieces(board_screen, game_state.board)
+def play_move_sound(move):
+    if move.is_pawn_promotion:
+        pg.mixer.Sound.play(promotion_sound)
+    elif move.is_castling:
+        pg.mixer.Sound.play(castling_sound)
+    elif move.piece_captured == "--":
+        pg.mixer.Sound.play(move_sound)
+    else:
+        pg.mixer.Sound.play(capture_sound)
 
 
 """
-Draw the squares on the board.
+Legal moves keyed by (start square, end square) for the click handler. The board has no
+promotion picker, so a promotion resolves to the queen, which the engine generates first.
 """
 
 
-def draw_board(board_screen):
-    global colors
-    colors = [pg.Color("light gray"), pg.Color("dark gray")]
-    for row in range(C.DIMENSION):
-        for column in range(C.DIMENSION):
-            if row % 2 == 0:
-                if column % 2 == 0:
-                    # draw white
-                    pg.draw.rect(board_screen, colors[0], [column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                           C.SQUARE_SIZE, C.SQUARE_SIZE])
-                else:
-                    # draw black
-                    pg.draw.rect(board_screen, colors[1], [column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                           C.SQUARE_SIZE, C.SQUARE_SIZE])
-            else:
-                if column % 2 == 0:
-                    # draw black
-                    pg.draw.rect(board_screen, colors[1], [column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                           C.SQUARE_SIZE, C.SQUARE_SIZE])
-                else:
-                    # draw white
-                    pg.draw.rect(board_screen, colors[0], [column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                           C.SQUARE_SIZE, C.SQUARE_SIZE])
-
-
-"""
-Draw the pieces on the board using the current Game.board
-"""
-
-
-def draw_pieces(board_screen, board):
-    for row in range(C.DIMENSION):
-        for column in range(C.DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                board_screen.blit(C.IMAGES[piece], pg.Rect(column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                           C.SQUARE_SIZE, C.SQUARE_SIZE))
-
-
-"""
-Animating a move
-"""
-
-
-def animate_move(move, board_screen, board, clock):
-    global colors
-    delta_row = move.end_row - move.start_row
-    delta_column = move.end_column - move.start_column
-    frames_per_square = 5
-    frame_count = (abs(delta_row) + abs(delta_column)) * frames_per_square
-    for frame in range(frame_count + 1):
-        row, column = ((move.start_row + delta_row * frame/frame_count,
-                       move.start_column + delta_column * frame/frame_count))
-        draw_board(board_screen)
-        draw_pieces(board_screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_column) % 2]
-        end_square = pg.Rect(move.end_column * C.SQUARE_SIZE, move.end_row * C.SQUARE_SIZE,
-                             C.SQUARE_SIZE, C.SQUARE_SIZE)
-        pg.draw.rect(board_screen, color, end_square)
-
-        # draw captured piece onto the rectangle
-        if move.piece_captured != "--" and not move.is_en_passant:
-            board_screen.blit(C.IMAGES[move.piece_captured], end_square)
-        # draw moving piece
-        board_screen.blit(C.IMAGES[move.piece_moved], pg.Rect(column * C.SQUARE_SIZE, row * C.SQUARE_SIZE,
-                                                              C.SQUARE_SIZE, C.SQUARE_SIZE))
-        pg.display.flip()
-        clock.tick(C.FPS)
-
-
-def draw_text(board_screen, text):
-    font = pg.font.SysFont("Adobe Arabic", 64, True, False)
-    text_object = font.render(text, 0, pg.Color('purple'))
-    text_location = pg.Rect(0, 0, C.BOARD_WIDTH, C.BOARD_HEIGHT)\
-        .move(C.BOARD_WIDTH/2 - text_object.get_width()/2, C.BOARD_HEIGHT/2 - text_object.get_height()/2)
-    board_screen.blit(text_object, text_location)
+def index_moves(valid_moves):
+    moves_by_squares = {}
+    for move in valid_moves:
+        moves_by_squares.setdefault(((move.start_row, move.start_column), (move.end_row, move.end_column)), move)
+    return moves_by_squares
 
 
 if __name__ == "__main__":